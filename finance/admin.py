@@ -1,19 +1,22 @@
 from django.contrib import admin
 from .models import Account, CreditCard, Category, Tag, Transaction, Invoice, CardCharge, InvoicePayment, RecurringTransaction, RecurringCardPurchase
+from .models import InstallmentPlan
 
 # Register your models here.
 @admin.register(Account)
 class AccountAdmin(admin.ModelAdmin):
-    list_display = ("name", "type", "user", "active")
+    list_display = ("name", "type", "user", "active", "income_total", "outcome_total")
     list_filter = ("type", "active")
     search_fields = ("name", "user__username")
+    readonly_fields = ("income_total", "outcome_total")
 
 
 @admin.register(CreditCard)
 class CreditCardAdmin(admin.ModelAdmin):
-    list_display = ("name", "brand", "closing_day", "due_day", "user", "active")
+    list_display = ("name", "brand", "limit", "committed_amount", "closing_day", "due_day", "user", "active")
     list_filter = ("active",)
     search_fields = ("name", "brand", "user__username")
+    readonly_fields = ("committed_amount",)
 
 
 @admin.register(Category)
@@ -39,9 +42,10 @@ class TransactionAdmin(admin.ModelAdmin):
 
 @admin.register(Invoice)
 class InvoiceAdmin(admin.ModelAdmin):
-    list_display = ("card", "year", "month", "status", "closing_date", "due_date")
+    list_display = ("card", "year", "month", "status", "closing_date", "due_date", "charges_total", "payments_total")
     list_filter = ("status", "card")
     search_fields = ("card__name",)
+    readonly_fields = ("charges_total", "payments_total")
 
 
 @admin.register(CardCharge)
@@ -52,6 +56,14 @@ class CardChargeAdmin(admin.ModelAdmin):
     date_hierarchy = "date"
 
 
+@admin.register(InstallmentPlan)
+class InstallmentPlanAdmin(admin.ModelAdmin):
+    list_display = ("start_date", "description", "card", "installments_total", "total_amount")
+    list_filter = ("card",)
+    search_fields = ("description", "card__name")
+    date_hierarchy = "start_date"
+
+
 @admin.register(InvoicePayment)
 class InvoicePaymentAdmin(admin.ModelAdmin):
     list_display = ("date", "invoice", "account", "amount", "kind")
@@ -0,0 +1,156 @@
+from decimal import Decimal
+
+from django.db.models import DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Account, CardCharge, CategoryClosure, CreditCard, Invoice, MonthlyRollup, Transaction
+
+
+ZERO = Decimal("0")
+
+
+def _rollup_sum(tx_type, month):
+    cond = Q(rollups__type=tx_type, rollups__year=month.year, rollups__month=month.month)
+    return Coalesce(
+        Sum("rollups__total", filter=cond),
+        Value(ZERO),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    )
+
+
+def account_summaries(user, month_start, next_month_start):
+    """Saldos por conta e totais do mês/próximo mês em uma única consulta agrupada.
+
+    Os totais de todo o histórico vêm dos campos mantidos em Account e os do
+    mês e do próximo mês vêm dos consolidados mensais (MonthlyRollup).
+    """
+    IN = Transaction.TxType.INCOME
+    OUT = Transaction.TxType.OUTCOME
+    accounts = (
+        Account.objects.filter(user=user)
+        .annotate(
+            month_income=_rollup_sum(IN, month_start),
+            month_outcome=_rollup_sum(OUT, month_start),
+            next_month_income=_rollup_sum(IN, next_month_start),
+            next_month_outcome=_rollup_sum(OUT, next_month_start),
+        )
+        .order_by("name")
+    )
+
+    account_balances = []
+    totals = {
+        "month_income_total": ZERO,
+        "month_outcome_total": ZERO,
+        "next_month_income_total": ZERO,
+        "next_month_outcome_total": ZERO,
+    }
+    for acc in accounts:
+        # Totais do mês consideram todas as contas (inclusive inativas)
+        totals["month_income_total"] += acc.month_income
+        totals["month_outcome_total"] += acc.month_outcome
+        totals["next_month_income_total"] += acc.next_month_income
+        totals["next_month_outcome_total"] += acc.next_month_outcome
+        if not acc.active:
+            continue
+        account_balances.append({
+            "account": acc,
+            "balance": acc.balance(),
+            "initial_balance": Decimal(acc.initial_balance),
+            "total_income": acc.income_total,
+            "total_outcome": acc.outcome_total,
+            "month_income": acc.month_income,
+            "month_outcome": acc.month_outcome,
+        })
+    return {"account_balances": account_balances, **totals}
+
+
+def card_invoice_summaries(user):
+    """Totais de faturas por cartão ativo, lidos dos totais armazenados em Invoice."""
+    cards = list(CreditCard.objects.filter(user=user, active=True).order_by("name"))
+    status_field = {
+        Invoice.Status.OPEN: "open_total",
+        Invoice.Status.CLOSED: "closed_total",
+        Invoice.Status.PAID: "paid_total",
+        Invoice.Status.PARTIAL: "partial_total",
+    }
+    summaries = {}
+    for card in cards:
+        summaries[card.pk] = {
+            "card": card,
+            "open_total": ZERO,
+            "closed_total": ZERO,
+            "paid_total": ZERO,
+            "partial_total": ZERO,
+            "total_charges": ZERO,
+            "total_payments": ZERO,
+            "balance": ZERO,
+        }
+    if not cards:
+        return []
+
+    totals = (
+        Invoice.objects.filter(card__user=user, card__active=True)
+        .values("card_id", "status")
+        .annotate(charges=Sum("charges_total"), payments=Sum("payments_total"))
+        .order_by()
+    )
+    for row in totals:
+        item = summaries[row["card_id"]]
+        item[status_field[row["status"]]] += row["charges"] or ZERO
+        item["total_charges"] += row["charges"] or ZERO
+        item["total_payments"] += row["payments"] or ZERO
+
+    for item in summaries.values():
+        item["balance"] = item["total_charges"] - item["total_payments"]
+    return [summaries[card.pk] for card in cards]
+
+
+def unpaid_invoices_total(user, start, end):
+    """Saldo das faturas não pagas com vencimento no período."""
+    agg = (
+        Invoice.objects.filter(card__user=user, due_date__gte=start, due_date__lte=end)
+        .exclude(status=Invoice.Status.PAID)
+        .aggregate(s=Sum(F("charges_total") - F("payments_total")))
+    )
+    return agg["s"] or ZERO
+
+
+def expenses_by_category(user, month_start, source="account", by_parent=False):
+    """Despesas do mês agrupadas por categoria no banco, como pares (categoria, total).
+
+    source="account" considera saídas em contas e source="card" as compras no
+    cartão. Com by_parent=True as subcategorias são somadas à categoria raiz.
+    """
+    rows = MonthlyRollup.objects.filter(user=user, year=month_start.year, month=month_start.month)
+    if source == "card":
+        rows = rows.filter(type=MonthlyRollup.Type.CARD)
+    else:
+        rows = rows.filter(type=MonthlyRollup.Type.OUTCOME, account__isnull=False)
+    if by_parent:
+        # Categoria raiz = ancestral mais distante na tabela de fechamento
+        root = (
+            CategoryClosure.objects.filter(descendant_id=OuterRef("category_id"))
+            .order_by("-depth").values("ancestor__name")[:1]
+        )
+        name = Coalesce(Subquery(root), Value("Sem categoria"))
+    else:
+        name = Coalesce("category__name", Value("Sem categoria"))
+    grouped = (
+        rows.values(name=name)
+        .annotate(s=Sum("total"))
+        .filter(s__gt=0)
+        .order_by("-s", "name")
+    )
+    return [(row["name"], row["s"]) for row in grouped]
+
+
+def category_subtree_total(user, category, start, end, source="account"):
+    """Total gasto na categoria e em todas as suas subcategorias no período."""
+    if source == "card":
+        qs = CardCharge.objects.filter(card__user=user)
+        field = "total_amount"
+    else:
+        qs = Transaction.objects.filter(user=user, type=Transaction.TxType.OUTCOME)
+        field = "amount"
+    qs = qs.filter(category__ancestor_links__ancestor=category, date__gte=start, date__lte=end)
+    return qs.aggregate(s=Sum(field))["s"] or ZERO
@@ -0,0 +1,119 @@
+"""Série histórica de saldos diários por conta.
+
+O banco acumula as somas diárias com uma função de janela; o Python só
+preenche os dias sem movimento repetindo o último saldo. Também calcula o
+saldo corrente exibido em cada linha de uma página do extrato.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When, Window
+from django.db.models.functions import Coalesce
+
+from .invoice_calendar import add_months
+from .models import Account, MonthlyRollup, Transaction
+
+
+ZERO = Decimal("0")
+
+
+def _signed_amount(field="amount"):
+    # Como Account.balance(): só entradas e saídas movem o saldo; transferências valem zero
+    return Case(
+        When(type=Transaction.TxType.INCOME, then=F(field)),
+        When(type=Transaction.TxType.OUTCOME, then=-F(field)),
+        default=Value(ZERO),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    )
+
+
+def daily_balances(user, start, end, accounts=None):
+    """Saldo ao fim de cada dia entre start e end (inclusive), por conta e consolidado.
+
+    São duas consultas: o saldo de abertura de cada conta (saldo inicial mais
+    tudo antes de start) e as somas diárias do período acumuladas por janela.
+    """
+    qs = Account.objects.filter(user=user)
+    if accounts is not None:
+        qs = qs.filter(pk__in=[getattr(a, "pk", a) for a in accounts])
+    accounts = list(
+        qs.annotate(
+            before=Coalesce(
+                Sum("transactions__amount", filter=Q(transactions__date__lt=start, transactions__type=Transaction.TxType.INCOME)),
+                Value(ZERO),
+            ) - Coalesce(
+                Sum("transactions__amount", filter=Q(transactions__date__lt=start, transactions__type=Transaction.TxType.OUTCOME)),
+                Value(ZERO),
+            ),
+        ).order_by("name")
+    )
+    opening = {acc.pk: Decimal(acc.initial_balance or 0) + acc.before for acc in accounts}
+
+    # Com o quadro padrão (RANGE até a linha atual) os lançamentos do mesmo dia são
+    # pares: todos recebem o acumulado do fim do dia e o DISTINCT deixa uma linha por dia
+    running = (
+        Transaction.objects.filter(account__in=[acc.pk for acc in accounts], date__gte=start, date__lte=end)
+        .annotate(running=Window(Sum(_signed_amount()), partition_by=F("account_id"), order_by=F("date").asc()))
+        .order_by("account_id", "date")
+        .values_list("account_id", "date", "running")
+        .distinct()
+    )
+    changes = {acc.pk: {} for acc in accounts}
+    for account_id, day, total in running:
+        changes[account_id][day] = opening[account_id] + total
+
+    size = (end - start).days + 1
+    days = [start + timedelta(days=i) for i in range(max(size, 0))]
+    series = []
+    for acc in accounts:
+        balance, values = opening[acc.pk], []
+        points = changes[acc.pk]
+        for day in days:
+            balance = points.get(day, balance)
+            values.append(balance)
+        series.append({"id": acc.pk, "name": acc.name, "balances": values})
+    total = [sum(day, ZERO) for day in zip(*(s["balances"] for s in series))] if series else [ZERO] * len(days)
+    return {"start": start, "end": end, "days": days, "accounts": series, "total": total}
+
+
+def balance_before(account, tx):
+    """Saldo da conta logo antes do lançamento tx (na ordem date, id).
+
+    Parte do saldo armazenado e desconta tx e o que veio depois: os meses
+    seguintes pelos consolidados mensais e o restante do próprio mês pelos
+    lançamentos, então o custo não cresce com a profundidade no histórico.
+    """
+    year, month = tx.date.year, tx.date.month
+    later_months = (
+        MonthlyRollup.objects.filter(account=account)
+        .filter(Q(year__gt=year) | Q(year=year, month__gt=month))
+        .aggregate(s=Sum(_signed_amount("total")))["s"] or ZERO
+    )
+    same_month = (
+        Transaction.objects.filter(account=account, date__lt=add_months(date(year, month, 1), 1))
+        .filter(Q(date__gt=tx.date) | Q(date=tx.date, id__gte=tx.pk))
+        .aggregate(s=Sum(_signed_amount()))["s"] or ZERO
+    )
+    # Totais mantidos por F(): a instância recebida pode estar desatualizada
+    account.refresh_from_db(fields=Account.TOTAL_FIELDS)
+    return account.balance() - later_months - same_month
+
+
+def set_running_balances(account, rows):
+    """Define running_balance (saldo da conta após o lançamento) nas linhas de uma página.
+
+    As linhas vêm em ordem (-date, -id), contíguas no histórico da conta. A soma
+    acumulada é uma função de janela em (date, id) restrita às linhas da página,
+    somada ao saldo de abertura antes da linha mais antiga da página.
+    """
+    if not rows:
+        return rows
+    opening = balance_before(account, rows[-1])
+    running = dict(
+        Transaction.objects.filter(pk__in=[tx.pk for tx in rows])
+        .annotate(running=Window(Sum(_signed_amount()), order_by=[F("date").asc(), F("id").asc()]))
+        .values_list("pk", "running")
+    )
+    for tx in rows:
+        tx.running_balance = opening + running[tx.pk]
+    return rows
@@ -0,0 +1,132 @@
+"""Cache por usuário invalidado por versão dos dados.
+
+Cada usuário tem um contador (Profile.data_version) incrementado por
+post_save/post_delete em qualquer modelo do financeiro. As chaves de cache
+incluem essa versão, então uma alteração invalida tudo que foi calculado antes
+sem precisar apagar entradas: as antigas saem pelo limite de tamanho do backend.
+
+O backend é o alias FINANCE_CACHE_ALIAS de settings.CACHES (memória local,
+arquivo ou banco), com MAX_ENTRIES limitando o tamanho.
+"""
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from .models import (
+    Account, CardCharge, Category, CreditCard, InstallmentPlan, Invoice, InvoicePayment, Profile,
+    RecurringCardPurchase, RecurringTransaction, Tag, Transaction, propagation_deferred,
+)
+
+
+VERSIONED_MODELS = (
+    Account, CreditCard, Category, Tag, Transaction, Invoice, CardCharge, InstallmentPlan, InvoicePayment,
+    RecurringTransaction, RecurringCardPurchase,
+)
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def get_cache():
+    alias = getattr(settings, "FINANCE_CACHE_ALIAS", "finance")
+    if alias not in settings.CACHES:
+        alias = "default"
+    return caches[alias]
+
+
+def _version_key(user_id):
+    return f"finance:version:{user_id}"
+
+
+def data_version(user_id):
+    cache = get_cache()
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        profile, _ = Profile.objects.get_or_create(user_id=user_id)
+        version = profile.data_version
+        cache.set(_version_key(user_id), version)
+    return version
+
+
+def bump_version(user_id):
+    if not user_id:
+        return
+    # Sem perfil ainda não há nada cacheado: data_version() o cria na primeira leitura
+    Profile.objects.filter(user_id=user_id).update(data_version=F("data_version") + 1)
+    # Descarta a versão em cache agora e de novo após o commit: uma leitura concorrente
+    # antes do commit ainda veria (e cachearia) a versão antiga
+    get_cache().delete(_version_key(user_id))
+    db_transaction.on_commit(lambda: get_cache().delete(_version_key(user_id)))
+
+
+def bump_versions(user_ids):
+    """bump_version para vários usuários com um único UPDATE (rotinas em lote)."""
+    user_ids = {pk for pk in user_ids if pk}
+    if not user_ids:
+        return
+    Profile.objects.filter(user_id__in=user_ids).update(data_version=F("data_version") + 1)
+    keys = [_version_key(pk) for pk in user_ids]
+    get_cache().delete_many(keys)
+    db_transaction.on_commit(lambda: get_cache().delete_many(keys))
+
+
+def cached(user, namespace, params, compute):
+    """Retorna compute() cacheado sob (usuário, versão dos dados, namespace, params)."""
+    digest = hashlib.sha1(repr(sorted(params.items())).encode()).hexdigest()
+    key = f"finance:{user.pk}:v{data_version(user.pk)}:{namespace}:{digest}"
+    cache = get_cache()
+    value = cache.get(key)
+    with _stats_lock:
+        _stats["hits" if value is not None else "misses"] += 1
+    if value is None:
+        value = compute()
+        cache.set(key, value)
+    return value
+
+
+def stats():
+    with _stats_lock:
+        hits, misses = _stats["hits"], _stats["misses"]
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": (hits / total) if total else 0.0}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats["hits"] = _stats["misses"] = 0
+
+
+def owner_id(instance):
+    if isinstance(instance, (CardCharge, Invoice, InstallmentPlan)):
+        return instance.card.user_id
+    if isinstance(instance, InvoicePayment):
+        return instance.invoice.card.user_id
+    return getattr(instance, "user_id", None)
+
+
+def _bump_for_instance(sender, instance, **kwargs):
+    if sender not in VERSIONED_MODELS or propagation_deferred():
+        return
+    try:
+        user_id = owner_id(instance)
+    except Exception:
+        # Objeto relacionado já removido (exclusão em cascata do dono)
+        return
+    bump_version(user_id)
+
+
+def _bump_for_tags(sender, instance, action, **kwargs):
+    if action.startswith("post_"):
+        _bump_for_instance(type(instance), instance)
+
+
+def connect_signals():
+    post_save.connect(_bump_for_instance, dispatch_uid="finance_cache_post_save")
+    post_delete.connect(_bump_for_instance, dispatch_uid="finance_cache_post_delete")
+    for through in (Transaction.tags.through, CardCharge.tags.through):
+        m2m_changed.connect(_bump_for_tags, sender=through, dispatch_uid=f"finance_cache_{through.__name__}")
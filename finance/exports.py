@@ -0,0 +1,93 @@
+"""Exportação do extrato em CSV e OFX por streaming.
+
+As linhas são lidas com iterator(chunk_size=...), que também busca as tags de
+cada bloco em uma única consulta, e escritas à medida que a resposta é enviada:
+o uso de memória não depende do tamanho do extrato.
+"""
+import csv
+from datetime import date
+
+from django.utils import timezone
+
+
+CHUNK_SIZE = 2000
+
+CSV_HEADER = ["Data", "Conta", "Descrição", "Tipo", "Categoria", "Tags", "Valor", "Conciliado"]
+
+
+class Echo:
+    """Pseudo-buffer para o csv.writer: devolve a linha em vez de armazená-la."""
+
+    def write(self, value):
+        return value
+
+
+def iter_transactions(queryset, chunk_size=CHUNK_SIZE):
+    qs = queryset.select_related("account", "category").prefetch_related("tags").order_by("-date", "-id")
+    return qs.iterator(chunk_size=chunk_size)
+
+
+def stream_csv(queryset, chunk_size=CHUNK_SIZE):
+    writer = csv.writer(Echo())
+    yield "\ufeff"  # BOM para o Excel reconhecer UTF-8
+    yield writer.writerow(CSV_HEADER)
+    for tx in iter_transactions(queryset, chunk_size):
+        yield writer.writerow([
+            tx.date.isoformat(),
+            tx.account.name,
+            tx.description,
+            tx.get_type_display(),
+            tx.category.name if tx.category else "",
+            ", ".join(t.name for t in tx.tags.all()),
+            tx.amount,
+            "Sim" if tx.reconciled else "Não",
+        ])
+
+
+def _ofx_text(value):
+    return str(value).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _ofx_date(value):
+    return value.strftime("%Y%m%d")
+
+
+def _ofx_type(tx, amount):
+    # Pernas de transferência (e lançamentos TRX, que não movem o saldo) saem como XFER
+    if tx.transfer_key or tx.type == "TRX":
+        return "XFER"
+    return "CREDIT" if amount > 0 else "DEBIT"
+
+
+def stream_ofx(queryset, account, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """OFX 1.02 (SGML) com um STMTTRN por lançamento da conta.
+
+    TRNAMT usa o mesmo sinal de Account.balance(), então o saldo inicial mais a
+    soma dos lançamentos exportados fecha com o LEDGERBAL do arquivo.
+    """
+    now = timezone.localtime().strftime("%Y%m%d%H%M%S")
+    start = start or date(1970, 1, 1)
+    end = end or timezone.localdate()
+    yield (
+        "OFXHEADER:100\r\nDATA:OFXSGML\r\nVERSION:102\r\nSECURITY:NONE\r\nENCODING:UTF-8\r\n"
+        "CHARSET:NONE\r\nCOMPRESSION:NONE\r\nOLDFILEUID:NONE\r\nNEWFILEUID:NONE\r\n\r\n"
+        "<OFX>\r\n<SIGNONMSGSRSV1><SONRS><STATUS><CODE>0<SEVERITY>INFO</STATUS>"
+        f"<DTSERVER>{now}<LANGUAGE>POR</SONRS></SIGNONMSGSRSV1>\r\n"
+        "<BANKMSGSRSV1><STMTTRNRS><TRNUID>1<STATUS><CODE>0<SEVERITY>INFO</STATUS>\r\n"
+        f"<STMTRS><CURDEF>{account.currency}<BANKACCTFROM><BANKID>0<ACCTID>{account.pk}<ACCTTYPE>CHECKING</BANKACCTFROM>\r\n"
+        f"<BANKTRANLIST><DTSTART>{_ofx_date(start)}<DTEND>{_ofx_date(end)}\r\n"
+    )
+    for tx in iter_transactions(queryset, chunk_size):
+        amount = tx.signed_amount()
+        memo = ", ".join(t.name for t in tx.tags.all())
+        yield (
+            f"<STMTTRN><TRNTYPE>{_ofx_type(tx, amount)}<DTPOSTED>{_ofx_date(tx.date)}"
+            f"<TRNAMT>{amount}<FITID>{tx.pk}"
+            f"<NAME>{_ofx_text(tx.description[:32])}"
+            + (f"<MEMO>{_ofx_text(memo)}" if memo else "")
+            + "</STMTTRN>\r\n"
+        )
+    yield (
+        f"</BANKTRANLIST><LEDGERBAL><BALAMT>{account.balance()}<DTASOF>{now}</LEDGERBAL>"
+        "</STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\r\n"
+    )
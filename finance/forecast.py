@@ -0,0 +1,116 @@
+"""Projeção diária de saldos (fluxo de caixa) para os próximos meses.
+
+As recorrências são expandidas virtualmente (rrule), sem criar lançamentos, e as
+faturas não pagas entram no dia do vencimento. Cada série é um vetor de
+variações diárias acumulado uma única vez no final.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.db.models import Sum
+
+from .invoice_calendar import add_months, following, period_for
+from .models import Account, Invoice, RecurringCardPurchase, RecurringTransaction, Transaction
+from .purchases import split_installments
+
+
+ZERO = Decimal("0")
+MAX_MONTHS = 36
+
+
+def project_cash_flow(user, months=12, start=None):
+    """Saldo projetado dia a dia de cada conta ativa, de start até start + months.
+
+    Retorna um dicionário com os dias, as séries por conta, a série de saídas
+    acumuladas das faturas de cartão e o total consolidado.
+    """
+    start = start or date.today()
+    end = add_months(start, months)
+    size = (end - start).days + 1
+
+    def index(d):
+        # Valores atrasados entram no primeiro dia da projeção
+        return max((d - start).days, 0)
+
+    accounts = list(Account.objects.filter(user=user, active=True).order_by("name"))
+    opening = {acc.pk: acc.balance() for acc in accounts}
+    deltas = {acc.pk: [ZERO] * size for acc in accounts}
+    invoice_deltas = [ZERO] * size
+
+    # Como Account.balance(), só entradas e saídas movem o saldo; transferências ficam de fora
+    moving = [Transaction.TxType.INCOME, Transaction.TxType.OUTCOME]
+
+    # Lançamentos já gravados com data futura: saem do saldo inicial e entram no dia
+    future = (
+        Transaction.objects.filter(user=user, account__in=accounts, date__gt=start, type__in=moving)
+        .values("account_id", "type", "date").annotate(s=Sum("amount")).order_by()
+    )
+    for row in future:
+        value = row["s"] if row["type"] == Transaction.TxType.INCOME else -row["s"]
+        opening[row["account_id"]] -= value
+        if row["date"] <= end:
+            deltas[row["account_id"]][index(row["date"])] += value
+
+    recurring = RecurringTransaction.objects.filter(user=user, active=True, account__in=accounts, type__in=moving)
+    for rec in recurring:
+        value = rec.amount if rec.type == Transaction.TxType.INCOME else -rec.amount
+        series = deltas[rec.account_id]
+        for when in rec.pending(end):
+            series[index(when)] += value
+
+    unpaid = (
+        Invoice.objects.filter(card__user=user, due_date__isnull=False, due_date__lte=end)
+        .exclude(status=Invoice.Status.PAID)
+        .values_list("due_date", "charges_total", "payments_total")
+    )
+    for due_date, charges, payments in unpaid:
+        if charges > payments:
+            invoice_deltas[index(due_date)] -= charges - payments
+
+    closed = set(
+        Invoice.objects.filter(card__user=user, status=Invoice.Status.CLOSED)
+        .values_list("card_id", "year", "month")
+    )
+    purchases = RecurringCardPurchase.objects.filter(user=user, active=True).select_related("card")
+    for rec in purchases:
+        card = rec.card
+        # Mesma divisão das compras gravadas (a sobra dos centavos fica na 1ª parcela)
+        amounts = split_installments(rec.total_amount, rec.installments_total)
+        for when in rec.pending(end):
+            for i, amount in enumerate(amounts):
+                target = period_for(card, add_months(when, i))
+                if (card.pk, target.year, target.month) in closed:
+                    target = following(card, target)
+                if target.due_date <= end:
+                    invoice_deltas[index(target.due_date)] -= amount
+
+    series = [
+        {"id": acc.pk, "name": acc.name, "balances": list(accumulate(deltas[acc.pk], initial=opening[acc.pk]))[1:]}
+        for acc in accounts
+    ]
+    invoices = list(accumulate(invoice_deltas))
+    total = [sum(day) for day in zip(invoices, *(s["balances"] for s in series))]
+    return {
+        "start": start,
+        "end": end,
+        "days": [start + timedelta(days=i) for i in range(size)],
+        "accounts": series,
+        "invoices": invoices,
+        "total": total,
+    }
+
+
+def month_end_rows(forecast):
+    """Linhas (data, saldos por conta, faturas, total) no último dia de cada mês projetado."""
+    days = forecast["days"]
+    rows = []
+    for i, day in enumerate(days):
+        if i == len(days) - 1 or days[i + 1].month != day.month:
+            rows.append({
+                "date": day,
+                "balances": [s["balances"][i] for s in forecast["accounts"]],
+                "invoices": forecast["invoices"][i],
+                "total": forecast["total"][i],
+            })
+    return rows
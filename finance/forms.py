@@ -1,6 +1,8 @@
 from django import forms
 from django.contrib.auth.models import User
 from .models import Transaction, Account, Category, CreditCard, Invoice, Tag, RecurringTransaction, RecurringCardPurchase, CardCharge
+from .models import InstallmentPlan
+from .search import filter_by_description, search_terms
 
 class TransactionForm(forms.ModelForm):
     class Meta:
@@ -62,6 +64,20 @@ class CardChargeForm(forms.ModelForm):
             self.fields["category"].queryset = Category.objects.filter(user=user, kind=Category.Kind.EXPENSE)
 
 
+class InstallmentPlanForm(forms.ModelForm):
+    class Meta:
+        model = InstallmentPlan
+        fields = ["card", "start_date", "description", "total_amount", "category"]
+        widgets = {"start_date": forms.DateInput(attrs={"type": "date"})}
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop("user", None)
+        super().__init__(*args, **kwargs)
+        if user is not None:
+            self.fields["card"].queryset = CreditCard.objects.filter(user=user, active=True)
+            self.fields["category"].queryset = Category.objects.filter(user=user, kind=Category.Kind.EXPENSE)
+
+
 class StatementFilterForm(forms.Form):
     account = forms.ModelChoiceField(queryset=Account.objects.none(), label="Conta")
     start_date = forms.DateField(label="De", required=False, widget=forms.DateInput(attrs={"type": "date"}))
@@ -70,6 +86,8 @@ class StatementFilterForm(forms.Form):
     category = forms.ModelChoiceField(queryset=Category.objects.none(), required=False)
     tag = forms.ModelChoiceField(queryset=Tag.objects.none(), required=False)
     reconciled = forms.ChoiceField(choices=(("", "Todos"), ("1", "Conciliado"), ("0", "Não conciliado")), required=False)
+    q = forms.CharField(label="Buscar", required=False, max_length=200)
+    projected = forms.BooleanField(label="Incluir projeções das recorrências", required=False)
 
     def __init__(self, *args, **kwargs):
         user = kwargs.pop("user", None)
@@ -80,13 +98,66 @@ class StatementFilterForm(forms.Form):
             self.fields["tag"].queryset = Tag.objects.filter(user=user)
             self.fields["category"].queryset = Category.objects.filter(user=user)
 
+    def shows_running_balance(self):
+        """Saldo corrente só faz sentido quando nenhum filtro remove lançamentos da conta."""
+        data = self.cleaned_data
+        return bool(data.get("account")) and not any(
+            data.get(name) for name in ("type", "category", "tag", "reconciled", "q")
+        )
+
+    def filter_queryset(self, qs):
+        """Aplica os filtros validados a um queryset de Transaction (extrato e exportação)."""
+        account = self.cleaned_data.get("account")
+        start_date = self.cleaned_data.get("start_date")
+        end_date = self.cleaned_data.get("end_date")
+        typ = self.cleaned_data.get("type")
+        category = self.cleaned_data.get("category")
+        tag = self.cleaned_data.get("tag")
+        reconciled = self.cleaned_data.get("reconciled")
+        if account:
+            qs = qs.filter(account=account)
+        if start_date:
+            qs = qs.filter(date__gte=start_date)
+        if end_date:
+            qs = qs.filter(date__lte=end_date)
+        if typ:
+            qs = qs.filter(type=typ)
+        if category:
+            # Inclui as subcategorias (tabela de fechamento)
+            qs = qs.filter(category__ancestor_links__ancestor=category)
+        if tag:
+            qs = qs.filter(tags=tag)
+        if reconciled == '1':
+            qs = qs.filter(reconciled=True)
+        elif reconciled == '0':
+            qs = qs.filter(reconciled=False)
+        if self.cleaned_data.get("q"):
+            qs = filter_by_description(qs, self.cleaned_data["q"])
+        return qs
+
+    def filter_schedules(self, qs):
+        """Aplica os mesmos filtros às recorrências cujas ocorrências serão projetadas."""
+        data = self.cleaned_data
+        # Projeções não têm tags nem estão conciliadas
+        if data.get("tag") or data.get("reconciled") == "1":
+            return qs.none()
+        if data.get("account"):
+            qs = qs.filter(account=data["account"])
+        if data.get("type"):
+            qs = qs.filter(type=data["type"])
+        if data.get("category"):
+            qs = qs.filter(category__ancestor_links__ancestor=data["category"])
+        for term in search_terms(data.get("q")):
+            qs = qs.filter(description__icontains=term)
+        return qs
+
 
 class RecurringTransactionForm(forms.ModelForm):
     class Meta:
         model = RecurringTransaction
         fields = [
             "account", "type", "description", "amount", "category",
-            "frequency", "day_of_month", "start_date", "next_date", "active", "end_date",
+            "frequency", "interval", "day_of_month", "start_date", "next_date", "count", "active", "end_date",
         ]
 
     def __init__(self, *args, **kwargs):
@@ -102,7 +173,7 @@ class RecurringCardPurchaseForm(forms.ModelForm):
         model = RecurringCardPurchase
         fields = [
             "card", "description", "total_amount", "installments_total", "category",
-            "frequency", "day_of_month", "next_date", "active", "end_date",
+            "frequency", "interval", "day_of_month", "next_date", "count", "active", "end_date",
         ]
 
     def __init__(self, *args, **kwargs):
@@ -0,0 +1,58 @@
+"""Calendário das faturas de cartão: regras puras, sem acesso ao banco.
+
+Uma compra feita no dia do fechamento (ou depois) vai para a fatura do mês
+seguinte; o vencimento cai no mesmo mês do fechamento quando closing_day <=
+due_day e no mês seguinte caso contrário. Os resultados são memorizados por
+configuração do cartão (closing_day, due_day), não pela instância.
+"""
+import calendar
+from collections import namedtuple
+from datetime import date
+from functools import lru_cache
+
+
+InvoicePeriod = namedtuple("InvoicePeriod", "year month closing_date due_date")
+
+
+def add_months(d, months, day=None):
+    """Soma meses a uma data, limitando o dia ao último dia do mês de destino."""
+    index = d.month - 1 + months
+    y, m = d.year + index // 12, index % 12 + 1
+    return date(y, m, min(day or d.day, calendar.monthrange(y, m)[1]))
+
+
+def next_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+@lru_cache(maxsize=4096)
+def _period(closing_day, due_day, year, month):
+    vy, vm = (year, month) if closing_day <= due_day else next_month(year, month)
+    return InvoicePeriod(year, month, date(year, month, min(closing_day, 28)), date(vy, vm, min(due_day, 28)))
+
+
+@lru_cache(maxsize=4096)
+def _period_for(closing_day, due_day, purchase_date):
+    y, m = purchase_date.year, purchase_date.month
+    if purchase_date.day >= min(closing_day, calendar.monthrange(y, m)[1]):
+        y, m = next_month(y, m)
+    return _period(closing_day, due_day, y, m)
+
+
+def period(card, year, month):
+    """Datas de fechamento e vencimento da fatura (year, month) do cartão."""
+    return _period(card.closing_day, card.due_day, year, month)
+
+
+def period_for(card, purchase_date):
+    """Fatura que recebe uma compra feita em purchase_date (sem considerar faturas fechadas)."""
+    return _period_for(card.closing_day, card.due_day, purchase_date)
+
+
+def following(card, current):
+    """Fatura seguinte a current; é para onde vão as compras quando current está fechada."""
+    return period(card, *next_month(current.year, current.month))
+
+
+def cache_info():
+    return {"period": _period.cache_info(), "period_for": _period_for.cache_info()}
@@ -0,0 +1,139 @@
+"""Ciclo de vida das faturas: quitação e fechamento.
+
+A regra de quitação fica em um só lugar. settle() lê compras, pagamentos e
+status em uma consulta e grava só o status; settle_invoices() aplica a mesma
+regra a todas as faturas de um usuário ou cartão com um único UPDATE.
+close_due_invoices() fecha de uma vez as faturas cujo fechamento já chegou.
+"""
+from datetime import date
+
+from django.db import transaction as db_transaction
+from django.db.models import Case, F, Q, Value, When
+
+from . import invoice_calendar
+from .cache import bump_versions
+from .models import CreditCard, Invoice
+from .purchases import resolve_card_invoices
+
+
+def settled_status(status, charges, payments):
+    """Status da fatura depois de uma mudança em compras ou pagamentos."""
+    if payments > 0:
+        return Invoice.Status.PAID if charges - payments <= 0 else Invoice.Status.PARTIAL
+    # Sem pagamentos: volta a aberta se estava paga; aberta/fechada continuam como estão
+    if status in (Invoice.Status.PAID, Invoice.Status.PARTIAL):
+        return Invoice.Status.OPEN
+    return status
+
+
+def settle(invoice):
+    """Recalcula e grava (update_fields) o status da fatura; retorna o novo status."""
+    status, charges, payments = (
+        Invoice.objects.filter(pk=invoice.pk).values_list("status", *Invoice.TOTAL_FIELDS).get()
+    )
+    invoice.charges_total, invoice.payments_total = charges, payments
+    invoice.status = settled_status(status, charges, payments)
+    if invoice.status != status:
+        invoice.save(update_fields=["status"])
+    return invoice.status
+
+
+def settled_status_expression():
+    """settled_status como expressão SQL, para atualizar várias faturas de uma vez."""
+    return Case(
+        When(payments_total__gt=0, charges_total__lte=F("payments_total"), then=Value(Invoice.Status.PAID)),
+        When(payments_total__gt=0, then=Value(Invoice.Status.PARTIAL)),
+        When(status__in=[Invoice.Status.PAID, Invoice.Status.PARTIAL], then=Value(Invoice.Status.OPEN)),
+        default=F("status"),
+    )
+
+
+def settle_invoices(user=None, card=None, refresh_totals=False):
+    """Recalcula o status de todas as faturas do usuário e/ou cartão (todas, se nenhum).
+
+    Com refresh_totals, os totais de compras e pagamentos (e o comprometido dos
+    cartões) são antes recalculados a partir do histórico, como após uma importação.
+    Retorna a quantidade de faturas cujo status mudou.
+    """
+    invoices = Invoice.objects.all()
+    cards = CreditCard.objects.all()
+    if user is not None:
+        invoices, cards = invoices.filter(card__user=user), cards.filter(user=user)
+    if card is not None:
+        invoices, cards = invoices.filter(card=card), cards.filter(pk=card.pk)
+    if refresh_totals:
+        Invoice.refresh_totals(invoices)
+        CreditCard.refresh_committed(cards)
+    status = settled_status_expression()
+    changed = invoices.annotate(settled=status).exclude(status=F("settled"))
+    user_ids = set(changed.values_list("card__user_id", flat=True))
+    updated = Invoice.objects.filter(pk__in=changed.values("pk")).update(status=status)
+    # update() não dispara os sinais que invalidam o cache
+    bump_versions(user_ids)
+    return updated
+
+
+def close_due_invoices(today=None, user=None):
+    """Fecha as faturas abertas/parciais com fechamento até today e projeta as próximas.
+
+    Tudo em uma transação curta: um UPDATE fecha as faturas vencidas e a
+    próxima fatura de cada cartão ativo (a primeira com fechamento depois de
+    today) é criada em lote se ainda não existir, tenha o cartão fechado fatura
+    agora ou não. Pode ser chamada pelo comando close_invoices ou por um
+    agendador no próprio processo; rodar de novo no mesmo dia não altera nada.
+    Retorna {"closed": faturas fechadas, "cards": cartões com faturas fechadas,
+    "opened": próximas faturas criadas}.
+    """
+    today = today or date.today()
+    pending = Invoice.objects.filter(status__in=[Invoice.Status.OPEN, Invoice.Status.PARTIAL])
+    cards = CreditCard.objects.filter(active=True)
+    if user is not None:
+        pending = pending.filter(card__user=user)
+        cards = cards.filter(user=user)
+
+    with db_transaction.atomic():
+        # Faturas antigas podem não ter as datas gravadas; InvoiceCloseView as preenche ao fechar
+        undated = list(
+            pending.filter(Q(closing_date__isnull=True) | Q(due_date__isnull=True))
+            .select_related("card").select_for_update()
+        )
+        for inv in undated:
+            period = invoice_calendar.period(inv.card, inv.year, inv.month)
+            inv.closing_date = inv.closing_date or period.closing_date
+            inv.due_date = inv.due_date or period.due_date
+        Invoice.objects.bulk_update(undated, ["closing_date", "due_date"])
+
+        due = pending.filter(closing_date__lte=today)
+        closed_cards, user_ids = set(), set()
+        for card_id, user_id in due.order_by().values_list("card_id", "card__user_id").distinct():
+            closed_cards.add(card_id)
+            user_ids.add(user_id)
+        closed = due.update(status=Invoice.Status.CLOSED) if closed_cards else 0
+
+        # Próxima fatura de cada cartão ativo: a primeira com fechamento depois de today
+        targets = {}
+        for card in cards.only("user_id", "closing_day", "due_day"):
+            target = invoice_calendar.period_for(card, today)
+            while target.closing_date <= today:
+                target = invoice_calendar.following(card, target)
+            targets[card] = target
+        existing = set()
+        if targets:
+            keys = [(t.year, t.month) for t in targets.values()]
+            (low_y, low_m), (high_y, high_m) = min(keys), max(keys)
+            existing = set(
+                Invoice.objects.filter(
+                    Q(year__gt=low_y) | Q(year=low_y, month__gte=low_m),
+                    Q(year__lt=high_y) | Q(year=high_y, month__lte=high_m),
+                    card__in=targets,
+                ).order_by().values_list("card_id", "year", "month")
+            )
+        periods = {
+            card: {target} for card, target in targets.items()
+            if (card.pk, target.year, target.month) not in existing
+        }
+        resolve_card_invoices(periods)
+        user_ids |= {card.user_id for card in periods}
+        # update()/bulk_create não disparam os sinais que invalidam o cache
+        bump_versions(user_ids)
+    return {"closed": closed, "cards": len(closed_cards), "opened": len(periods)}
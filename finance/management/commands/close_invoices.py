@@ -0,0 +1,36 @@
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from finance.invoices import close_due_invoices
+
+
+class Command(BaseCommand):
+    help = (
+        "Fecha todas as faturas abertas ou parciais cuja data de fechamento já chegou "
+        "e projeta a próxima fatura de cada cartão ativo. Pode ser executado várias vezes por dia."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", help="Data de referência (AAAA-MM-DD); padrão: hoje.")
+        parser.add_argument("--user", help="Processa apenas os cartões deste usuário (username).")
+
+    def handle(self, *args, **options):
+        try:
+            today = date.fromisoformat(options["date"]) if options["date"] else timezone.localdate()
+        except ValueError:
+            raise CommandError(f"Data inválida: {options['date']}")
+        user = None
+        if options["user"]:
+            User = get_user_model()
+            try:
+                user = User.objects.get(username=options["user"])
+            except User.DoesNotExist:
+                raise CommandError(f"Usuário '{options['user']}' não encontrado.")
+        result = close_due_invoices(today, user=user)
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['closed']} fatura(s) fechada(s) em {result['cards']} cartão(ões) até {today.isoformat()}; "
+            f"{result['opened']} próxima(s) fatura(s) criada(s)."
+        ))
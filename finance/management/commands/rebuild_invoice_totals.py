@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+from django.db.models import F
+
+from finance.cache import bump_versions
+from finance.invoices import settle_invoices
+from finance.models import CreditCard, Invoice
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifica e recalcula os totais armazenados nas faturas (compras e pagamentos) "
+        "e o valor comprometido de cada cartão."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Apenas verifica; falha se houver divergência e não altera nada.",
+        )
+        parser.add_argument(
+            "--settle",
+            action="store_true",
+            help="Depois de recalcular, atualiza também o status (paga/parcial/aberta) de todas as faturas.",
+        )
+
+    def handle(self, *args, **options):
+        actual = Invoice.actual_totals()
+        drifted = (
+            Invoice.objects.annotate(
+                actual_charges=actual["charges_total"],
+                actual_payments=actual["payments_total"],
+            )
+            .exclude(charges_total=F("actual_charges"), payments_total=F("actual_payments"))
+            .select_related("card")
+        )
+        drifted = list(drifted)
+        for inv in drifted:
+            self.stdout.write(
+                f"Fatura {inv.pk} ({inv}): compras {inv.charges_total} != {inv.actual_charges}, "
+                f"pagamentos {inv.payments_total} != {inv.actual_payments}"
+            )
+        # Com as faturas corretas, o comprometido do cartão é a soma de seus saldos
+        cards = list(
+            CreditCard.objects.annotate(actual=CreditCard.actual_committed())
+            .exclude(committed_amount=F("actual"))
+        )
+        for card in cards:
+            self.stdout.write(f"Cartão {card.pk} ({card}): comprometido {card.committed_amount} != {card.actual}")
+
+        if options["check"]:
+            if drifted or cards:
+                raise CommandError(f"{len(drifted)} fatura(s) e {len(cards)} cartão(ões) com totais divergentes.")
+            self.stdout.write(self.style.SUCCESS("Totais das faturas conferem."))
+            return
+
+        with db_transaction.atomic():
+            updated = Invoice.refresh_totals()
+            CreditCard.refresh_committed()
+            settled = settle_invoices() if options["settle"] else 0
+            # update() não dispara os sinais que invalidam o cache dos usuários afetados
+            bump_versions({inv.card.user_id for inv in drifted} | {card.user_id for card in cards})
+        self.stdout.write(self.style.SUCCESS(
+            f"{updated} fatura(s) recalculada(s); {len(drifted)} divergência(s) corrigida(s)."
+        ))
+        if options["settle"]:
+            self.stdout.write(self.style.SUCCESS(f"{settled} fatura(s) com status atualizado."))
@@ -0,0 +1,57 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+
+from finance.cache import bump_versions
+from finance.models import MonthlyRollup
+
+
+class Command(BaseCommand):
+    help = "Reconstrói os consolidados mensais (MonthlyRollup) a partir de transações e compras no cartão."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Reconstrói apenas os dados deste usuário (username).")
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Apenas verifica; falha se algum consolidado divergir do histórico e não altera nada.",
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options["user"]:
+            User = get_user_model()
+            try:
+                user = User.objects.get(username=options["user"])
+            except User.DoesNotExist:
+                raise CommandError(f"Usuário '{options['user']}' não encontrado.")
+        if options["check"]:
+            self.check_rollups(user)
+            return
+        with db_transaction.atomic():
+            if user is not None:
+                user_ids = {user.pk}
+            else:
+                user_ids = set(MonthlyRollup.objects.values_list("user_id", flat=True).distinct())
+            created = MonthlyRollup.rebuild(user=user)
+            if user is None:
+                user_ids |= set(MonthlyRollup.objects.values_list("user_id", flat=True).distinct())
+            # delete()/bulk_create não disparam os sinais que invalidam o cache
+            bump_versions(user_ids)
+        self.stdout.write(self.style.SUCCESS(f"{created} linha(s) de consolidado mensal gerada(s)."))
+
+    def check_rollups(self, user):
+        def key(row):
+            return tuple(getattr(row, f) for f in MonthlyRollup.KEY_FIELDS)
+
+        stored = MonthlyRollup.objects.exclude(total=0, count=0)
+        if user is not None:
+            stored = stored.filter(user=user)
+        stored = {key(row): (row.total, row.count) for row in stored}
+        actual = {key(row): (row.total, row.count) for row in MonthlyRollup.actual_rows(user)}
+        drifted = sorted((k for k in stored.keys() | actual.keys() if stored.get(k) != actual.get(k)), key=str)
+        for k in drifted:
+            self.stdout.write(f"Consolidado {k}: armazenado {stored.get(k)} != {actual.get(k)}")
+        if drifted:
+            raise CommandError(f"{len(drifted)} consolidado(s) mensal(is) divergente(s).")
+        self.stdout.write(self.style.SUCCESS("Consolidados mensais conferem."))
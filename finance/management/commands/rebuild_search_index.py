@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from finance.search import install_search_index
+
+
+class Command(BaseCommand):
+    help = "Recria (se necessário) e reconstrói os índices de busca textual das descrições."
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            self.stdout.write("Banco sem FTS5: a busca usa icontains, nada a reconstruir.")
+            return
+        install_search_index()
+        self.stdout.write(self.style.SUCCESS("Índices de busca reconstruídos."))
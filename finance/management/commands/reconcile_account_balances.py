@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+from django.db.models import F
+
+from finance.cache import bump_versions
+from finance.models import Account
+
+
+class Command(BaseCommand):
+    help = "Detecta e corrige divergências entre os saldos armazenados das contas e o histórico de transações."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Apenas verifica; falha se houver divergência e não altera nada.",
+        )
+
+    def handle(self, *args, **options):
+        actual = Account.actual_totals()
+        drifted = list(
+            Account.objects.annotate(
+                actual_income=actual["income_total"],
+                actual_outcome=actual["outcome_total"],
+            ).exclude(income_total=F("actual_income"), outcome_total=F("actual_outcome"))
+        )
+        for acc in drifted:
+            self.stdout.write(
+                f"Conta {acc.pk} ({acc}): entradas {acc.income_total} != {acc.actual_income}, "
+                f"saídas {acc.outcome_total} != {acc.actual_outcome}"
+            )
+
+        if options["check"]:
+            if drifted:
+                raise CommandError(f"{len(drifted)} conta(s) com saldo divergente.")
+            self.stdout.write(self.style.SUCCESS("Saldos das contas conferem."))
+            return
+
+        with db_transaction.atomic():
+            Account.refresh_totals(Account.objects.filter(pk__in=[acc.pk for acc in drifted]))
+            # update() não dispara os sinais que invalidam o cache dos usuários afetados
+            bump_versions(acc.user_id for acc in drifted)
+        self.stdout.write(self.style.SUCCESS(f"{len(drifted)} conta(s) corrigida(s)."))
@@ -0,0 +1,42 @@
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from finance.recurrence import BATCH_SIZE, run_recurrences
+
+
+class Command(BaseCommand):
+    help = (
+        "Gera todas as ocorrências vencidas de lançamentos e compras recorrentes até a data alvo. "
+        "Pode ser executado de novo (ou após uma interrupção) sem duplicar ocorrências."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--until", help="Data alvo (AAAA-MM-DD); padrão: hoje.")
+        parser.add_argument("--user", help="Processa apenas os agendamentos deste usuário (username).")
+        parser.add_argument(
+            "--batch-size", type=int, default=BATCH_SIZE,
+            help=f"Agendamentos por transação (padrão: {BATCH_SIZE}).",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            until = date.fromisoformat(options["until"]) if options["until"] else timezone.localdate()
+        except ValueError:
+            raise CommandError(f"Data inválida: {options['until']}")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size deve ser positivo.")
+        user = None
+        if options["user"]:
+            User = get_user_model()
+            try:
+                user = User.objects.get(username=options["user"])
+            except User.DoesNotExist:
+                raise CommandError(f"Usuário '{options['user']}' não encontrado.")
+        result = run_recurrences(until, user=user, batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['transactions']} lançamento(s) e {result['charges']} parcela(s) gerado(s) "
+            f"em {result['schedules']} agendamento(s) até {until.isoformat()}."
+        ))
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:48
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_invoice_totals(apps, schema_editor):
+    Invoice = apps.get_model("finance", "Invoice")
+    CardCharge = apps.get_model("finance", "CardCharge")
+    InvoicePayment = apps.get_model("finance", "InvoicePayment")
+    charges = (
+        CardCharge.objects.filter(invoice=OuterRef("pk"))
+        .order_by().values("invoice").annotate(s=Sum("total_amount")).values("s")
+    )
+    payments = (
+        InvoicePayment.objects.filter(invoice=OuterRef("pk"))
+        .order_by().values("invoice").annotate(s=Sum("amount")).values("s")
+    )
+    zero = Value(0, output_field=models.DecimalField(max_digits=14, decimal_places=2))
+    Invoice.objects.update(
+        charges_total=Coalesce(Subquery(charges), zero),
+        payments_total=Coalesce(Subquery(payments), zero),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0005_alter_invoicepayment_account_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='charges_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='payments_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.RunPython(fill_invoice_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:49
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_account_totals(apps, schema_editor):
+    Account = apps.get_model("finance", "Account")
+    Transaction = apps.get_model("finance", "Transaction")
+    zero = Value(0, output_field=models.DecimalField(max_digits=14, decimal_places=2))
+
+    def total(tx_type):
+        sub = (
+            Transaction.objects.filter(account=OuterRef("pk"), type=tx_type)
+            .order_by().values("account").annotate(s=Sum("amount")).values("s")
+        )
+        return Coalesce(Subquery(sub), zero)
+
+    Account.objects.update(income_total=total("IN"), outcome_total=total("OUT"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0006_invoice_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='income_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='outcome_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.RunPython(fill_account_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+def build_rollups(apps, schema_editor):
+    MonthlyRollup = apps.get_model("finance", "MonthlyRollup")
+    Transaction = apps.get_model("finance", "Transaction")
+    CardCharge = apps.get_model("finance", "CardCharge")
+    grouped_txs = (
+        Transaction.objects.order_by()
+        .values("user_id", "account_id", "category_id", "type", year=ExtractYear("date"), month=ExtractMonth("date"))
+        .annotate(total=Sum("amount"), count=Count("id"))
+    )
+    grouped_charges = (
+        CardCharge.objects.order_by()
+        .values("card_id", "category_id", user_id=F("card__user_id"), year=ExtractYear("date"), month=ExtractMonth("date"))
+        .annotate(total=Sum("total_amount"), count=Count("id"))
+    )
+    rows = [MonthlyRollup(**row) for row in grouped_txs]
+    rows += [MonthlyRollup(type="CARD", **row) for row in grouped_charges]
+    MonthlyRollup.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0007_account_totals'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('IN', 'Entrada'), ('OUT', 'Saída'), ('TRX', 'Transferência'), ('CARD', 'Cartão')], max_length=4)),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='finance.account')),
+                ('card', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='finance.creditcard')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='finance.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'year', 'month'], name='finance_mon_user_id_75561d_idx'), models.Index(fields=['account', 'year', 'month'], name='finance_mon_account_f41d91_idx'), models.Index(fields=['card', 'year', 'month'], name='finance_mon_card_id_bf34e2_idx')],
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0009_category_closure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='data_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
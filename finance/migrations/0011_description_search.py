@@ -0,0 +1,54 @@
+# Índices de busca textual (SQLite FTS5) sobre as descrições de lançamentos e compras
+
+from django.db import migrations
+
+
+SEARCH_TABLES = (
+    ("finance_transaction_fts", "finance_transaction"),
+    ("finance_cardcharge_fts", "finance_cardcharge"),
+)
+
+
+def create_search_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for fts, table in SEARCH_TABLES:
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {fts} USING fts5(description, content='{table}', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        # Tabela de conteúdo externo: os gatilhos mantêm o índice em dia com a tabela original
+        schema_editor.execute(
+            f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, description) VALUES (new.id, new.description); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, description) VALUES ('delete', old.id, old.description); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {fts}_au AFTER UPDATE OF description ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, description) VALUES ('delete', old.id, old.description); "
+            f"INSERT INTO {fts}(rowid, description) VALUES (new.id, new.description); END"
+        )
+        schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def drop_search_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for fts, _ in SEARCH_TABLES:
+        for suffix in ("ai", "ad", "au"):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {fts}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0010_profile_data_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_tables, drop_search_tables),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0011_description_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cardcharge',
+            index=models.Index(fields=['card', 'date'], name='finance_car_card_id_4dca58_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['card', 'status'], name='finance_inv_card_id_e13912_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['due_date'], name='finance_inv_due_dat_b93853_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'date'], name='finance_tra_user_id_3294c0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'account', 'type', 'date'], name='finance_tra_user_id_038697_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['recurring_transaction', 'date'], name='finance_tra_recurri_41c2df_idx'),
+        ),
+    ]
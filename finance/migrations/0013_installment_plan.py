@@ -0,0 +1,85 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:12
+
+import calendar
+from datetime import date
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def _shift_months(d, months):
+    year, month = divmod(d.year * 12 + d.month - 1 + months, 12)
+    month += 1
+    last = calendar.monthrange(year, month)[1]
+    return date(year, month, min(d.day, last))
+
+
+def group_installments(apps, schema_editor):
+    """Agrupa as parcelas já existentes em planos.
+
+    Parcelas do mesmo cartão, descrição, categoria e número de parcelas formam um
+    plano enquanto a numeração seguir em sequência (ordem de criação).
+    """
+    CardCharge = apps.get_model('finance', 'CardCharge')
+    InstallmentPlan = apps.get_model('finance', 'InstallmentPlan')
+
+    def flush(group):
+        if not group:
+            return
+        first = group[0]
+        plan = InstallmentPlan.objects.create(
+            card_id=first.card_id,
+            description=first.description,
+            category_id=first.category_id,
+            installments_total=first.installments_total,
+            total_amount=sum(c.total_amount for c in group),
+            start_date=_shift_months(first.date, 1 - first.installment_number),
+        )
+        CardCharge.objects.filter(pk__in=[c.pk for c in group]).update(plan=plan)
+
+    charges = (
+        CardCharge.objects.filter(installments_total__gt=1, plan__isnull=True)
+        .order_by('card_id', 'description', 'category_id', 'installments_total', 'id')
+    )
+    group, key, last_number = [], None, 0
+    for charge in charges.iterator():
+        charge_key = (charge.card_id, charge.description, charge.category_id, charge.installments_total)
+        if charge_key != key or charge.installment_number != last_number + 1:
+            flush(group)
+            group, key = [], charge_key
+        group.append(charge)
+        last_number = charge.installment_number
+    flush(group)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0012_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstallmentPlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('description', models.CharField(max_length=200)),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('installments_total', models.PositiveIntegerField(default=1)),
+                ('start_date', models.DateField(help_text='Data da primeira parcela')),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='installment_plans', to='finance.creditcard')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='finance.category')),
+            ],
+            options={
+                'ordering': ['-start_date', '-id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='cardcharge',
+            name='plan',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='parcels', to='finance.installmentplan'),
+        ),
+        migrations.RunPython(group_installments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:16
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_committed_amount(apps, schema_editor):
+    CreditCard = apps.get_model("finance", "CreditCard")
+    Invoice = apps.get_model("finance", "Invoice")
+    zero = Value(0, output_field=models.DecimalField(max_digits=14, decimal_places=2))
+    sub = (
+        Invoice.objects.filter(card=OuterRef("pk"))
+        .order_by().values("card").annotate(s=Sum(F("charges_total") - F("payments_total"))).values("s")
+    )
+    CreditCard.objects.update(committed_amount=Coalesce(Subquery(sub), zero))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0013_installment_plan'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='creditcard',
+            name='committed_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.RunPython(fill_committed_amount, migrations.RunPython.noop),
+    ]
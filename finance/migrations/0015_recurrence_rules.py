@@ -0,0 +1,53 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0014_card_committed_amount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recurringcardpurchase',
+            name='count',
+            field=models.PositiveIntegerField(blank=True, help_text='Total de ocorrências (vazio = sem limite)', null=True),
+        ),
+        migrations.AddField(
+            model_name='recurringcardpurchase',
+            name='generated_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recurringcardpurchase',
+            name='interval',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Repete a cada N períodos da frequência'),
+        ),
+        migrations.AddField(
+            model_name='recurringtransaction',
+            name='count',
+            field=models.PositiveIntegerField(blank=True, help_text='Total de ocorrências (vazio = sem limite)', null=True),
+        ),
+        migrations.AddField(
+            model_name='recurringtransaction',
+            name='generated_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recurringtransaction',
+            name='interval',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Repete a cada N períodos da frequência'),
+        ),
+        migrations.AlterField(
+            model_name='recurringcardpurchase',
+            name='frequency',
+            field=models.CharField(choices=[('MONTHLY', 'Mensal'), ('WEEKLY', 'Semanal'), ('BIWEEKLY', 'Quinzenal'), ('YEARLY', 'Anual'), ('LAST_BDAY', 'Último dia útil do mês')], default='MONTHLY', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='recurringtransaction',
+            name='frequency',
+            field=models.CharField(choices=[('MONTHLY', 'Mensal'), ('WEEKLY', 'Semanal'), ('BIWEEKLY', 'Quinzenal'), ('YEARLY', 'Anual'), ('LAST_BDAY', 'Último dia útil do mês')], default='MONTHLY', max_length=10),
+        ),
+    ]
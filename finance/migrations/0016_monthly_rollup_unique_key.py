@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:51
+
+import django.db.models.functions.comparison
+from django.conf import settings
+from django.db import migrations, models
+
+
+KEY_FIELDS = ("user_id", "account_id", "card_id", "category_id", "type", "year", "month")
+
+
+def merge_duplicate_rollups(apps, schema_editor):
+    """Junta linhas repetidas de uma mesma chave (somando total e quantidade) antes da restrição."""
+    MonthlyRollup = apps.get_model("finance", "MonthlyRollup")
+    kept, duplicates = {}, []
+    for row in MonthlyRollup.objects.order_by("id").iterator():
+        key = tuple(getattr(row, f) for f in KEY_FIELDS)
+        first = kept.get(key)
+        if first is None:
+            kept[key] = row
+            continue
+        first.total += row.total
+        first.count += row.count
+        first.merged = True
+        duplicates.append(row.pk)
+    MonthlyRollup.objects.bulk_update([row for row in kept.values() if getattr(row, "merged", False)], ["total", "count"])
+    MonthlyRollup.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0015_recurrence_rules'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_rollups, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='monthlyrollup',
+            constraint=models.UniqueConstraint(models.F('user'), django.db.models.functions.comparison.Coalesce('account', models.Value(0), output_field=models.BigIntegerField()), django.db.models.functions.comparison.Coalesce('card', models.Value(0), output_field=models.BigIntegerField()), django.db.models.functions.comparison.Coalesce('category', models.Value(0), output_field=models.BigIntegerField()), models.F('type'), models.F('year'), models.F('month'), name='unique_monthly_rollup_key'),
+        ),
+    ]
@@ -1,10 +1,41 @@
-from django.db import models
+from django.db import IntegrityError, models
+from django.db import transaction as db_transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, ExtractMonth, ExtractYear, Greatest
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.utils import timezone
-from datetime import date
-import calendar
-from django.db.models.signals import post_save
+from datetime import date, timedelta
+from decimal import Decimal
+import logging
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from . import invoice_calendar, rrule
+
+
+logger = logging.getLogger(__name__)
+
+_propagation_deferred = ContextVar("finance_propagation_deferred", default=False)
+
+
+@contextmanager
+def defer_propagation():
+    """Suspende a propagação feita pelos sinais (totais, consolidados e versão do cache).
+
+    Usado por operações em conjunto que aplicam todas as mudanças de uma vez ao final.
+    """
+    token = _propagation_deferred.set(True)
+    try:
+        yield
+    finally:
+        _propagation_deferred.reset(token)
+
+
+def propagation_deferred():
+    return _propagation_deferred.get()
 
 # Create your models here.
 
@@ -16,9 +47,31 @@ class TimeStampedModel(models.Model):
         abstract = True
 
 
+class StoredTotalsMixin(models.Model):
+    """Modelos com totais mantidos por atualizações incrementais (F()).
+
+    Um save comum não deve sobrescrever esses campos com valores possivelmente
+    desatualizados em memória; para gravá-los, passe update_fields explicitamente.
+    """
+    TOTAL_FIELDS = ()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.TOTAL_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+
 class Profile(TimeStampedModel):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="profile")
     email_confirmed = models.BooleanField(default=False)
+    # Incrementado a cada alteração nos dados financeiros do usuário (ver finance.cache)
+    data_version = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"Perfil de {self.user.username}"
@@ -33,7 +86,7 @@ def create_user_profile(sender, instance, created, **kwargs):
             pass
 
 
-class Account(TimeStampedModel):
+class Account(StoredTotalsMixin, TimeStampedModel):
     class AccountType(models.TextChoices):
         BANK = "BANK", "Banco"
         WALLET = "WALLET", "Carteira"
@@ -45,6 +98,11 @@ class Account(TimeStampedModel):
     initial_balance = models.DecimalField(max_digits=14, decimal_places=2, default=0)
     currency = models.CharField(max_length=3, default="BRL")
     active = models.BooleanField(default=True)
+    # Totais de entradas/saídas mantidos pelas transações (ver apply_transaction_deltas)
+    income_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    outcome_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    TOTAL_FIELDS = ("income_total", "outcome_total")
 
     class Meta:
         unique_together = ("user", "name")
@@ -53,8 +111,54 @@ class Account(TimeStampedModel):
     def __str__(self):
         return f"{self.name}"
 
+    def balance(self):
+        return (self.initial_balance or 0) + (self.income_total or 0) - (self.outcome_total or 0)
+
+    @staticmethod
+    def apply_transaction_deltas(rows):
+        """Aplica (account_id, type, valor com sinal) aos totais das contas."""
+        deltas = {}
+        for account_id, tx_type, amount in rows:
+            income, outcome = deltas.get(account_id, (0, 0))
+            if tx_type == Transaction.TxType.INCOME:
+                income += amount
+            elif tx_type == Transaction.TxType.OUTCOME:
+                outcome += amount
+            deltas[account_id] = (income, outcome)
+        for account_id, (income, outcome) in deltas.items():
+            if not account_id or (not income and not outcome):
+                continue
+            Account.objects.filter(pk=account_id).update(
+                income_total=F("income_total") + income,
+                outcome_total=F("outcome_total") + outcome,
+            )
 
-class CreditCard(TimeStampedModel):
+    @staticmethod
+    def actual_totals():
+        """Expressões com os totais reais de entradas e saídas de cada conta."""
+        zero = Value(0, output_field=models.DecimalField(max_digits=14, decimal_places=2))
+
+        def total(tx_type):
+            sub = (
+                Transaction.objects.filter(account=OuterRef("pk"), type=tx_type)
+                .order_by().values("account").annotate(s=Sum("amount")).values("s")
+            )
+            return Coalesce(Subquery(sub), zero)
+
+        return {
+            "income_total": total(Transaction.TxType.INCOME),
+            "outcome_total": total(Transaction.TxType.OUTCOME),
+        }
+
+    @staticmethod
+    def refresh_totals(queryset=None):
+        """Recalcula os totais a partir do histórico de transações (atualização em conjunto)."""
+        if queryset is None:
+            queryset = Account.objects.all()
+        return queryset.update(**Account.actual_totals())
+
+
+class CreditCard(StoredTotalsMixin, TimeStampedModel):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
     brand = models.CharField(max_length=50, blank=True)
@@ -62,6 +166,10 @@ class CreditCard(TimeStampedModel):
     closing_day = models.PositiveSmallIntegerField(help_text="Dia do fechamento da fatura (1-28)")
     due_day = models.PositiveSmallIntegerField(help_text="Dia do vencimento da fatura (1-28)")
     active = models.BooleanField(default=True)
+    # Compras (inclusive parcelas futuras) menos pagamentos, mantido junto com os totais das faturas
+    committed_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    TOTAL_FIELDS = ("committed_amount",)
 
     class Meta:
         unique_together = ("user", "name")
@@ -70,6 +178,47 @@ class CreditCard(TimeStampedModel):
     def __str__(self):
         return f"{self.name}"
 
+    def available_limit(self):
+        return (self.limit or 0) - (self.committed_amount or 0)
+
+    def utilization(self):
+        """Fração do limite comprometida (None quando o cartão não tem limite)."""
+        if not self.limit:
+            return None
+        return self.committed_amount / self.limit
+
+    def exceeds_limit(self, amount):
+        return bool(self.limit) and amount > self.available_limit()
+
+    @staticmethod
+    def add_committed(deltas):
+        """Soma {card_id: valor} a committed_amount de vários cartões em um único UPDATE."""
+        deltas = {pk: delta for pk, delta in deltas.items() if pk and delta}
+        if not deltas:
+            return
+        increment = Case(
+            *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+            output_field=models.DecimalField(max_digits=14, decimal_places=2),
+        )
+        CreditCard.objects.filter(pk__in=deltas).update(committed_amount=F("committed_amount") + increment)
+
+    @staticmethod
+    def actual_committed():
+        """Expressão com o valor comprometido real de cada cartão, a partir das faturas."""
+        sub = (
+            Invoice.objects.filter(card=OuterRef("pk"))
+            .order_by().values("card").annotate(s=Sum(F("charges_total") - F("payments_total"))).values("s")
+        )
+        zero = Value(0, output_field=models.DecimalField(max_digits=14, decimal_places=2))
+        return Coalesce(Subquery(sub), zero)
+
+    @staticmethod
+    def refresh_committed(queryset=None):
+        """Recalcula committed_amount a partir dos totais das faturas (atualização em conjunto)."""
+        if queryset is None:
+            queryset = CreditCard.objects.all()
+        return queryset.update(committed_amount=CreditCard.actual_committed())
+
 
 class Category(TimeStampedModel):
     class Kind(models.TextChoices):
@@ -89,6 +238,62 @@ class Category(TimeStampedModel):
     def __str__(self):
         return f"{self.name}"
 
+    def clean(self):
+        super().clean()
+        if self.parent_id and self.pk and self.is_ancestor_of(self.parent_id):
+            raise ValidationError({"parent": "A categoria pai não pode ser a própria categoria nem uma de suas subcategorias."})
+
+    def is_ancestor_of(self, category_id):
+        return CategoryClosure.objects.filter(ancestor_id=self.pk, descendant_id=category_id).exists()
+
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        old_parent_id = None
+        if not creating:
+            old_parent_id = Category.objects.filter(pk=self.pk).values_list("parent_id", flat=True).first()
+        with db_transaction.atomic():
+            super().save(*args, **kwargs)
+            if creating:
+                self._link_subtree([(self.pk, 0)])
+            elif old_parent_id != self.parent_id:
+                subtree = list(
+                    CategoryClosure.objects.filter(ancestor_id=self.pk).values_list("descendant_id", "depth")
+                )
+                subtree_ids = [descendant_id for descendant_id, _ in subtree]
+                if self.parent_id in subtree_ids:
+                    raise ValidationError("Hierarquia de categorias com ciclo.")
+                # Desliga a subárvore dos ancestrais antigos e liga aos novos
+                CategoryClosure.objects.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+                self._link_subtree(subtree, include_self=False)
+
+    def _link_subtree(self, subtree, include_self=True):
+        """Cria os vínculos entre os ancestrais de self (a partir do pai) e a subárvore dada."""
+        links = []
+        if include_self:
+            links.append(CategoryClosure(ancestor_id=self.pk, descendant_id=self.pk, depth=0))
+        if self.parent_id:
+            ancestors = CategoryClosure.objects.filter(descendant_id=self.parent_id).values_list("ancestor_id", "depth")
+            links += [
+                CategoryClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=a_depth + d_depth + 1)
+                for ancestor_id, a_depth in ancestors
+                for descendant_id, d_depth in subtree
+            ]
+        CategoryClosure.objects.bulk_create(links)
+
+
+class CategoryClosure(models.Model):
+    """Tabela de fechamento da hierarquia de categorias (inclui o vínculo de cada categoria consigo mesma)."""
+    ancestor = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="descendant_links")
+    descendant = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="ancestor_links")
+    depth = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ("ancestor", "descendant")
+        indexes = [models.Index(fields=["descendant", "depth"])]
+
+    def __str__(self):
+        return f"{self.ancestor_id} -> {self.descendant_id} ({self.depth})"
+
 
 class Tag(TimeStampedModel):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -122,12 +327,56 @@ class Transaction(TimeStampedModel):
 
     class Meta:
         ordering = ["-date", "-id"]
+        indexes = [
+            models.Index(fields=["user", "date"]),
+            models.Index(fields=["user", "account", "type", "date"]),
+            models.Index(fields=["recurring_transaction", "date"]),
+        ]
 
     def __str__(self):
         return f"{self.date} - {self.description} ({self.amount})"
 
+    def signed_amount(self):
+        """Efeito no saldo da conta, pela mesma regra de Account.balance(): só IN e OUT contam."""
+        if self.type == Transaction.TxType.INCOME:
+            return self.amount
+        if self.type == Transaction.TxType.OUTCOME:
+            return -self.amount
+        return Decimal("0.00")
 
-class Invoice(TimeStampedModel):
+    # Campos que afetam saldos e consolidados mensais
+    CONTRIBUTION_FIELDS = ("user_id", "account_id", "category_id", "type", "date", "amount")
+
+    def contribution(self):
+        values = {f: getattr(self, f) for f in self.CONTRIBUTION_FIELDS}
+        values["date"] = self._meta.get_field("date").to_python(self.date)
+        return values
+
+    @staticmethod
+    def apply_contributions(changes, cascade=False):
+        """Propaga pares (valores, sinal) para os saldos das contas e os consolidados mensais.
+
+        cascade indica remoções feitas pelo on_delete de outro modelo (ver MonthlyRollup.apply).
+        """
+        changes = list(changes)
+        Account.apply_transaction_deltas(
+            (values["account_id"], values["type"], sign * values["amount"]) for values, sign in changes
+        )
+        MonthlyRollup.add_transactions(changes, cascade)
+
+    def save(self, *args, **kwargs):
+        old = None
+        if self.pk:
+            old = Transaction.objects.filter(pk=self.pk).values(*self.CONTRIBUTION_FIELDS).first()
+        with db_transaction.atomic():
+            super().save(*args, **kwargs)
+            changes = [(self.contribution(), 1)]
+            if old is not None:
+                changes.append((old, -1))
+            Transaction.apply_contributions(changes)
+
+
+class Invoice(StoredTotalsMixin, TimeStampedModel):
     class Status(models.TextChoices):
         OPEN = "OPEN", "Aberta"
         CLOSED = "CLOSED", "Fechada"
@@ -140,90 +389,140 @@ class Invoice(TimeStampedModel):
     closing_date = models.DateField(null=True, blank=True)
     due_date = models.DateField(null=True, blank=True)
     status = models.CharField(max_length=10, choices=Status.choices, default=Status.OPEN)
+    # Totais desnormalizados, mantidos por CardCharge/InvoicePayment (ver add_to_totals)
+    charges_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    payments_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    TOTAL_FIELDS = ("charges_total", "payments_total")
 
     class Meta:
         unique_together = ("card", "year", "month")
         ordering = ["-year", "-month"]
+        indexes = [
+            models.Index(fields=["card", "status"]),
+            models.Index(fields=["due_date"]),
+        ]
 
     def __str__(self):
         return f"{self.card.name} {self.year}-{self.month:02d}"
 
     def total_charges(self):
-        agg = self.charges.aggregate(s=models.Sum("total_amount"))
-        return agg.get("s") or 0
+        return self.charges_total
 
     def total_payments(self):
-        agg = self.payments.aggregate(s=models.Sum("amount"))
-        return agg.get("s") or 0
+        return self.payments_total
 
     def balance(self):
-        return (self.total_charges() or 0) - (self.total_payments() or 0)
+        return (self.charges_total or 0) - (self.payments_total or 0)
 
     @staticmethod
-    def assign_invoice_for(card: "CreditCard", purchase_date: date):
-        y = purchase_date.year
-        m = purchase_date.month
-        # Usa dia de fechamento efetivo do mês (limita ao último dia do mês)
-        from calendar import monthrange
-        eff_close = min(card.closing_day, monthrange(y, m)[1])
-        # Compras no dia de fechamento (ou após) pertencem à fatura do próximo mês
-        if purchase_date.day >= eff_close:
-            if m == 12:
-                y += 1
-                m = 1
-            else:
-                m += 1
-        inv, _ = Invoice.objects.get_or_create(card=card, year=y, month=m)
-        # Define datas de fechamento/vencimento padrão
-        try:
-            inv.closing_date = date(y, m, min(card.closing_day, 28))
-        except Exception:
-            inv.closing_date = None
-        # Vencimento: mesmo mês se fechamento <= vencimento, próximo mês se fechamento > vencimento
-        if card.closing_day <= card.due_day:
-            # Mesmo mês do fechamento
-            vy, vm = y, m
-        else:
-            # Próximo mês
-            vy, vm = (y + 1, 1) if m == 12 else (y, m + 1)
-        try:
-            inv.due_date = date(vy, vm, min(card.due_day, 28))
-        except Exception:
-            inv.due_date = None
-        inv.save()
+    def add_to_totals(invoice_id, charges=0, payments=0):
+        if not invoice_id or (not charges and not payments):
+            return
+        Invoice.objects.filter(pk=invoice_id).update(
+            charges_total=F("charges_total") + charges,
+            payments_total=F("payments_total") + payments,
+        )
+        CreditCard.objects.filter(invoices=invoice_id).update(
+            committed_amount=F("committed_amount") + charges - payments,
+        )
+
+    @staticmethod
+    def add_charges(deltas):
+        """Soma {invoice_id: valor} a charges_total de várias faturas em um único UPDATE."""
+        deltas = {pk: delta for pk, delta in deltas.items() if pk and delta}
+        if not deltas:
+            return
+        increment = Case(
+            *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+            output_field=models.DecimalField(max_digits=14, decimal_places=2),
+        )
+        Invoice.objects.filter(pk__in=deltas).update(charges_total=F("charges_total") + increment)
+
+    @staticmethod
+    def actual_totals():
+        """Expressões com os totais reais de compras e pagamentos de cada fatura."""
+        charges = (
+            CardCharge.objects.filter(invoice=OuterRef("pk"))
+            .order_by().values("invoice").annotate(s=Sum("total_amount")).values("s")
+        )
+        payments = (
+            InvoicePayment.objects.filter(invoice=OuterRef("pk"))
+            .order_by().values("invoice").annotate(s=Sum("amount")).values("s")
+        )
+        zero = Value(0, output_field=models.DecimalField(max_digits=14, decimal_places=2))
+        return {
+            "charges_total": Coalesce(Subquery(charges), zero),
+            "payments_total": Coalesce(Subquery(payments), zero),
+        }
+
+    @staticmethod
+    def refresh_totals(queryset=None):
+        """Recalcula os totais a partir de compras e pagamentos (atualização em conjunto)."""
+        if queryset is None:
+            queryset = Invoice.objects.all()
+        return queryset.update(**Invoice.actual_totals())
+
+    @staticmethod
+    def delete_if_empty(invoice_ids):
+        """Exclui as faturas indicadas que não têm compras nem pagamentos."""
+        return Invoice.objects.filter(
+            pk__in=invoice_ids, charges__isnull=True, payments__isnull=True
+        ).delete()
+
+    @staticmethod
+    def for_period(card: "CreditCard", period):
+        """Obtém (ou cria) a fatura do período do calendário, gravando só o que mudou."""
+        inv, created = Invoice.objects.get_or_create(
+            card=card, year=period.year, month=period.month,
+            defaults={"closing_date": period.closing_date, "due_date": period.due_date},
+        )
+        if not created and (inv.closing_date, inv.due_date) != (period.closing_date, period.due_date):
+            inv.closing_date, inv.due_date = period.closing_date, period.due_date
+            inv.save(update_fields=["closing_date", "due_date"])
         return inv
 
+    @staticmethod
+    def assign_invoice_for(card: "CreditCard", purchase_date: date):
+        return Invoice.for_period(card, invoice_calendar.period_for(card, purchase_date))
+
     def next_invoice(self):
-        y, m = self.year, self.month
-        if m == 12:
-            y += 1
-            m = 1
-        else:
-            m += 1
-        inv, _ = Invoice.objects.get_or_create(card=self.card, year=y, month=m)
-        # Preenche datas padrão se necessário
-        try:
-            inv.closing_date = date(y, m, min(self.card.closing_day, 28))
-        except Exception:
-            inv.closing_date = None
-        # Vencimento: mesmo mês se fechamento <= vencimento, próximo mês se fechamento > vencimento
-        if self.card.closing_day <= self.card.due_day:
-            # Mesmo mês do fechamento
-            vy, vm = y, m
-        else:
-            # Próximo mês
-            vy, vm = (y + 1, 1) if m == 12 else (y, m + 1)
-        try:
-            inv.due_date = date(vy, vm, min(self.card.due_day, 28))
-        except Exception:
-            inv.due_date = None
-        inv.save()
-        return inv
+        current = invoice_calendar.period(self.card, self.year, self.month)
+        return Invoice.for_period(self.card, invoice_calendar.following(self.card, current))
+
+
+class InstallmentPlan(TimeStampedModel):
+    """Compra parcelada: dona das parcelas (CardCharge), editadas e excluídas em conjunto."""
+
+    card = models.ForeignKey(CreditCard, on_delete=models.CASCADE, related_name="installment_plans")
+    description = models.CharField(max_length=200)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2)
+    installments_total = models.PositiveIntegerField(default=1)
+    start_date = models.DateField(help_text="Data da primeira parcela")
+    category = models.ForeignKey(Category, on_delete=models.PROTECT, null=True, blank=True)
+
+    class Meta:
+        ordering = ["-start_date", "-id"]
+
+    def __str__(self):
+        return f"{self.description} ({self.installments_total}x)"
+
+    @classmethod
+    def sync_with_parcels(cls, plan_ids):
+        """Recalcula valor e número de parcelas a partir das que restaram; exclui planos sem parcelas."""
+        plans = cls.objects.filter(pk__in={pk for pk in plan_ids if pk})
+        plans.filter(parcels__isnull=True).delete()
+        parcels = CardCharge.objects.filter(plan=OuterRef("pk")).order_by().values("plan")
+        plans.update(
+            total_amount=Subquery(parcels.annotate(total=Sum("total_amount")).values("total")),
+            installments_total=Subquery(parcels.annotate(n=Count("id")).values("n")),
+        )
 
 
 class CardCharge(TimeStampedModel):
     card = models.ForeignKey(CreditCard, on_delete=models.CASCADE, related_name="charges")
     invoice = models.ForeignKey(Invoice, on_delete=models.PROTECT, related_name="charges")
+    plan = models.ForeignKey(InstallmentPlan, on_delete=models.CASCADE, null=True, blank=True, related_name="parcels")
     date = models.DateField(default=timezone.now)
     description = models.CharField(max_length=200)
     total_amount = models.DecimalField(max_digits=14, decimal_places=2)
@@ -234,32 +533,82 @@ class CardCharge(TimeStampedModel):
 
     class Meta:
         ordering = ["-date", "-id"]
+        indexes = [models.Index(fields=["card", "date"])]
 
     def __str__(self):
         return f"{self.description} ({self.installment_number}/{self.installments_total})"
 
+    # Campos que afetam totais de faturas e consolidados mensais
+    CONTRIBUTION_FIELDS = ("card_id", "invoice_id", "category_id", "date", "total_amount")
+
+    def contribution(self):
+        values = {f: getattr(self, f) for f in self.CONTRIBUTION_FIELDS}
+        values["date"] = self._meta.get_field("date").to_python(self.date)
+        values["user_id"] = self.card.user_id
+        return values
+
+    @staticmethod
+    def apply_contributions(changes, cascade=False):
+        """Propaga pares (valores, sinal) para os totais das faturas e os consolidados mensais."""
+        changes = list(changes)
+        invoice_deltas, card_deltas = {}, {}
+        for values, sign in changes:
+            invoice_id, card_id = values["invoice_id"], values["card_id"]
+            invoice_deltas[invoice_id] = invoice_deltas.get(invoice_id, 0) + sign * values["total_amount"]
+            card_deltas[card_id] = card_deltas.get(card_id, 0) + sign * values["total_amount"]
+        Invoice.add_charges(invoice_deltas)
+        CreditCard.add_committed(card_deltas)
+        MonthlyRollup.add_card_charges(changes, cascade)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Guarda os valores carregados para saber, no save(), o que realmente mudou
+        if all(f in field_names for f in cls.CONTRIBUTION_FIELDS):
+            instance._loaded_values = {f: getattr(instance, f) for f in cls.CONTRIBUTION_FIELDS}
+        return instance
+
+    def _old_contribution(self):
+        """Valores gravados antes desta alteração (None para compras novas)."""
+        if not self.pk:
+            return None
+        loaded = getattr(self, "_loaded_values", None)
+        if loaded is None:
+            return (
+                CardCharge.objects.filter(pk=self.pk)
+                .values(*self.CONTRIBUTION_FIELDS, user_id=F("card__user_id"))
+                .first()
+            )
+        if loaded["card_id"] == self.card_id:
+            user_id = self.card.user_id
+        else:
+            user_id = CreditCard.objects.filter(pk=loaded["card_id"]).values_list("user_id", flat=True).first()
+        return {**loaded, "user_id": user_id}
+
     def save(self, *args, **kwargs):
-        old_invoice = None
-        if self.pk:
-            try:
-                old = CardCharge.objects.select_related("invoice").get(pk=self.pk)
-                old_invoice = old.invoice
-            except CardCharge.DoesNotExist:
-                pass
-        # Garante fatura correta baseada em card+date
-        if self.card_id and self.date:
-            inv = Invoice.assign_invoice_for(self.card, self.date)
-            if inv.status == Invoice.Status.CLOSED:
-                inv = inv.next_invoice()
-            self.invoice = inv
-        super().save(*args, **kwargs)
+        old = self._old_contribution()
+        new_date = self._meta.get_field("date").to_python(self.date)
+        moved = old is None or old["card_id"] != self.card_id or old["date"] != new_date
+        with db_transaction.atomic():
+            # Reatribui a fatura só quando cartão ou data mudaram
+            if self.card_id and self.date and (moved or not self.invoice_id):
+                inv = Invoice.assign_invoice_for(self.card, new_date)
+                if inv.status == Invoice.Status.CLOSED:
+                    inv = inv.next_invoice()
+                self.invoice = inv
+            super().save(*args, **kwargs)
+            current = self.contribution()
+            if old is None:
+                CardCharge.apply_contributions([(current, 1)])
+            elif any(old[f] != current[f] for f in current):
+                CardCharge.apply_contributions([(current, 1), (old, -1)])
+            # Parcela editada isoladamente: o plano passa a refletir a soma das parcelas
+            if self.plan_id and old is not None and old["total_amount"] != current["total_amount"]:
+                InstallmentPlan.sync_with_parcels([self.plan_id])
+        self._loaded_values = {f: current[f] for f in self.CONTRIBUTION_FIELDS}
         # Remove fatura antiga se tiver ficado vazia
-        if old_invoice and (not self.invoice_id or old_invoice.pk != self.invoice_id):
-            if not old_invoice.charges.exists() and not old_invoice.payments.exists():
-                try:
-                    old_invoice.delete()
-                except Exception:
-                    pass
+        if old is not None and old["invoice_id"] != self.invoice_id:
+            Invoice.delete_if_empty([old["invoice_id"]])
 
     def post(self, *args, **kwargs):
         # Limpa relações M2M antes de excluir o lançamento
@@ -289,10 +638,259 @@ class InvoicePayment(TimeStampedModel):
     def __str__(self):
         return f"Pagamento {self.amount} em {self.date}"
 
+    def save(self, *args, **kwargs):
+        old = None
+        if self.pk:
+            old = InvoicePayment.objects.filter(pk=self.pk).values("invoice_id", "amount").first()
+        with db_transaction.atomic():
+            super().save(*args, **kwargs)
+            if old is not None and old["invoice_id"] == self.invoice_id:
+                Invoice.add_to_totals(self.invoice_id, payments=self.amount - old["amount"])
+            else:
+                if old is not None:
+                    Invoice.add_to_totals(old["invoice_id"], payments=-old["amount"])
+                Invoice.add_to_totals(self.invoice_id, payments=self.amount)
+
+
+def cascaded(sender, origin):
+    """Se a exclusão partiu de outro modelo (on_delete=CASCADE), e não de sender."""
+    model = origin.model if isinstance(origin, models.QuerySet) else type(origin)
+    return origin is not None and not issubclass(model, sender)
+
+
+@receiver(post_delete, sender=Transaction)
+def remove_transaction_contribution(sender, instance, origin=None, **kwargs):
+    Transaction.apply_contributions([(instance.contribution(), -1)], cascaded(sender, origin))
+
 
-class RecurringTransaction(TimeStampedModel):
-    class Frequency(models.TextChoices):
-        MONTHLY = "MONTHLY", "Mensal"
+@receiver(post_delete, sender=CardCharge)
+def remove_charge_contribution(sender, instance, origin=None, **kwargs):
+    if propagation_deferred():
+        return
+    cascade = cascaded(sender, origin)
+    CardCharge.apply_contributions([(instance.contribution(), -1)], cascade)
+    # Exclusão de uma parcela avulsa (a do plano inteiro vem em cascata ou adiada)
+    if instance.plan_id and not cascade:
+        InstallmentPlan.sync_with_parcels([instance.plan_id])
+
+
+@receiver(post_delete, sender=InvoicePayment)
+def remove_payment_from_invoice_totals(sender, instance, **kwargs):
+    Invoice.add_to_totals(instance.invoice_id, payments=-instance.amount)
+
+
+class MonthlyRollup(models.Model):
+    """Totais mensais por (usuário, conta/cartão, categoria, tipo), mantidos incrementalmente."""
+
+    class Type(models.TextChoices):
+        INCOME = "IN", "Entrada"
+        OUTCOME = "OUT", "Saída"
+        TRANSFER = "TRX", "Transferência"
+        CARD = "CARD", "Cartão"
+
+    KEY_FIELDS = ("user_id", "account_id", "card_id", "category_id", "type", "year", "month")
+    # Limita o tamanho do filtro OR usado para localizar as linhas existentes
+    BATCH_SIZE = 200
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, null=True, blank=True, related_name="rollups")
+    card = models.ForeignKey(CreditCard, on_delete=models.CASCADE, null=True, blank=True, related_name="rollups")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name="rollups")
+    type = models.CharField(max_length=4, choices=Type.choices)
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "year", "month"]),
+            models.Index(fields=["account", "year", "month"]),
+            models.Index(fields=["card", "year", "month"]),
+        ]
+        constraints = [
+            # Uma linha por chave; as chaves nulas entram como 0 para que NULL não escape da unicidade
+            models.UniqueConstraint(
+                "user",
+                Coalesce("account", Value(0), output_field=models.BigIntegerField()),
+                Coalesce("card", Value(0), output_field=models.BigIntegerField()),
+                Coalesce("category", Value(0), output_field=models.BigIntegerField()),
+                "type",
+                "year",
+                "month",
+                name="unique_monthly_rollup_key",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.year}-{self.month:02d} {self.type} {self.total}"
+
+    @staticmethod
+    def apply(deltas, cascade=False):
+        """Soma {chave: (total, quantidade)} às linhas existentes, criando as que faltam.
+
+        Uma remoção ou alteração sem linha correspondente não tem onde ser aplicada.
+        Em exclusões em cascata (cascade) isso é esperado, pois o dono leva junto os
+        consolidados; fora delas indica consolidados divergentes e é registrado no
+        log para ser corrigido com rebuild_rollups.
+        """
+        deltas = [(key, value) for key, value in deltas.items() if value[0] or value[1]]
+        missing = []
+        for start in range(0, len(deltas), MonthlyRollup.BATCH_SIZE):
+            batch = deltas[start:start + MonthlyRollup.BATCH_SIZE]
+            cond = Q()
+            for key, _ in batch:
+                cond |= Q(**dict(zip(MonthlyRollup.KEY_FIELDS, key)))
+            existing = {
+                tuple(getattr(row, f) for f in MonthlyRollup.KEY_FIELDS): row
+                for row in MonthlyRollup.objects.filter(cond)
+            }
+            to_update, to_create = [], []
+            for key, (total, count) in batch:
+                row = existing.get(key)
+                if row is not None:
+                    row.total = F("total") + total
+                    row.count = F("count") + count
+                    to_update.append(row)
+                elif count > 0:
+                    to_create.append(MonthlyRollup(**dict(zip(MonthlyRollup.KEY_FIELDS, key)), total=total, count=count))
+                else:
+                    missing.append(key)
+            if to_update:
+                MonthlyRollup.objects.bulk_update(to_update, ["total", "count"])
+            if to_create:
+                try:
+                    with db_transaction.atomic():
+                        MonthlyRollup.objects.bulk_create(to_create)
+                except IntegrityError:
+                    # Outra escrita criou alguma das linhas entre a leitura e o insert:
+                    # aplica de novo esses deltas, que agora encontram as linhas existentes
+                    MonthlyRollup.apply({
+                        tuple(getattr(row, f) for f in MonthlyRollup.KEY_FIELDS): (row.total, row.count)
+                        for row in to_create
+                    })
+        if missing and not cascade:
+            logger.warning(
+                "Consolidado mensal ausente para %d chave(s) %s; rode rebuild_rollups --check.",
+                len(missing), missing[:10],
+            )
+
+    @staticmethod
+    def _accumulate(deltas, key, amount, sign):
+        total, count = deltas.get(key, (0, 0))
+        deltas[key] = (total + sign * amount, count + sign)
+
+    @staticmethod
+    def add_transactions(changes, cascade=False):
+        deltas = {}
+        for values, sign in changes:
+            d = values["date"]
+            key = (values["user_id"], values["account_id"], None, values["category_id"], values["type"], d.year, d.month)
+            MonthlyRollup._accumulate(deltas, key, values["amount"], sign)
+        MonthlyRollup.apply(deltas, cascade)
+
+    @staticmethod
+    def add_card_charges(changes, cascade=False):
+        deltas = {}
+        for values, sign in changes:
+            d = values["date"]
+            key = (values["user_id"], None, values["card_id"], values["category_id"], MonthlyRollup.Type.CARD, d.year, d.month)
+            MonthlyRollup._accumulate(deltas, key, values["total_amount"], sign)
+        MonthlyRollup.apply(deltas, cascade)
+
+    @staticmethod
+    def rebuild(user=None):
+        """Reconstrói os consolidados a partir das transações e compras no cartão."""
+        rollups = MonthlyRollup.objects.all()
+        if user is not None:
+            rollups = rollups.filter(user=user)
+        rollups.delete()
+        rows = MonthlyRollup.actual_rows(user)
+        MonthlyRollup.objects.bulk_create(rows, batch_size=500)
+        return len(rows)
+
+    @staticmethod
+    def actual_rows(user=None):
+        """Linhas (não gravadas) que os consolidados deveriam ter, calculadas do histórico."""
+        txs = Transaction.objects.all()
+        charges = CardCharge.objects.all()
+        if user is not None:
+            txs = txs.filter(user=user)
+            charges = charges.filter(card__user=user)
+        grouped_txs = (
+            txs.order_by()
+            .values("user_id", "account_id", "category_id", "type", year=ExtractYear("date"), month=ExtractMonth("date"))
+            .annotate(total=Sum("amount"), count=Count("id"))
+        )
+        grouped_charges = (
+            charges.order_by()
+            .values("card_id", "category_id", user_id=F("card__user_id"), year=ExtractYear("date"), month=ExtractMonth("date"))
+            .annotate(total=Sum("total_amount"), count=Count("id"))
+        )
+        rows = [MonthlyRollup(**row) for row in grouped_txs.iterator()]
+        rows += [MonthlyRollup(type=MonthlyRollup.Type.CARD, **row) for row in grouped_charges.iterator()]
+        return rows
+
+
+class RecurrenceFrequency(models.TextChoices):
+    MONTHLY = rrule.MONTHLY, "Mensal"
+    WEEKLY = rrule.WEEKLY, "Semanal"
+    BIWEEKLY = rrule.BIWEEKLY, "Quinzenal"
+    YEARLY = rrule.YEARLY, "Anual"
+    LAST_BUSINESS_DAY = rrule.LAST_BUSINESS_DAY, "Último dia útil do mês"
+
+
+class RecurrenceMixin(models.Model):
+    """Campos e expansão comuns às recorrências; as datas vêm de rrule.Rule.
+
+    next_date é a âncora da regra (próxima ocorrência) e generated_count conta as
+    ocorrências já geradas, para respeitar count.
+    """
+    interval = models.PositiveSmallIntegerField(default=1, help_text="Repete a cada N períodos da frequência")
+    count = models.PositiveIntegerField(null=True, blank=True, help_text="Total de ocorrências (vazio = sem limite)")
+    generated_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def rule(self):
+        remaining = None if self.count is None else max(self.count - self.generated_count, 0)
+        return rrule.Rule(self.frequency, self.interval, self.day_of_month, self.next_date, remaining, self.end_date)
+
+    def pending(self, until):
+        """Ocorrências ainda não geradas até until."""
+        if not self.active:
+            return []
+        return self.rule().upto(until)
+
+    def advance(self, dates):
+        """Avança next_date depois de gerar as ocorrências dates (as primeiras pendentes)."""
+        if dates:
+            self.next_date = self.rule().nth(len(dates))
+            self.generated_count += len(dates)
+
+    def rewind(self, when):
+        """Volta next_date para when (ocorrência excluída) para que ela seja gerada de novo.
+
+        As ocorrências desfeitas, de when até antes do next_date atual, deixam de
+        contar em generated_count; sem isso uma regra com count terminaria antes.
+        """
+        if when >= self.next_date:
+            return
+        undone = rrule.Rule(self.frequency, self.interval, self.day_of_month, when, None, None).between(
+            when, self.next_date - timedelta(days=1),
+        )
+        self.next_date = when
+        self.generated_count = Greatest(F("generated_count") - len(undone), Value(0))
+        self.save(update_fields=["next_date", "generated_count"])
+        self.refresh_from_db(fields=["generated_count"])
+
+    def upcoming(self, n=3):
+        return self.rule().preview(n) if self.active else []
+
+
+class RecurringTransaction(RecurrenceMixin, TimeStampedModel):
+    Frequency = RecurrenceFrequency
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     account = models.ForeignKey(Account, on_delete=models.CASCADE)
@@ -314,12 +912,11 @@ class RecurringTransaction(TimeStampedModel):
         return f"{self.get_frequency_display()} {self.description}"
 
     def generate_next(self):
-        if not self.active:
-            return None
-        nd = self.next_date
-        if self.end_date and nd > self.end_date:
+        nd = self.rule().nth(0)
+        if not self.pending(nd):
             return None
-        tx = Transaction.objects.create(
+        # Ocorrência já gravada (por exemplo, depois de rewind) não é repetida, como em run_recurrences
+        tx = self.generated_transactions.filter(date=nd).first() or Transaction.objects.create(
             user=self.user,
             account=self.account,
             type=self.type,
@@ -329,18 +926,13 @@ class RecurringTransaction(TimeStampedModel):
             category=self.category,
             recurring_transaction=self,
         )
-        # advance month
-        y = nd.year + (nd.month // 12)
-        m = 1 if nd.month == 12 else nd.month + 1
-        d = min(self.day_of_month, 28)
-        self.next_date = date(y, m, d)
-        self.save(update_fields=["next_date"])
+        self.advance([nd])
+        self.save(update_fields=["next_date", "generated_count"])
         return tx
 
 
-class RecurringCardPurchase(TimeStampedModel):
-    class Frequency(models.TextChoices):
-        MONTHLY = "MONTHLY", "Mensal"
+class RecurringCardPurchase(RecurrenceMixin, TimeStampedModel):
+    Frequency = RecurrenceFrequency
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     card = models.ForeignKey(CreditCard, on_delete=models.CASCADE)
@@ -361,41 +953,15 @@ class RecurringCardPurchase(TimeStampedModel):
         return f"{self.get_frequency_display()} {self.description}"
 
     def generate_next(self):
-        if not self.active:
+        nd = self.rule().nth(0)
+        if not self.pending(nd):
             return None
-        nd = self.next_date
-        if self.end_date and nd > self.end_date:
-            return None
-        inv = Invoice.assign_invoice_for(self.card, nd)
-        if inv.status == Invoice.Status.CLOSED:
-            inv = inv.next_invoice()
-        # cria parcelas a partir da data base nd
-        from decimal import Decimal
-        per_parcel = (self.total_amount / self.installments_total).quantize(Decimal("0.01")) if self.installments_total > 1 else self.total_amount
-        for i in range(1, self.installments_total + 1):
-            cy = nd.year + ((nd.month - 1 + (i - 1)) // 12)
-            cm = ((nd.month - 1 + (i - 1)) % 12) + 1
-            last_day = calendar.monthrange(cy, cm)[1]
-            cday = min(nd.day, last_day)
-            cdate = date(cy, cm, cday)
-            inv_i = Invoice.assign_invoice_for(self.card, cdate)
-            if inv_i.status == Invoice.Status.CLOSED:
-                inv_i = inv_i.next_invoice()
-            CardCharge.objects.create(
-                card=self.card,
-                invoice=inv_i,
-                date=cdate,
-                description=self.description,
-                total_amount=per_parcel,
-                installment_number=i,
-                installments_total=self.installments_total,
-                category=self.category,
-            )
-        # advance month for next recurrence
-        y = nd.year + (nd.month // 12)
-        m = 1 if nd.month == 12 else nd.month + 1
-        last_day_next = calendar.monthrange(y, m)[1]
-        d = min(self.day_of_month, last_day_next)
-        self.next_date = date(y, m, d)
-        self.save(update_fields=["next_date"])
-        return inv
+        # Mesmo caminho das compras parceladas (plano, faturas e totais em lote)
+        from .purchases import create_installment_purchase
+
+        charges = create_installment_purchase(
+            self.card, nd, self.description, self.total_amount, self.installments_total, self.category,
+        )
+        self.advance([nd])
+        self.save(update_fields=["next_date", "generated_count"])
+        return charges[0].invoice
@@ -0,0 +1,97 @@
+"""Paginação por chave (keyset) na ordenação (-date, -id) dos lançamentos.
+
+O cursor guarda a data e o id da última (ou primeira) linha exibida, então
+cada página é uma consulta por faixa de índice, com custo constante em
+qualquer profundidade, e continua estável quando novas linhas são inseridas.
+
+Linhas projetadas (ver projections.py) podem ser intercaladas às reais: a
+chave de ordenação passa a ser (data, posto, id), com posto 1 para projeções,
+que ficam antes dos lançamentos reais do mesmo dia.
+"""
+import base64
+import heapq
+from datetime import date
+from decimal import Decimal
+from itertools import islice
+
+from django.db.models import Q
+
+
+PAGE_SIZE = 50
+
+
+def cursor_key(obj):
+    """Chave (data, posto, id) de uma linha real ou projetada."""
+    if getattr(obj, "projected", False):
+        return obj.date, obj.cursor_rank, obj.sort_id
+    return obj.date, 0, obj.pk
+
+
+def encode_cursor(direction, obj):
+    day, rank, pk = cursor_key(obj)
+    raw = f"{direction}|{day.isoformat()}|{pk}" + (f"|{rank}" if rank else "")
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Retorna (direção, data, posto, id) ou None para cursores ausentes ou inválidos."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        direction, day, pk, *rank = raw.split("|")
+        if direction not in ("n", "p") or len(rank) > 1:
+            return None
+        return direction, date.fromisoformat(day), int(rank[0]) if rank else 0, int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    def __init__(self, items, has_next, has_previous):
+        self.items = items
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = encode_cursor("n", items[-1]) if has_next and items else None
+        self.previous_cursor = encode_cursor("p", items[0]) if has_previous and items else None
+        # Totais da página calculados sobre os lançamentos reais já carregados
+        real = [o for o in items if not getattr(o, "projected", False)]
+        self.income_total = sum((o.amount for o in real if o.type == "IN"), Decimal("0"))
+        self.outcome_total = sum((o.amount for o in real if o.type == "OUT"), Decimal("0"))
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def paginate_keyset(queryset, cursor=None, per_page=PAGE_SIZE, projected=None):
+    """Página de queryset em (-date, -id) a partir do cursor (None = primeira página).
+
+    projected, se informado, é uma função (chave, reverse) que gera as linhas
+    projetadas estritamente depois da chave na ordem pedida; elas são
+    intercaladas às linhas reais sem carregar nenhum dos lados por inteiro.
+    """
+    decoded = decode_cursor(cursor)
+    direction, key = ("n", None) if decoded is None else (decoded[0], decoded[1:])
+
+    if direction == "n":
+        rows = queryset
+        if key is not None:
+            day, rank, pk = key
+            rows = rows.filter(Q(date__lt=day) | Q(date=day, id__lt=pk) if not rank else Q(date__lte=day))
+        rows = rows.order_by("-date", "-id")[:per_page + 1]
+        if projected is not None:
+            rows = heapq.merge(rows, projected(key, True), key=cursor_key, reverse=True)
+        rows = list(islice(rows, per_page + 1))
+        return KeysetPage(rows[:per_page], has_next=len(rows) > per_page, has_previous=key is not None)
+
+    day, rank, pk = key
+    rows = queryset.filter(Q(date__gt=day) | Q(date=day, id__gt=pk) if not rank else Q(date__gt=day))
+    rows = rows.order_by("date", "id")[:per_page + 1]
+    if projected is not None:
+        rows = heapq.merge(rows, projected(key, False), key=cursor_key)
+    rows = list(islice(rows, per_page + 1))
+    items = rows[:per_page][::-1]
+    return KeysetPage(items, has_next=True, has_previous=len(rows) > per_page)
@@ -0,0 +1,77 @@
+"""Ocorrências projetadas de lançamentos recorrentes, calculadas sob demanda.
+
+Nada é gravado: as datas vêm da regra de cada RecurringTransaction ativa
+(rrule) e são geradas preguiçosamente, já na ordem da listagem, para serem
+intercaladas aos lançamentos reais por paginate_keyset.
+"""
+import heapq
+from datetime import date
+
+from .invoice_calendar import add_months
+from .models import RecurringTransaction, Transaction
+from .pagination import cursor_key
+
+
+PROJECTION_MONTHS = 12
+
+
+class ProjectedTransaction:
+    """Lançamento que uma recorrência ainda vai gerar; só leitura, sem id próprio."""
+
+    projected = True
+    cursor_rank = 1
+    reconciled = False
+    running_balance = None
+
+    def __init__(self, schedule, when):
+        self.recurring_transaction = schedule
+        self.sort_id = schedule.pk
+        self.date = when
+        self.account = schedule.account
+        self.category = schedule.category
+        self.type = schedule.type
+        self.description = schedule.description
+        self.amount = schedule.amount
+
+    def get_type_display(self):
+        return Transaction.TxType(self.type).label
+
+
+def projection_schedules(user):
+    return (
+        RecurringTransaction.objects.filter(user=user, active=True)
+        .select_related("account", "category")
+        .order_by("pk")
+    )
+
+
+def projection_end(today=None, months=PROJECTION_MONTHS):
+    return add_months(today or date.today(), months)
+
+
+def occurrences(schedule, start, end, reverse=False):
+    for when in schedule.rule().iter_between(start, end, reverse=reverse):
+        yield ProjectedTransaction(schedule, when)
+
+
+def projected_source(schedules, end, start=None):
+    """Fonte de projeções para paginate_keyset, entre start (ou a próxima data) e end."""
+    schedules = list(schedules)
+    start = start or date.min
+
+    def source(key, reverse):
+        if key is None:
+            low, high = start, end
+        elif reverse:
+            low, high = start, min(end, key[0])
+        else:
+            low, high = max(start, key[0]), end
+        streams = [occurrences(rec, low, high, reverse) for rec in schedules]
+        merged = heapq.merge(*streams, key=cursor_key, reverse=reverse)
+        if key is None:
+            return merged
+        if reverse:
+            return (obj for obj in merged if cursor_key(obj) < key)
+        return (obj for obj in merged if cursor_key(obj) > key)
+
+    return source
@@ -0,0 +1,160 @@
+"""Registro de compras parceladas no cartão em lote.
+
+Todas as faturas de destino são resolvidas em uma consulta, as que faltam são
+criadas em um único bulk_create, as parcelas em outro, e os totais das faturas
+e os consolidados mensais são atualizados de uma vez: o número de consultas
+não depende da quantidade de parcelas.
+"""
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import F, Q
+
+from .cache import bump_version
+from .invoice_calendar import add_months, following, period_for
+from .models import CardCharge, InstallmentPlan, Invoice, defer_propagation
+
+
+def split_installments(total, parcels):
+    """Valores das parcelas, em ordem: a sobra do arredondamento fica na primeira.
+
+    As demais mantêm o arredondamento usado até aqui e a soma é sempre o total.
+    """
+    parcels = max(int(parcels), 1)
+    per_parcel = (total / parcels).quantize(Decimal("0.01"))
+    return [total - per_parcel * (parcels - 1)] + [per_parcel] * (parcels - 1)
+
+
+def resolve_invoices(card, periods):
+    """Mapeia cada período de compra para a fatura que a recebe, criando as que faltam.
+
+    Como em Invoice.assign_invoice_for, uma fatura fechada desvia a compra para o
+    mês seguinte. São no máximo duas consultas: a busca e o bulk_create.
+    """
+    resolved = resolve_card_invoices({card: periods})
+    return {p: resolved[card.pk, p] for p in periods}
+
+
+def resolve_card_invoices(periods_by_card):
+    """resolve_invoices para vários cartões de uma vez: {(card_id, período): fatura}.
+
+    A busca cobre o intervalo entre o menor e o maior período pedidos, em vez de
+    um OR por período, para não esbarrar no limite de profundidade de expressões
+    do SQLite quando há milhares de cartões.
+    """
+    cards = {card.pk: card for card in periods_by_card}
+    wanted = {
+        card.pk: set(periods) | {following(card, p) for p in periods}
+        for card, periods in periods_by_card.items() if periods
+    }
+    if not wanted:
+        return {}
+    keys = [(p.year, p.month) for periods in wanted.values() for p in periods]
+    (low_y, low_m), (high_y, high_m) = min(keys), max(keys)
+    existing = {
+        (inv.card_id, inv.year, inv.month): inv
+        for inv in Invoice.objects.filter(
+            Q(year__gt=low_y) | Q(year=low_y, month__gte=low_m),
+            Q(year__lt=high_y) | Q(year=high_y, month__lte=high_m),
+            card_id__in=wanted,
+        )
+    }
+
+    targets = {}
+    for card, periods in periods_by_card.items():
+        for p in periods:
+            inv = existing.get((card.pk, p.year, p.month))
+            closed = inv is not None and inv.status == Invoice.Status.CLOSED
+            targets[card.pk, p] = following(card, p) if closed else p
+    missing = [
+        Invoice(card=cards[card_id], year=t.year, month=t.month, closing_date=t.closing_date, due_date=t.due_date)
+        for card_id, t in sorted({(card_id, t) for (card_id, _), t in targets.items()})
+        if (card_id, t.year, t.month) not in existing
+    ]
+    if missing:
+        for inv in Invoice.objects.bulk_create(missing):
+            existing[(inv.card_id, inv.year, inv.month)] = inv
+    return {key: existing[(key[0], t.year, t.month)] for key, t in targets.items()}
+
+
+def create_installment_purchase(card, purchase_date, description, total_amount, installments_total=1, category=None):
+    """Cria as parcelas de uma compra e retorna a lista de CardCharge criadas.
+
+    Compras com mais de uma parcela ganham um InstallmentPlan dono das parcelas.
+    """
+    parcels = max(int(installments_total), 1)
+    amounts = split_installments(total_amount, parcels)
+    dates = [add_months(purchase_date, i) for i in range(parcels)]
+    with db_transaction.atomic():
+        plan = None
+        if parcels > 1:
+            plan = InstallmentPlan.objects.create(
+                card=card, description=description, total_amount=total_amount,
+                installments_total=parcels, start_date=purchase_date, category=category,
+            )
+        invoices = resolve_invoices(card, {period_for(card, d) for d in dates})
+        charges = CardCharge.objects.bulk_create([
+            CardCharge(
+                card=card,
+                plan=plan,
+                invoice=invoices[period_for(card, d)],
+                date=d,
+                description=description,
+                total_amount=amount,
+                installment_number=i,
+                installments_total=parcels,
+                category=category,
+            )
+            for i, (d, amount) in enumerate(zip(dates, amounts), start=1)
+        ])
+        # bulk_create não passa por save() nem pelos sinais: propaga totais e versão aqui
+        CardCharge.apply_contributions([(charge.contribution(), 1) for charge in charges])
+        bump_version(card.user_id)
+    return charges
+
+
+def reschedule_plan(plan):
+    """Grava o plano e reaplica valor, cartão, data inicial, categoria e descrição às parcelas.
+
+    As parcelas são redivididas e movidas de fatura com um bulk_update; totais,
+    consolidados e faturas que ficaram vazias são tratados em conjunto.
+    """
+    card = plan.card
+    amounts = split_installments(plan.total_amount, plan.installments_total)
+    with db_transaction.atomic():
+        plan.save()  # o post_save do plano incrementa a versão do cache
+        parcels = list(CardCharge.objects.filter(plan=plan).select_related("card").order_by("installment_number"))
+        old = [(charge.contribution(), -1) for charge in parcels]
+        dates = [add_months(plan.start_date, charge.installment_number - 1) for charge in parcels]
+        invoices = resolve_invoices(card, {period_for(card, d) for d in dates})
+        for charge, d, amount in zip(parcels, dates, amounts):
+            charge.card = card
+            charge.date = d
+            charge.invoice = invoices[period_for(card, d)]
+            charge.total_amount = amount
+            charge.category = plan.category
+            charge.description = plan.description
+        CardCharge.objects.bulk_update(parcels, ["card", "date", "invoice", "total_amount", "category", "description"])
+        new = [(charge.contribution(), 1) for charge in parcels]
+        CardCharge.apply_contributions(old + new)
+        for charge, (values, _) in zip(parcels, new):
+            charge._loaded_values = {f: values[f] for f in CardCharge.CONTRIBUTION_FIELDS}
+        with defer_propagation():
+            Invoice.delete_if_empty({values["invoice_id"] for values, _ in old} - {c.invoice_id for c in parcels})
+    return parcels
+
+
+def delete_installment_plan(plan):
+    """Exclui o plano e todas as parcelas de uma vez, removendo as faturas que ficarem vazias."""
+    user_id = plan.card.user_id
+    old = list(
+        CardCharge.objects.filter(plan=plan)
+        .values(*CardCharge.CONTRIBUTION_FIELDS, user_id=F("card__user_id"))
+    )
+    with db_transaction.atomic():
+        # As exclusões disparariam a propagação parcela a parcela e fatura a fatura
+        with defer_propagation():
+            plan.delete()
+            CardCharge.apply_contributions([(values, -1) for values in old])
+            Invoice.delete_if_empty({values["invoice_id"] for values in old})
+        bump_version(user_id)
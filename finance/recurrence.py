@@ -0,0 +1,130 @@
+"""Execução em lote das recorrências vencidas (lançamentos e compras no cartão).
+
+Cada lote de agendamentos é processado em uma transação: as ocorrências até a
+data alvo, expandidas por rrule, são criadas com bulk_create, os totais e
+consolidados são propagados de uma vez e next_date avança com um bulk_update.
+Um lote interrompido não grava nada e uma nova execução parte do next_date gravado, então rodar de novo
+não duplica ocorrências.
+"""
+from django.db import transaction as db_transaction
+
+from .cache import bump_versions
+from .invoice_calendar import add_months, period_for
+from .models import CardCharge, InstallmentPlan, RecurringCardPurchase, RecurringTransaction, Transaction
+from .purchases import resolve_card_invoices, split_installments
+
+
+BATCH_SIZE = 500
+
+
+def _batches(ids, size):
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def due(model, until, user=None):
+    qs = model.objects.filter(active=True, next_date__lte=until)
+    if user is not None:
+        qs = qs.filter(user=user)
+    return qs
+
+
+def run_transaction_batch(ids, until):
+    """Gera os lançamentos vencidos dos agendamentos ids; retorna (lançamentos, agendamentos)."""
+    schedules = list(due(RecurringTransaction, until).filter(pk__in=ids).select_for_update())
+    if not schedules:
+        return 0, 0
+    # Ocorrências já gravadas (por exemplo, geradas pela tela) não são repetidas
+    existing = set(
+        Transaction.objects.filter(
+            recurring_transaction__in=schedules, date__gte=min(rec.rule().nth(0) for rec in schedules), date__lte=until,
+        ).values_list("recurring_transaction_id", "date")
+    )
+    rows, advanced = [], []
+    for rec in schedules:
+        dates = rec.pending(until)
+        for when in dates:
+            if (rec.pk, when) not in existing:
+                rows.append(Transaction(
+                    user_id=rec.user_id, account_id=rec.account_id, type=rec.type, date=when,
+                    description=rec.description, amount=rec.amount, category_id=rec.category_id,
+                    recurring_transaction=rec,
+                ))
+        if dates:
+            rec.advance(dates)
+            advanced.append(rec)
+    created = Transaction.objects.bulk_create(rows)
+    # bulk_create/bulk_update não passam por save() nem pelos sinais
+    Transaction.apply_contributions([(tx.contribution(), 1) for tx in created])
+    RecurringTransaction.objects.bulk_update(advanced, ["next_date", "generated_count"])
+    bump_versions(rec.user_id for rec in advanced)
+    return len(created), len(advanced)
+
+
+def run_card_purchase_batch(ids, until):
+    """Gera as compras vencidas dos agendamentos ids; retorna (parcelas, agendamentos)."""
+    schedules = list(
+        due(RecurringCardPurchase, until).filter(pk__in=ids).select_related("card").select_for_update()
+    )
+    if not schedules:
+        return 0, 0
+    purchases, advanced = [], []
+    for rec in schedules:
+        dates = rec.pending(until)
+        purchases.extend((rec, when) for when in dates)
+        if dates:
+            rec.advance(dates)
+            advanced.append(rec)
+
+    periods = {}
+    for rec, when in purchases:
+        for i in range(max(rec.installments_total, 1)):
+            periods.setdefault(rec.card, set()).add(period_for(rec.card, add_months(when, i)))
+    invoices = resolve_card_invoices(periods)
+
+    # Compras parceladas ganham um plano, como em create_installment_purchase
+    plans = InstallmentPlan.objects.bulk_create([
+        InstallmentPlan(
+            card=rec.card, description=rec.description, total_amount=rec.total_amount,
+            installments_total=rec.installments_total, start_date=when, category_id=rec.category_id,
+        )
+        for rec, when in purchases if rec.installments_total > 1
+    ])
+    plans = iter(plans)
+    rows = []
+    for rec, when in purchases:
+        parcels = max(rec.installments_total, 1)
+        plan = next(plans) if parcels > 1 else None
+        amounts = split_installments(rec.total_amount, parcels)
+        for i, amount in enumerate(amounts):
+            d = add_months(when, i)
+            rows.append(CardCharge(
+                card=rec.card, plan=plan, invoice=invoices[rec.card_id, period_for(rec.card, d)], date=d,
+                description=rec.description, total_amount=amount, installment_number=i + 1,
+                installments_total=parcels, category_id=rec.category_id,
+            ))
+    created = CardCharge.objects.bulk_create(rows)
+    CardCharge.apply_contributions([(charge.contribution(), 1) for charge in created])
+    RecurringCardPurchase.objects.bulk_update(advanced, ["next_date", "generated_count"])
+    bump_versions(rec.user_id for rec in advanced)
+    return len(created), len(advanced)
+
+
+def run_recurrences(until, user=None, batch_size=BATCH_SIZE):
+    """Gera todas as ocorrências vencidas até until, em lotes de batch_size agendamentos.
+
+    Retorna um dicionário com as quantidades de lançamentos, parcelas e agendamentos avançados.
+    """
+    result = {"transactions": 0, "charges": 0, "schedules": 0}
+    jobs = (
+        (RecurringTransaction, run_transaction_batch, "transactions"),
+        (RecurringCardPurchase, run_card_purchase_batch, "charges"),
+    )
+    for model, run_batch, counter in jobs:
+        ids = list(due(model, until, user).order_by("pk").values_list("pk", flat=True))
+        for batch in _batches(ids, batch_size):
+            with db_transaction.atomic():
+                created, advanced = run_batch(batch, until)
+            result[counter] += created
+            result["schedules"] += advanced
+    return result
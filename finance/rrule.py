@@ -0,0 +1,107 @@
+"""Regras de recorrência (no estilo RRULE) e expansão de ocorrências: funções puras.
+
+Uma regra parte da data âncora (a próxima ocorrência, índice 0) e a k-ésima
+ocorrência é calculada diretamente a partir de k. Para expandir um intervalo,
+os índices inicial e final são obtidos por aritmética e as datas geradas de uma
+vez, sem percorrer a série desde a âncora: o custo depende só do número de
+ocorrências dentro do intervalo.
+"""
+import calendar
+from collections import namedtuple
+from datetime import date, timedelta
+
+from .invoice_calendar import add_months
+
+
+MONTHLY = "MONTHLY"
+WEEKLY = "WEEKLY"
+BIWEEKLY = "BIWEEKLY"
+YEARLY = "YEARLY"
+LAST_BUSINESS_DAY = "LAST_BDAY"
+
+# Passo em dias ou em meses de cada frequência, multiplicado pelo intervalo
+DAY_STEPS = {WEEKLY: 7, BIWEEKLY: 14}
+MONTH_STEPS = {MONTHLY: 1, YEARLY: 12, LAST_BUSINESS_DAY: 1}
+
+
+def last_business_day(year, month):
+    """Último dia útil (segunda a sexta) do mês; feriados não são considerados."""
+    last = date(year, month, calendar.monthrange(year, month)[1])
+    return last - timedelta(days=max(last.weekday() - 4, 0))
+
+
+def _month_index(d):
+    return d.year * 12 + d.month - 1
+
+
+def _ceil_div(a, b):
+    return -(-a // b)
+
+
+class Rule(namedtuple("Rule", "frequency interval day_of_month anchor remaining until")):
+    """Regra de recorrência.
+
+    anchor é a próxima ocorrência; remaining limita quantas ainda restam (None =
+    sem limite) e until é a última data permitida (None = sem fim).
+    """
+
+    @property
+    def step(self):
+        interval = max(self.interval or 1, 1)
+        if self.frequency in DAY_STEPS:
+            return DAY_STEPS[self.frequency] * interval
+        return MONTH_STEPS[self.frequency] * interval
+
+    def nth(self, k):
+        """Data da k-ésima ocorrência (k = 0 é a âncora, ajustada à regra quando preciso)."""
+        if self.frequency == LAST_BUSINESS_DAY:
+            # Inclusive para k = 0: a ocorrência do mês da âncora é o seu último dia útil
+            target = add_months(self.anchor, self.step * k, 1)
+            return last_business_day(target.year, target.month)
+        if k == 0:
+            return self.anchor
+        if self.frequency in DAY_STEPS:
+            return self.anchor + timedelta(days=self.step * k)
+        return add_months(self.anchor, self.step * k, self.day_of_month)
+
+    def _first_index(self, start):
+        """Menor k com nth(k) >= start."""
+        if start <= self.nth(0):
+            return 0
+        if self.frequency in DAY_STEPS:
+            return _ceil_div((start - self.anchor).days, self.step)
+        k = max(_ceil_div(_month_index(start) - _month_index(self.anchor), self.step), 1)
+        return k if self.nth(k) >= start else k + 1
+
+    def _last_index(self, end):
+        """Maior k com nth(k) <= end (-1 se nenhum)."""
+        if end < self.nth(0):
+            return -1
+        if self.frequency in DAY_STEPS:
+            return (end - self.anchor).days // self.step
+        k = (_month_index(end) - _month_index(self.anchor)) // self.step
+        return k if k == 0 or self.nth(k) <= end else k - 1
+
+    def iter_between(self, start, end, reverse=False):
+        """Gera as ocorrências em [start, end] sob demanda, em ordem crescente ou decrescente."""
+        if self.until is not None:
+            end = min(end, self.until)
+        first, last = self._first_index(start), self._last_index(end)
+        if self.remaining is not None:
+            last = min(last, self.remaining - 1)
+        indexes = range(last, first - 1, -1) if reverse else range(first, last + 1)
+        return (self.nth(k) for k in indexes)
+
+    def between(self, start, end):
+        """Ocorrências em [start, end], limitadas por until e remaining."""
+        return list(self.iter_between(start, end))
+
+    def upto(self, end):
+        """Ocorrências pendentes, da primeira (nth(0)) até end."""
+        return self.between(self.nth(0), end)
+
+    def preview(self, n):
+        """As próximas n ocorrências."""
+        last = n - 1 if self.remaining is None else min(n, self.remaining) - 1
+        dates = [self.nth(k) for k in range(last + 1)]
+        return [d for d in dates if self.until is None or d <= self.until]
@@ -0,0 +1,112 @@
+"""Busca textual nas descrições de lançamentos e compras no cartão.
+
+No SQLite usa os índices FTS5 criados pela migração 0011 (tokenizador unicode61
+sem acentos, com busca por prefixo). Em outros bancos recorre a icontains.
+"""
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import CardCharge, Transaction
+
+
+SEARCH_INDEXES = {
+    Transaction: "finance_transaction_fts",
+    CardCharge: "finance_cardcharge_fts",
+}
+
+
+def search_terms(text):
+    return re.findall(r"\w+", text or "")
+
+
+def match_query(text):
+    """Expressão MATCH do FTS5: todos os termos, cada um como prefixo."""
+    return " AND ".join(f'"{term}"*' for term in search_terms(text))
+
+
+def fts_enabled():
+    return connection.vendor == "sqlite"
+
+
+def filter_by_description(queryset, text):
+    """Restringe o queryset (Transaction ou CardCharge) às descrições que casam com text."""
+    terms = search_terms(text)
+    if not terms:
+        return queryset
+    if fts_enabled():
+        table = SEARCH_INDEXES[queryset.model]
+        ids = RawSQL(f"SELECT rowid FROM {table} WHERE {table} MATCH %s", [match_query(text)])
+        return queryset.filter(id__in=ids)
+    for term in terms:
+        queryset = queryset.filter(description__icontains=term)
+    return queryset
+
+
+def install_search_index():
+    """(Re)cria as tabelas FTS5 e os gatilhos, se faltarem, e reconstrói os índices.
+
+    Necessário quando uma migração recria finance_transaction ou finance_cardcharge
+    no SQLite (os gatilhos são descartados junto com a tabela antiga).
+    """
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        for model, fts in SEARCH_INDEXES.items():
+            table = model._meta.db_table
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(description, content='{table}', "
+                "content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {fts}(rowid, description) VALUES (new.id, new.description); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, description) VALUES ('delete', old.id, old.description); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF description ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, description) VALUES ('delete', old.id, old.description); "
+                f"INSERT INTO {fts}(rowid, description) VALUES (new.id, new.description); END"
+            )
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def search(user, text, limit=50):
+    """Resultados de lançamentos e compras no cartão, ordenados por relevância (bm25).
+
+    Retorna uma lista de (tipo, objeto) com tipo "transaction" ou "charge".
+    """
+    if not search_terms(text):
+        return []
+    if fts_enabled():
+        sql = (
+            "SELECT kind, id FROM ("
+            " SELECT 'transaction' AS kind, t.id AS id, bm25(finance_transaction_fts) AS rank"
+            " FROM finance_transaction_fts JOIN finance_transaction t ON t.id = finance_transaction_fts.rowid"
+            " WHERE finance_transaction_fts MATCH %s AND t.user_id = %s"
+            " UNION ALL"
+            " SELECT 'charge', c.id, bm25(finance_cardcharge_fts)"
+            " FROM finance_cardcharge_fts JOIN finance_cardcharge c ON c.id = finance_cardcharge_fts.rowid"
+            " JOIN finance_creditcard cc ON cc.id = c.card_id"
+            " WHERE finance_cardcharge_fts MATCH %s AND cc.user_id = %s"
+            ") ORDER BY rank LIMIT %s"
+        )
+        match = match_query(text)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [match, user.pk, match, user.pk, limit])
+            ranked = cursor.fetchall()
+    else:
+        txs = filter_by_description(Transaction.objects.filter(user=user), text).order_by("-date", "-id")
+        charges = filter_by_description(CardCharge.objects.filter(card__user=user), text).order_by("-date", "-id")
+        ranked = [("transaction", pk) for pk in txs.values_list("id", flat=True)[:limit]]
+        ranked += [("charge", pk) for pk in charges.values_list("id", flat=True)[:limit]]
+        ranked = ranked[:limit]
+
+    txs = Transaction.objects.select_related("account").in_bulk([pk for kind, pk in ranked if kind == "transaction"])
+    charges = CardCharge.objects.select_related("card", "invoice").in_bulk([pk for kind, pk in ranked if kind == "charge"])
+    objects = {"transaction": txs, "charge": charges}
+    return [(kind, objects[kind][pk]) for kind, pk in ranked if pk in objects[kind]]
@@ -1,3 +1,1530 @@
+import re
+from datetime import date
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.core.management.base import CommandError
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .aggregates import (
+    account_summaries, card_invoice_summaries, category_subtree_total, expenses_by_category, unpaid_invoices_total,
+)
+from .balances import daily_balances, set_running_balances
+from .cache import data_version, get_cache, reset_stats, stats
+from .forecast import project_cash_flow
+from .invoices import close_due_invoices, settle, settle_invoices
+from . import invoice_calendar
+from .models import (
+    Account, CardCharge, Category, CategoryClosure, CreditCard, InstallmentPlan, Invoice, InvoicePayment, MonthlyRollup,
+    RecurringCardPurchase, RecurringTransaction, Tag, Transaction, cascaded,
+)
+from .pagination import cursor_key, decode_cursor, paginate_keyset
+from .projections import projected_source, projection_schedules
+from .purchases import create_installment_purchase, delete_installment_plan, reschedule_plan
+from .recurrence import run_recurrences
+from . import rrule
+from .search import filter_by_description, search
+
+
+class FinanceTestCase(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user("ana", password="x")
+        self.client.force_login(self.user)
+
+    def make_account(self, name, initial="0", active=True):
+        return Account.objects.create(user=self.user, name=name, initial_balance=Decimal(initial), active=active)
+
+    def make_tx(self, account, tx_type, amount, when, **extra):
+        return Transaction.objects.create(
+            user=self.user, account=account, type=tx_type, date=when,
+            description=extra.pop("description", "Lançamento"), amount=Decimal(amount), **extra,
+        )
+
+    def make_card(self, name="Cartão", closing_day=10, due_day=20, **extra):
+        return CreditCard.objects.create(user=self.user, name=name, closing_day=closing_day, due_day=due_day, **extra)
+
+    def make_charge(self, card, amount, when, **extra):
+        charge = CardCharge(
+            card=card, date=when, description=extra.pop("description", "Compra"),
+            total_amount=Decimal(amount), **extra,
+        )
+        charge.save()
+        return charge
+
+
+class AccountSummariesTests(FinanceTestCase):
+    def test_totals_per_account_and_month(self):
+        acc = self.make_account("Banco", "100")
+        inactive = self.make_account("Antiga", active=False)
+        self.make_tx(acc, "IN", "50", date(2026, 1, 10))
+        self.make_tx(acc, "OUT", "20", date(2026, 3, 5))
+        self.make_tx(acc, "IN", "30", date(2026, 4, 2))
+        self.make_tx(inactive, "OUT", "7", date(2026, 3, 9))
+
+        with self.assertNumQueries(1):
+            summary = account_summaries(self.user, date(2026, 3, 1), date(2026, 4, 1))
+
+        [item] = summary["account_balances"]
+        self.assertEqual(item["account"], acc)
+        self.assertEqual(item["balance"], Decimal("160"))
+        self.assertEqual(item["total_income"], Decimal("80"))
+        self.assertEqual(item["total_outcome"], Decimal("20"))
+        self.assertEqual(item["month_income"], Decimal("0"))
+        self.assertEqual(item["month_outcome"], Decimal("20"))
+        self.assertEqual(summary["month_outcome_total"], Decimal("27"))
+        self.assertEqual(summary["next_month_income_total"], Decimal("30"))
+
+    def test_dashboard_queries_do_not_grow_with_accounts(self):
+        def count_dashboard_queries():
+            from django.db import connection
+            from django.test.utils import CaptureQueriesContext
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(reverse("finance:dashboard"))
+            return len(ctx.captured_queries)
+
+        self.make_tx(self.make_account("A"), "IN", "10", date.today())
+        baseline = count_dashboard_queries()
+        for i in range(5):
+            self.make_tx(self.make_account(f"Conta {i}"), "OUT", "3", date.today())
+        self.assertEqual(count_dashboard_queries(), baseline)
+
+
+class CardInvoiceSummariesTests(FinanceTestCase):
+    def test_totals_by_status(self):
+        card = self.make_card()
+        c1 = self.make_charge(card, "100", date(2026, 1, 5))
+        c2 = self.make_charge(card, "40", date(2026, 2, 5))
+        self.make_charge(card, "15", date(2026, 2, 6))
+        Invoice.objects.filter(pk=c1.invoice_id).update(status=Invoice.Status.PAID)
+        Invoice.objects.filter(pk=c2.invoice_id).update(status=Invoice.Status.PARTIAL)
+        InvoicePayment.objects.create(invoice=c1.invoice, amount=Decimal("100"))
+        InvoicePayment.objects.create(invoice=c2.invoice, amount=Decimal("10"))
+
+        [item] = card_invoice_summaries(self.user)
+        self.assertEqual(item["paid_total"], Decimal("100"))
+        self.assertEqual(item["partial_total"], Decimal("55"))
+        self.assertEqual(item["open_total"], Decimal("0"))
+        self.assertEqual(item["total_charges"], Decimal("155"))
+        self.assertEqual(item["total_payments"], Decimal("110"))
+        self.assertEqual(item["balance"], Decimal("45"))
+
+    def test_query_count_independent_of_invoice_history(self):
+        cards = [self.make_card("A"), self.make_card("B")]
+        for card in cards:
+            self.make_charge(card, "10", date(2026, 1, 5))
+        with self.assertNumQueries(2):
+            card_invoice_summaries(self.user)
+        for card in cards:
+            for month in range(2, 13):
+                self.make_charge(card, "10", date(2025, month, 5))
+        with self.assertNumQueries(2):
+            card_invoice_summaries(self.user)
+
+    def test_unpaid_invoices_total(self):
+        card = self.make_card()
+        charge = self.make_charge(card, "80", date(2026, 3, 2))
+        InvoicePayment.objects.create(invoice=charge.invoice, amount=Decimal("30"))
+        due = charge.invoice.due_date
+        self.assertEqual(unpaid_invoices_total(self.user, due, due), Decimal("50"))
+
+
+class InvoiceTotalsTests(FinanceTestCase):
+    def assertTotals(self, invoice, charges, payments):
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.charges_total, Decimal(charges))
+        self.assertEqual(invoice.payments_total, Decimal(payments))
+
+    def test_totals_follow_charge_and_payment_writes(self):
+        card = self.make_card()
+        charge = self.make_charge(card, "100", date(2026, 1, 5))
+        jan = charge.invoice
+        self.make_charge(card, "50", date(2026, 1, 6))
+        payment = InvoicePayment.objects.create(invoice=jan, amount=Decimal("30"))
+        self.assertTotals(jan, "150", "30")
+
+        payment.amount = Decimal("45")
+        payment.save()
+        charge.total_amount = Decimal("120")
+        charge.save()
+        self.assertTotals(jan, "170", "45")
+
+        # Mover a compra de mês leva o valor para a outra fatura
+        charge.date = date(2026, 2, 5)
+        charge.save()
+        self.assertNotEqual(charge.invoice_id, jan.pk)
+        self.assertTotals(jan, "50", "45")
+        self.assertTotals(charge.invoice, "120", "0")
+
+        payment.delete()
+        CardCharge.objects.filter(pk=charge.pk).delete()
+        self.assertTotals(jan, "50", "0")
+
+    def test_balance_reads_without_queries(self):
+        card = self.make_card()
+        charge = self.make_charge(card, "80", date(2026, 1, 5))
+        InvoicePayment.objects.create(invoice=charge.invoice, amount=Decimal("20"))
+        inv = Invoice.objects.get(pk=charge.invoice_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(inv.balance(), Decimal("60"))
+
+    def test_stale_instance_save_keeps_totals(self):
+        card = self.make_card()
+        charge = self.make_charge(card, "80", date(2026, 1, 5))
+        stale = Invoice.objects.get(pk=charge.invoice_id)
+        InvoicePayment.objects.create(invoice=stale, amount=Decimal("20"))
+        stale.status = Invoice.Status.PARTIAL
+        stale.save()
+        self.assertTotals(stale, "80", "20")
+
+    def test_rebuild_command_detects_and_fixes_drift(self):
+        card = self.make_card()
+        charge = self.make_charge(card, "80", date(2026, 1, 5))
+        Invoice.objects.filter(pk=charge.invoice_id).update(charges_total=Decimal("1"))
+        with self.assertRaises(CommandError):
+            call_command("rebuild_invoice_totals", "--check", stdout=StringIO())
+        call_command("rebuild_invoice_totals", stdout=StringIO())
+        self.assertTotals(charge.invoice, "80", "0")
+        call_command("rebuild_invoice_totals", "--check", stdout=StringIO())
+
+
+class InvoiceSettlementTests(FinanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = self.make_account("Conta", "1000")
+        self.card = self.make_card()
+        self.charge = self.make_charge(self.card, "100", date(2026, 1, 5))
+        self.invoice = self.charge.invoice
+
+    def assertStatus(self, invoice, expected):
+        invoice.refresh_from_db(fields=["status"])
+        self.assertEqual(invoice.status, expected)
+
+    def test_settle_transitions(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(settle(self.invoice), Invoice.Status.OPEN)
+        payment = InvoicePayment.objects.create(invoice=self.invoice, amount=Decimal("40"))
+        # Leitura, UPDATE só do status e invalidação do cache pelo sinal
+        with self.assertNumQueries(3):
+            self.assertEqual(settle(self.invoice), Invoice.Status.PARTIAL)
+        payment.amount = Decimal("100")
+        payment.save()
+        settle(self.invoice)
+        self.assertStatus(self.invoice, Invoice.Status.PAID)
+        payment.delete()
+        settle(self.invoice)
+        self.assertStatus(self.invoice, Invoice.Status.OPEN)
+
+        # Fatura fechada sem pagamentos continua fechada
+        Invoice.objects.filter(pk=self.invoice.pk).update(status=Invoice.Status.CLOSED)
+        self.assertEqual(settle(self.invoice), Invoice.Status.CLOSED)
+
+    def test_payment_views_settle_status(self):
+        url = reverse("finance:invoice_payment", kwargs={"pk": self.invoice.pk})
+        self.client.post(url, {"account": self.account.pk, "date": "2026-02-10", "amount": "30", "kind": "PARTIAL"})
+        self.assertStatus(self.invoice, Invoice.Status.PARTIAL)
+        payment = InvoicePayment.objects.get()
+        self.client.post(
+            reverse("finance:invoice_payment_update", kwargs={"pk": payment.pk}),
+            {"account": self.account.pk, "date": "2026-02-10", "amount": "100", "kind": "TOTAL"},
+        )
+        self.assertStatus(self.invoice, Invoice.Status.PAID)
+        self.client.post(reverse("finance:invoice_payment_delete", kwargs={"pk": payment.pk}))
+        self.assertStatus(self.invoice, Invoice.Status.OPEN)
+
+    def test_bulk_settle_by_user_and_card(self):
+        other = self.make_card("Outro")
+        other_charge = self.make_charge(other, "50", date(2026, 1, 5))
+        InvoicePayment.objects.create(invoice=self.invoice, amount=Decimal("100"))
+        InvoicePayment.objects.create(invoice=other_charge.invoice, amount=Decimal("10"))
+        self.assertEqual(settle_invoices(card=self.card), 1)
+        self.assertStatus(self.invoice, Invoice.Status.PAID)
+        self.assertStatus(other_charge.invoice, Invoice.Status.OPEN)
+
+        version = data_version(self.user.pk)
+        # Usuários afetados, UPDATE e invalidação do cache
+        with self.assertNumQueries(3):
+            self.assertEqual(settle_invoices(user=self.user), 1)
+        self.assertStatus(other_charge.invoice, Invoice.Status.PARTIAL)
+        self.assertGreater(data_version(self.user.pk), version)
+        self.assertEqual(settle_invoices(user=self.user), 0)
+
+    def test_bulk_settle_refreshes_totals_after_import(self):
+        # Importação direta: totais e status armazenados ficaram para trás
+        InvoicePayment.objects.bulk_create([InvoicePayment(invoice=self.invoice, amount=Decimal("100"))])
+        self.assertEqual(settle_invoices(user=self.user), 0)
+        self.assertEqual(settle_invoices(user=self.user, refresh_totals=True), 1)
+        self.assertStatus(self.invoice, Invoice.Status.PAID)
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.committed_amount, Decimal("0"))
+
+    def test_rebuild_command_settles(self):
+        Invoice.objects.filter(pk=self.invoice.pk).update(payments_total=Decimal("100"))
+        call_command("rebuild_invoice_totals", "--settle", stdout=StringIO())
+        self.assertStatus(self.invoice, Invoice.Status.OPEN)
+        InvoicePayment.objects.bulk_create([InvoicePayment(invoice=self.invoice, amount=Decimal("100"))])
+        call_command("rebuild_invoice_totals", "--settle", stdout=StringIO())
+        self.assertStatus(self.invoice, Invoice.Status.PAID)
+
+
+class InvoiceClosingTests(FinanceTestCase):
+    def test_closes_due_invoices_and_projects_next(self):
+        card = self.make_card(closing_day=10, due_day=20)
+        other = self.make_card("Outro", closing_day=25, due_day=5)
+        jan = self.make_charge(card, "100", date(2026, 1, 5)).invoice
+        feb = self.make_charge(card, "40", date(2026, 2, 5)).invoice
+        later = self.make_charge(other, "60", date(2026, 2, 5)).invoice
+        InvoicePayment.objects.create(invoice=jan, amount=Decimal("30"))
+        settle(jan)
+        # Fatura antiga sem datas gravadas
+        Invoice.objects.filter(pk=feb.pk).update(closing_date=None, due_date=None)
+
+        version = data_version(self.user.pk)
+        # Número fixo de consultas (com o savepoint), independente de quantos cartões há
+        with self.assertNumQueries(11):
+            result = close_due_invoices(date(2026, 2, 10))
+        self.assertEqual(result, {"closed": 2, "cards": 1, "opened": 1})
+        statuses = dict(Invoice.objects.values_list("pk", "status"))
+        self.assertEqual(statuses[jan.pk], Invoice.Status.CLOSED)
+        self.assertEqual(statuses[feb.pk], Invoice.Status.CLOSED)
+        self.assertEqual(statuses[later.pk], Invoice.Status.OPEN)
+        feb.refresh_from_db()
+        self.assertEqual((feb.closing_date, feb.due_date), (date(2026, 2, 10), date(2026, 2, 20)))
+        self.assertEqual(
+            Invoice.objects.get(card=card, year=2026, month=3).status, Invoice.Status.OPEN,
+        )
+        self.assertGreater(data_version(self.user.pk), version)
+
+        # Nova execução no mesmo dia não muda nada; compras novas vão para a fatura projetada
+        self.assertEqual(close_due_invoices(date(2026, 2, 10)), {"closed": 0, "cards": 0, "opened": 0})
+        self.assertEqual(self.make_charge(card, "10", date(2026, 2, 9)).invoice.month, 3)
+
+    def test_projects_next_invoice_for_cards_without_due_invoices(self):
+        card = self.make_card(closing_day=10, due_day=20)
+        self.make_charge(card, "100", date(2026, 1, 5))
+        idle = self.make_card("Sem compras", closing_day=25, due_day=5)
+        self.make_card("Inativo", active=False)
+        result = close_due_invoices(date(2026, 2, 10))
+        self.assertEqual(result, {"closed": 1, "cards": 1, "opened": 2})
+        invoice = Invoice.objects.get(card=idle)
+        self.assertEqual((invoice.year, invoice.month, invoice.status), (2026, 2, Invoice.Status.OPEN))
+        self.assertEqual(invoice.closing_date, date(2026, 2, 25))
+        self.assertEqual(Invoice.objects.filter(card__name="Inativo").count(), 0)
+
+    def test_catch_up_skips_to_first_future_invoice(self):
+        card = self.make_card(closing_day=10, due_day=20)
+        self.make_charge(card, "100", date(2026, 1, 5))
+        out = StringIO()
+        call_command("close_invoices", "--date", "2026-05-15", "--user", "ana", stdout=out)
+        self.assertIn("1 fatura(s) fechada(s)", out.getvalue())
+        self.assertEqual(
+            list(Invoice.objects.filter(card=card).order_by("year", "month").values_list("month", "status")),
+            [(1, Invoice.Status.CLOSED), (6, Invoice.Status.OPEN)],
+        )
+        with self.assertRaises(CommandError):
+            call_command("close_invoices", "--date", "ontem", stdout=StringIO())
+
+
+class AccountBalanceStoreTests(FinanceTestCase):
+    def assertBalance(self, account, expected):
+        account.refresh_from_db()
+        self.assertEqual(account.balance(), Decimal(expected))
+
+    def test_balance_follows_transaction_writes(self):
+        acc = self.make_account("Banco", "100")
+        other = self.make_account("Carteira")
+        tx = self.make_tx(acc, "IN", "50", date(2026, 1, 10))
+        self.make_tx(acc, "OUT", "20", date(2026, 1, 11))
+        self.assertBalance(acc, "130")
+
+        tx.amount = Decimal("70")
+        tx.save()
+        self.assertBalance(acc, "150")
+        tx.type = "OUT"
+        tx.save()
+        self.assertBalance(acc, "10")
+        tx.account = other
+        tx.save()
+        self.assertBalance(acc, "80")
+        self.assertBalance(other, "-70")
+        tx.delete()
+        self.assertBalance(other, "0")
+
+    def test_transfer_pair_deletion(self):
+        a = self.make_account("A", "100")
+        b = self.make_account("B")
+        self.client.post(reverse("finance:transfer_create"), {
+            "from_account": a.pk, "to_account": b.pk, "date": "2026-01-10",
+            "description": "PIX", "amount": "40",
+        })
+        self.assertBalance(a, "60")
+        self.assertBalance(b, "40")
+        tx = Transaction.objects.filter(account=a).get()
+        self.client.post(reverse("finance:transaction_delete", args=[tx.pk]))
+        self.assertBalance(a, "100")
+        self.assertBalance(b, "0")
+
+    def test_account_form_does_not_overwrite_totals(self):
+        acc = self.make_account("Banco")
+        stale = Account.objects.get(pk=acc.pk)
+        self.make_tx(acc, "IN", "25", date(2026, 1, 10))
+        stale.name = "Banco Novo"
+        stale.save()
+        self.assertBalance(acc, "25")
+
+    def test_reconcile_command_repairs_drift(self):
+        acc = self.make_account("Banco", "10")
+        self.make_tx(acc, "IN", "25", date(2026, 1, 10))
+        Account.objects.filter(pk=acc.pk).update(income_total=Decimal("0"))
+        with self.assertRaises(CommandError):
+            call_command("reconcile_account_balances", "--check", stdout=StringIO())
+        call_command("reconcile_account_balances", stdout=StringIO())
+        self.assertBalance(acc, "35")
+
+
+class MonthlyRollupTests(FinanceTestCase):
+    def rollup(self, **filters):
+        return {
+            (r.account_id, r.card_id, r.category_id, r.type, r.year, r.month): (r.total, r.count)
+            for r in MonthlyRollup.objects.filter(user=self.user, **filters).exclude(count=0)
+        }
+
+    def test_incremental_matches_rebuild(self):
+        food = Category.objects.create(user=self.user, name="Mercado", kind="EXPENSE")
+        acc = self.make_account("Banco")
+        card = self.make_card()
+        tx = self.make_tx(acc, "OUT", "30", date(2026, 1, 10), category=food)
+        self.make_tx(acc, "OUT", "12", date(2026, 1, 15), category=food)
+        self.make_tx(acc, "IN", "500", date(2026, 1, 5))
+        charge = self.make_charge(card, "99", date(2026, 1, 20), category=food)
+        self.make_charge(card, "10", date(2026, 2, 2))
+
+        tx.date = date(2026, 2, 1)
+        tx.save()
+        charge.total_amount = Decimal("90")
+        charge.save()
+        Transaction.objects.filter(type="IN").delete()
+
+        incremental = self.rollup()
+        self.assertEqual(incremental[(acc.pk, None, food.pk, "OUT", 2026, 1)], (Decimal("12"), 1))
+        self.assertEqual(incremental[(acc.pk, None, food.pk, "OUT", 2026, 2)], (Decimal("30"), 1))
+        self.assertEqual(incremental[(None, card.pk, food.pk, "CARD", 2026, 1)], (Decimal("90"), 1))
+
+        call_command("rebuild_rollups", stdout=StringIO())
+        self.assertEqual(self.rollup(), incremental)
+
+    def test_concurrent_insert_is_merged(self):
+        acc = self.make_account("Banco")
+        raced = []
+
+        def competing_writer(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            # Simula outra escrita que cria a mesma linha logo depois da leitura feita por apply()
+            if sql.startswith("SELECT") and 'FROM "finance_monthlyrollup"' in sql and not raced:
+                raced.append(True)
+                MonthlyRollup.objects.create(
+                    user=self.user, account=acc, type="OUT", year=2026, month=1, total=Decimal("5"), count=1,
+                )
+            return result
+
+        with connection.execute_wrapper(competing_writer):
+            self.make_tx(acc, "OUT", "30", date(2026, 1, 10))
+        self.assertTrue(raced)
+        self.assertEqual(self.rollup(), {(acc.pk, None, None, "OUT", 2026, 1): (Decimal("35"), 2)})
+
+    def test_missing_row_is_reported_outside_cascades(self):
+        acc = self.make_account("Banco")
+        tx = self.make_tx(acc, "OUT", "30", date(2026, 1, 10))
+        self.make_tx(acc, "IN", "50", date(2026, 1, 11))
+        MonthlyRollup.objects.filter(type="OUT").delete()
+        with self.assertLogs("finance.models", "WARNING") as logs:
+            tx.delete()
+        self.assertIn("rebuild_rollups", logs.output[0])
+        # Em cascata o dono leva os consolidados junto: a ausência é esperada
+        self.assertTrue(cascaded(Transaction, acc))
+        self.assertFalse(cascaded(Transaction, Transaction.objects.filter(pk=tx.pk)))
+        with self.assertNoLogs("finance.models", "WARNING"):
+            MonthlyRollup.apply({(self.user.pk, acc.pk, None, None, "OUT", 2025, 1): (Decimal("-5"), -1)}, cascade=True)
+
+        self.make_tx(acc, "OUT", "5", date(2026, 2, 1))
+        MonthlyRollup.objects.filter(type="IN").update(total=Decimal("1"))
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("rebuild_rollups", "--check", stdout=out)
+        self.assertIn("armazenado (Decimal('1.00'), 1)", out.getvalue())
+        call_command("rebuild_rollups", stdout=StringIO())
+        call_command("rebuild_rollups", "--check", stdout=StringIO())
+
+    def test_owner_deletion_cascades_cleanly(self):
+        acc = self.make_account("Banco")
+        self.make_tx(acc, "OUT", "30", date(2026, 1, 10))
+        with self.assertNoLogs("finance.models", "WARNING"):
+            acc.delete()
+        self.assertFalse(MonthlyRollup.objects.exists())
+
+        self.make_tx(self.make_account("Outra"), "IN", "5", date(2026, 1, 10))
+        with self.assertNoLogs("finance.models", "WARNING"):
+            self.user.delete()
+        self.assertFalse(MonthlyRollup.objects.exists())
+
+
+class ExpensesByCategoryTests(FinanceTestCase):
+    def test_grouped_and_sorted_pairs(self):
+        home = Category.objects.create(user=self.user, name="Casa", kind="EXPENSE")
+        rent = Category.objects.create(user=self.user, name="Aluguel", kind="EXPENSE", parent=home)
+        power = Category.objects.create(user=self.user, name="Energia", kind="EXPENSE", parent=home)
+        fun = Category.objects.create(user=self.user, name="Lazer", kind="EXPENSE")
+        acc = self.make_account("Banco")
+        self.make_tx(acc, "OUT", "1000", date(2026, 3, 5), category=rent)
+        self.make_tx(acc, "OUT", "150", date(2026, 3, 6), category=power)
+        self.make_tx(acc, "OUT", "300", date(2026, 3, 7), category=fun)
+        self.make_tx(acc, "OUT", "20", date(2026, 3, 8))
+        self.make_tx(acc, "OUT", "999", date(2026, 4, 1), category=fun)
+        self.make_charge(self.make_card(), "80", date(2026, 3, 9), category=fun)
+
+        with self.assertNumQueries(1):
+            pairs = expenses_by_category(self.user, date(2026, 3, 1))
+        self.assertEqual(pairs, [
+            ("Aluguel", Decimal("1000")), ("Lazer", Decimal("300")),
+            ("Energia", Decimal("150")), ("Sem categoria", Decimal("20")),
+        ])
+        self.assertEqual(
+            expenses_by_category(self.user, date(2026, 3, 1), by_parent=True),
+            [("Casa", Decimal("1150")), ("Lazer", Decimal("300")), ("Sem categoria", Decimal("20"))],
+        )
+        self.assertEqual(expenses_by_category(self.user, date(2026, 3, 1), "card"), [("Lazer", Decimal("80"))])
+
+    def test_dashboard_renders_breakdown(self):
+        home = Category.objects.create(user=self.user, name="Casa", kind="EXPENSE")
+        rent = Category.objects.create(user=self.user, name="Aluguel", kind="EXPENSE", parent=home)
+        self.make_tx(self.make_account("Banco"), "OUT", "1000", date.today(), category=rent)
+        self.assertContains(self.client.get(reverse("finance:dashboard")), "Aluguel")
+        self.assertContains(self.client.get(reverse("finance:dashboard") + "?by_parent=1"), "Casa")
+
+
+class CategoryClosureTests(FinanceTestCase):
+    def make_category(self, name, parent=None):
+        return Category.objects.create(user=self.user, name=name, kind="EXPENSE", parent=parent)
+
+    def ancestors(self, category):
+        return set(category.ancestor_links.values_list("ancestor__name", "depth"))
+
+    def test_closure_follows_create_and_move(self):
+        home = self.make_category("Casa")
+        bills = self.make_category("Contas", home)
+        power = self.make_category("Energia", bills)
+        self.assertEqual(self.ancestors(power), {("Energia", 0), ("Contas", 1), ("Casa", 2)})
+
+        other = self.make_category("Fixas")
+        bills.parent = other
+        bills.save()
+        self.assertEqual(self.ancestors(power), {("Energia", 0), ("Contas", 1), ("Fixas", 2)})
+        self.assertEqual(self.ancestors(home), {("Casa", 0)})
+
+        power.delete()
+        self.assertFalse(CategoryClosure.objects.filter(descendant_id=power.pk).exists())
+
+    def test_edit_form_rejects_cycles(self):
+        home = self.make_category("Casa")
+        bills = self.make_category("Contas", home)
+        resp = self.client.post(reverse("finance:category_update", args=[home.pk]), {
+            "name": "Casa", "kind": "EXPENSE", "parent": bills.pk,
+        })
+        self.assertEqual(resp.status_code, 200)
+        home.refresh_from_db()
+        self.assertIsNone(home.parent_id)
+        with self.assertRaises(ValidationError):
+            home.parent = bills
+            home.full_clean()
+
+    def test_subtree_filters_and_totals(self):
+        home = self.make_category("Casa")
+        bills = self.make_category("Contas", home)
+        power = self.make_category("Energia", bills)
+        acc = self.make_account("Banco")
+        self.make_tx(acc, "OUT", "100", date(2026, 3, 5), category=power)
+        self.make_tx(acc, "OUT", "40", date(2026, 3, 6), category=home)
+        self.make_tx(acc, "OUT", "7", date(2026, 3, 7), category=self.make_category("Lazer"))
+
+        total = category_subtree_total(self.user, home, date(2026, 3, 1), date(2026, 3, 31))
+        self.assertEqual(total, Decimal("140"))
+        self.assertEqual(
+            expenses_by_category(self.user, date(2026, 3, 1), by_parent=True),
+            [("Casa", Decimal("140")), ("Lazer", Decimal("7"))],
+        )
+        resp = self.client.get(reverse("finance:statement"), {"account": acc.pk, "category": bills.pk})
+        self.assertEqual(len(resp.context["object_list"]), 1)
+
+
+class VersionedCacheTests(FinanceTestCase):
+    def test_dashboard_is_cached_until_data_changes(self):
+        acc = self.make_account("Banco", "100")
+        reset_stats()
+        self.client.get(reverse("finance:dashboard"))
+        with self.assertNumQueries(2):  # sessão e usuário; versão e contexto vêm do cache
+            self.client.get(reverse("finance:dashboard"))
+        self.assertEqual(stats()["hits"], 1)
+
+        self.make_tx(acc, "IN", "25", date.today())
+        resp = self.client.get(reverse("finance:dashboard"))
+        self.assertEqual(resp.context["account_balances"][0]["balance"], Decimal("125"))
+        self.assertEqual(stats()["misses"], 2)
+
+    def test_repair_commands_invalidate_cached_dashboard(self):
+        acc = self.make_account("Banco", "100")
+        self.make_tx(acc, "OUT", "40", date.today())
+        card = self.make_card()
+        self.make_charge(card, "80", date.today())
+
+        # Totais e consolidados corrompidos por fora dos sinais; o painel cacheado mostra o valor errado
+        Account.objects.filter(pk=acc.pk).update(outcome_total=Decimal("0"))
+        Invoice.objects.filter(card=card).update(charges_total=Decimal("1"))
+        MonthlyRollup.objects.filter(user=self.user).delete()
+
+        def dashboard():
+            ctx = self.client.get(reverse("finance:dashboard")).context
+            return (
+                ctx["account_balances"][0]["balance"],
+                ctx["card_invoice_totals"][0]["total_charges"],
+                ctx["month_outcome_total"],
+            )
+
+        self.assertEqual(dashboard(), (Decimal("100"), Decimal("1"), Decimal("0")))
+        call_command("reconcile_account_balances", stdout=StringIO())
+        self.assertEqual(dashboard(), (Decimal("60"), Decimal("1"), Decimal("0")))
+        call_command("rebuild_invoice_totals", stdout=StringIO())
+        self.assertEqual(dashboard(), (Decimal("60"), Decimal("80"), Decimal("0")))
+        call_command("rebuild_rollups", stdout=StringIO())
+        self.assertEqual(dashboard(), (Decimal("60"), Decimal("80"), Decimal("40")))
+
+    def test_versions_are_per_user(self):
+        other = User.objects.create_user("bia", password="x")
+        before = data_version(other.pk)
+        self.make_account("Banco")
+        self.assertEqual(data_version(other.pk), before)
+        self.assertGreater(data_version(self.user.pk), 0)
+
+    def test_tag_changes_invalidate_statement(self):
+        acc = self.make_account("Banco")
+        tx = self.make_tx(acc, "OUT", "10", date(2026, 1, 5))
+        tag = Tag.objects.create(user=self.user, name="viagem")
+        url = reverse("finance:statement") + f"?account={acc.pk}&tag={tag.pk}"
+        self.assertEqual(len(self.client.get(url).context["object_list"]), 0)
+        tx.tags.add(tag)
+        self.assertEqual(len(self.client.get(url).context["object_list"]), 1)
+
+    def test_stats_endpoint_requires_staff(self):
+        url = reverse("finance:cache_stats")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(set(self.client.get(url).json()), {"hits", "misses", "hit_rate"})
+
+
+class ForecastTests(FinanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.acc = self.make_account("Banco", "100")
+        self.make_tx(self.acc, "IN", "30", date(2025, 12, 20))
+        self.make_tx(self.acc, "OUT", "20", date(2026, 1, 10))
+        RecurringTransaction.objects.create(
+            user=self.user, account=self.acc, type="IN", description="Salário", amount=Decimal("50"),
+            day_of_month=5, start_date=date(2026, 1, 5), next_date=date(2026, 1, 5),
+        )
+        card = self.make_card(closing_day=10, due_day=20)
+        self.make_charge(card, "100", date(2026, 1, 5))
+        RecurringCardPurchase.objects.create(
+            user=self.user, card=card, description="Assinatura", total_amount=Decimal("60"),
+            installments_total=2, day_of_month=15, next_date=date(2026, 1, 15),
+        )
+
+    def test_projects_balances_day_by_day(self):
+        forecast = project_cash_flow(self.user, months=2, start=date(2026, 1, 1))
+        days = forecast["days"]
+        self.assertEqual((days[0], days[-1]), (date(2026, 1, 1), date(2026, 3, 1)))
+        balances = forecast["accounts"][0]["balances"]
+        self.assertEqual(balances[0], Decimal("130"))
+        self.assertEqual(balances[days.index(date(2026, 1, 31))], Decimal("160"))
+        self.assertEqual(balances[-1], Decimal("210"))
+        # Fatura aberta vence em 20/01; 1ª parcela virtual cai na fatura de fevereiro
+        self.assertEqual(forecast["invoices"][days.index(date(2026, 1, 20))], Decimal("-100"))
+        self.assertEqual(forecast["invoices"][-1], Decimal("-130"))
+        self.assertEqual(forecast["total"][-1], Decimal("80"))
+        # Nada foi gravado
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertEqual(CardCharge.objects.count(), 1)
+
+    def test_transfers_are_not_projected(self):
+        wallet = self.make_account("Carteira", "150")
+        self.make_tx(wallet, "TRX", "30", date(2026, 1, 3))
+        RecurringTransaction.objects.create(
+            user=self.user, account=wallet, type="TRX", description="Reserva", amount=Decimal("10"),
+            day_of_month=5, start_date=date(2026, 1, 5), next_date=date(2026, 1, 5),
+        )
+        forecast = project_cash_flow(self.user, months=2, start=date(2026, 1, 1))
+        balances = next(s["balances"] for s in forecast["accounts"] if s["id"] == wallet.pk)
+        wallet.refresh_from_db()
+        self.assertEqual(balances[0], wallet.balance())
+        self.assertEqual(balances[-1], wallet.balance())
+
+    def test_parcels_follow_the_booked_split(self):
+        start = date(2026, 1, 1)
+        before = project_cash_flow(self.user, months=4, start=start)
+        card = self.make_card("Outro", closing_day=10, due_day=20)
+        RecurringCardPurchase.objects.create(
+            user=self.user, card=card, description="Curso", total_amount=Decimal("100"),
+            installments_total=3, day_of_month=15, next_date=date(2026, 1, 15), count=1,
+        )
+        after = project_cash_flow(self.user, months=4, start=start)
+        days = after["days"]
+        added = [a - b for a, b in zip(after["invoices"], before["invoices"])]
+        # Mesmos valores que create_installment_purchase grava: 33,34 + 33,33 + 33,33
+        self.assertEqual(added[days.index(date(2026, 2, 20))], Decimal("-33.34"))
+        self.assertEqual(added[days.index(date(2026, 3, 20))], Decimal("-66.67"))
+        self.assertEqual(added[-1], Decimal("-100"))
+
+    def test_views(self):
+        resp = self.client.get(reverse("finance:forecast") + "?months=3")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.context["rows"]), 4)
+        data = self.client.get(reverse("finance:forecast_data") + "?months=1").json()
+        self.assertEqual(data["accounts"][0]["name"], "Banco")
+        self.assertEqual(len(data["days"]), len(data["total"]))
+
+
+class DailyBalancesTests(FinanceTestCase):
+    def test_running_balance_with_gap_filling(self):
+        acc = self.make_account("Banco", "100")
+        other = self.make_account("Poupança", "10")
+        self.make_tx(acc, "IN", "50", date(2025, 12, 31))
+        self.make_tx(acc, "OUT", "30", date(2026, 1, 2))
+        self.make_tx(acc, "IN", "5", date(2026, 1, 2))
+        self.make_tx(acc, "IN", "20", date(2026, 1, 4))
+        self.make_tx(acc, "OUT", "999", date(2026, 1, 6))
+
+        with self.assertNumQueries(2):
+            result = daily_balances(self.user, date(2026, 1, 1), date(2026, 1, 5))
+        banco, poupanca = result["accounts"]
+        self.assertEqual(banco["balances"], [Decimal(v) for v in ("150", "125", "125", "145", "145")])
+        self.assertEqual(poupanca["balances"], [Decimal("10")] * 5)
+        self.assertEqual(result["total"][-1], Decimal("155"))
+        only = daily_balances(self.user, date(2026, 1, 1), date(2026, 1, 1), accounts=[other.pk])
+        self.assertEqual([s["name"] for s in only["accounts"]], ["Poupança"])
+
+    def test_transfers_do_not_move_balance(self):
+        acc = self.make_account("Banco", "100")
+        self.make_tx(acc, "IN", "50", date(2026, 1, 2))
+        self.make_tx(acc, "TRX", "30", date(2026, 1, 3))
+        result = daily_balances(self.user, date(2026, 1, 1), date(2026, 1, 4))
+        balances = result["accounts"][0]["balances"]
+        self.assertEqual(balances, [Decimal(v) for v in ("100", "150", "150", "150")])
+        acc.refresh_from_db()
+        self.assertEqual(balances[-1], acc.balance())
+
+    def test_endpoint(self):
+        acc = self.make_account("Banco", "100")
+        self.make_tx(acc, "IN", "50", date(2026, 1, 2))
+        url = reverse("finance:balance_history")
+        data = self.client.get(url, {"start": "2026-01-01", "end": "2026-01-03"}).json()
+        self.assertEqual(data["days"], ["2026-01-01", "2026-01-02", "2026-01-03"])
+        self.assertEqual(data["total"], ["100.00", "150.00", "150.00"])
+        self.assertEqual(self.client.get(url, {"start": "2026-02-01", "end": "2026-01-01"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"start": "ontem"}).status_code, 400)
+
+
+class KeysetPaginationTests(FinanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.acc = self.make_account("Banco")
+        self.txs = [self.make_tx(self.acc, "OUT", str(i + 1), date(2026, 1, 1 + i // 2)) for i in range(7)]
+
+    def test_walks_forward_and_back(self):
+        qs = Transaction.objects.filter(user=self.user)
+        first = paginate_keyset(qs, per_page=3)
+        self.assertEqual([t.pk for t in first], [t.pk for t in self.txs[::-1][:3]])
+        self.assertFalse(first.has_previous)
+        self.assertEqual(first.outcome_total, Decimal("18"))
+
+        second = paginate_keyset(qs, first.next_cursor, per_page=3)
+        self.assertEqual([t.pk for t in second], [t.pk for t in self.txs[::-1][3:6]])
+        # Lançamentos novos não deslocam as páginas seguintes
+        self.make_tx(self.acc, "IN", "1", date(2026, 2, 1))
+        third = paginate_keyset(qs, second.next_cursor, per_page=3)
+        self.assertEqual([t.pk for t in third], [self.txs[0].pk])
+        self.assertFalse(third.has_next)
+
+        back = paginate_keyset(qs, third.previous_cursor, per_page=3)
+        self.assertEqual([t.pk for t in back], [t.pk for t in second])
+        self.assertTrue(back.has_previous)
+
+    def test_invalid_cursor_returns_first_page(self):
+        self.assertIsNone(decode_cursor("lixo"))
+        page = paginate_keyset(Transaction.objects.all(), "lixo", per_page=2)
+        self.assertEqual(page.items[0].pk, self.txs[-1].pk)
+
+    def test_views_paginate_with_constant_queries(self):
+        for i in range(60):
+            self.make_tx(self.acc, "IN", "1", date(2025, 1, 1))
+        url = reverse("finance:transaction_list")
+        first = self.client.get(url)
+        self.assertEqual(len(first.context["object_list"]), 50)
+        with self.assertNumQueries(4):  # sessão, usuário, página e tags
+            deep = self.client.get(url, {"cursor": first.context["page"].next_cursor})
+        self.assertEqual(len(deep.context["object_list"]), 17)
+        statement = self.client.get(reverse("finance:statement"), {"account": self.acc.pk})
+        self.assertTrue(statement.context["page"].has_next)
+
+
+class StatementExportTests(FinanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.acc = self.make_account("Banco", "100")
+        self.tag = Tag.objects.create(user=self.user, name="mercado")
+        for i in range(5):
+            tx = self.make_tx(self.acc, "OUT", "10", date(2026, 1, 1 + i), description=f"Compra {i}")
+            tx.tags.add(self.tag)
+        self.make_tx(self.acc, "IN", "500", date(2026, 2, 1), description="Salário")
+
+    def test_csv_streams_filtered_rows_with_batched_tags(self):
+        url = reverse("finance:statement_export", args=["csv"])
+        with self.assertNumQueries(5):  # sessão, usuário, conta do filtro, lançamentos e tags
+            resp = self.client.get(url, {"account": self.acc.pk, "type": "OUT"})
+            content = b"".join(resp.streaming_content).decode("utf-8-sig")
+        lines = content.strip().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertIn("Compra 4", lines[1])
+        self.assertIn("mercado", lines[1])
+
+    def test_csv_fetches_tags_per_chunk(self):
+        from .exports import stream_csv
+        qs = Transaction.objects.filter(user=self.user)
+        with self.assertNumQueries(4):  # um cursor para os lançamentos e as tags de cada bloco de 2
+            rows = list(stream_csv(qs, chunk_size=2))
+        self.assertEqual(len(rows), 8)
+
+    def test_ofx(self):
+        resp = self.client.get(reverse("finance:statement_export", args=["ofx"]), {"account": self.acc.pk})
+        content = b"".join(resp.streaming_content).decode()
+        self.assertTrue(content.startswith("OFXHEADER:100"))
+        self.assertEqual(content.count("<STMTTRN>"), 6)
+        self.assertIn("<TRNAMT>-10.00", content)
+        self.assertIn("<BALAMT>550.00", content)
+
+    def test_ofx_amounts_add_up_to_ledger_balance(self):
+        other = self.make_account("Poupança")
+        self.acc.currency = "USD"
+        self.acc.save()
+        self.client.post(reverse("finance:transfer_create"), {
+            "from_account": self.acc.pk, "to_account": other.pk, "date": "2026-02-02",
+            "description": "Reserva", "amount": "120",
+        })
+        self.make_tx(self.acc, "TRX", "30", date(2026, 2, 3), description="Ajuste")
+        resp = self.client.get(reverse("finance:statement_export", args=["ofx"]), {"account": self.acc.pk})
+        content = b"".join(resp.streaming_content).decode()
+        self.assertIn("<CURDEF>USD", content)
+        self.assertEqual(content.count("<TRNTYPE>XFER"), 2)
+        amounts = [Decimal(v) for v in re.findall(r"<TRNAMT>([-\d.]+)", content)]
+        ledger = Decimal(re.search(r"<BALAMT>([-\d.]+)", content).group(1))
+        self.acc.refresh_from_db()
+        self.assertEqual(ledger, self.acc.balance())
+        self.assertEqual(self.acc.initial_balance + sum(amounts), ledger)
+
+    def test_requires_valid_filters(self):
+        resp = self.client.get(reverse("finance:statement_export", args=["csv"]))
+        self.assertRedirects(resp, reverse("finance:statement"))
+        self.assertEqual(self.client.get(reverse("finance:statement_export", args=["xls"])).status_code, 404)
+
+
+class DescriptionSearchTests(FinanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.acc = self.make_account("Banco")
+        self.card = self.make_card()
+        self.bread = self.make_tx(self.acc, "OUT", "8", date(2026, 1, 2), description="Padaria Pão Quente")
+        self.make_tx(self.acc, "OUT", "90", date(2026, 1, 3), description="Farmácia")
+        self.charge = self.make_charge(self.card, "40", date(2026, 1, 4), description="Pão de Açúcar")
+
+    def test_prefix_and_accent_insensitive(self):
+        qs = Transaction.objects.filter(user=self.user)
+        self.assertEqual(list(filter_by_description(qs, "pao")), [self.bread])
+        self.assertEqual(list(filter_by_description(qs, "FARM")), [qs.get(description="Farmácia")])
+        self.assertEqual(list(filter_by_description(qs, "pao farm")), [])
+
+    def test_index_follows_writes(self):
+        qs = Transaction.objects.filter(user=self.user)
+        self.bread.description = "Mercado"
+        self.bread.save()
+        self.assertFalse(filter_by_description(qs, "padaria").exists())
+        self.assertTrue(filter_by_description(qs, "merc").exists())
+        self.bread.delete()
+        self.assertFalse(filter_by_description(qs, "merc").exists())
+
+    def test_combined_search_is_per_user(self):
+        other = User.objects.create_user("bia", password="x")
+        acc = Account.objects.create(user=other, name="Outro")
+        Transaction.objects.create(user=other, account=acc, type="OUT", date=date(2026, 1, 1), description="Pão", amount=1)
+        hits = search(self.user, "pão")
+        self.assertEqual({(kind, obj.pk) for kind, obj in hits}, {("transaction", self.bread.pk), ("charge", self.charge.pk)})
+        data = self.client.get(reverse("finance:search"), {"q": "acucar"}).json()
+        self.assertEqual([r["id"] for r in data["results"]], [self.charge.pk])
+
+    def test_statement_and_invoice_filters(self):
+        resp = self.client.get(reverse("finance:statement"), {"account": self.acc.pk, "q": "padaria"})
+        self.assertEqual(resp.context["object_list"], [self.bread])
+        resp = self.client.get(reverse("finance:invoice_list"), {"q": "farmacia"})
+        self.assertEqual(len(resp.context["object_list"]), 0)
+        resp = self.client.get(reverse("finance:invoice_list"), {"q": "acucar"})
+        self.assertEqual(len(resp.context["object_list"]), 1)
+        resp = self.client.get(reverse("finance:invoice_detail", args=[self.charge.invoice_id]), {"q": "outra"})
+        self.assertEqual(len(resp.context["charges"]), 0)
+
+
+class QueryPlanTests(FinanceTestCase):
+    """Consultas das páginas mais usadas não podem varrer as tabelas grandes."""
+
+    HOT_TABLES = ("finance_transaction", "finance_cardcharge", "finance_invoice", "finance_monthlyrollup")
+
+    def setUp(self):
+        super().setUp()
+        self.acc = self.make_account("Banco", "100")
+        card = self.make_card()
+        rec = RecurringTransaction.objects.create(
+            user=self.user, account=self.acc, type="OUT", description="Aluguel", amount=Decimal("900"),
+            next_date=date(2026, 1, 5),
+        )
+        self.tx = self.make_tx(self.acc, "OUT", "900", date(2026, 1, 5), recurring_transaction=rec)
+        self.make_tx(self.acc, "IN", "50", date(2026, 1, 6))
+        self.make_charge(card, "30", date(2026, 1, 7))
+
+    def assertNoTableScans(self, url, params=None):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(url, params or {}).status_code, 200)
+        checked = 0
+        for query in ctx.captured_queries:
+            sql = query["sql"]
+            if not sql.startswith("SELECT") or not any(t in sql for t in self.HOT_TABLES):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            checked += 1
+            for step in plan:
+                for table in self.HOT_TABLES:
+                    self.assertNotRegex(step, rf"^SCAN {table}$", f"Varredura completa em:\n{sql}\n{plan}")
+        self.assertGreater(checked, 0)
+
+    def test_dashboard(self):
+        self.assertNoTableScans(reverse("finance:dashboard"))
+
+    def test_statement(self):
+        self.assertNoTableScans(reverse("finance:statement"), {"account": self.acc.pk, "start_date": "2026-01-01"})
+
+    def test_invoice_list(self):
+        self.assertNoTableScans(reverse("finance:invoice_list"))
+
+    def test_recurring_delete_check(self):
+        self.assertNoTableScans(reverse("finance:transaction_delete", args=[self.tx.pk]))
+
+
+class RunningBalanceTests(FinanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.acc = self.make_account("Banco", "100")
+        other = self.make_account("Outra")
+        amounts = [("IN", "50"), ("OUT", "30"), ("TRX", "40"), ("OUT", "5"), ("IN", "200"), ("OUT", "70")]
+        self.expected = {}
+        balance = Decimal("100")
+        for i, (typ, amount) in enumerate(amounts):
+            # Dois lançamentos por mês, de janeiro a março
+            tx = self.make_tx(self.acc, typ, amount, date(2026, 1 + i // 2, 5))
+            self.make_tx(other, "OUT", "1", date(2026, 1 + i // 2, 5))
+            if typ != "TRX":
+                balance += Decimal(amount) if typ == "IN" else -Decimal(amount)
+            self.expected[tx.pk] = balance
+
+    def test_every_page_in_both_directions(self):
+        qs = Transaction.objects.filter(account=self.acc)
+        cursor, pages = None, []
+        while True:
+            page = paginate_keyset(qs, cursor, per_page=2)
+            # Abertura (consolidados, resto do mês e totais da conta) e a janela da página
+            with self.assertNumQueries(4):
+                set_running_balances(self.acc, page.items)
+            pages.append(page)
+            for tx in page:
+                self.assertIsInstance(tx.running_balance, Decimal)
+                self.assertEqual(tx.running_balance, self.expected[tx.pk])
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(len(pages), 3)
+        self.assertEqual(pages[0].items[0].running_balance, self.acc.balance())
+        back = paginate_keyset(qs, pages[-1].previous_cursor, per_page=2)
+        set_running_balances(self.acc, back.items)
+        self.assertEqual([tx.running_balance for tx in back], [self.expected[tx.pk] for tx in back])
+
+    def test_statement_column(self):
+        url = reverse("finance:statement")
+        resp = self.client.get(url, {"account": self.acc.pk, "end_date": "2026-02-28"})
+        self.assertTrue(resp.context["show_running_balance"])
+        rows = resp.context["object_list"]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual([tx.running_balance for tx in rows], [self.expected[tx.pk] for tx in rows])
+        resp = self.client.get(url, {"account": self.acc.pk, "type": "OUT"})
+        self.assertFalse(resp.context["show_running_balance"])
+
+
+class InstallmentPurchaseTests(FinanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.card = self.make_card(closing_day=10, due_day=20)
+
+    def count_queries(self, parcels, when):
+        with CaptureQueriesContext(connection) as ctx:
+            create_installment_purchase(self.card, when, "Compra", Decimal("120"), parcels)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_depend_on_installments(self):
+        self.assertEqual(self.count_queries(2, date(2026, 1, 5)), self.count_queries(12, date(2027, 1, 5)))
+
+    def test_parcels_invoices_and_totals(self):
+        charges = create_installment_purchase(self.card, date(2026, 1, 15), "TV", Decimal("300"), 3)
+        self.assertEqual([c.installment_number for c in charges], [1, 2, 3])
+        invoices = list(Invoice.objects.filter(card=self.card).order_by("year", "month"))
+        self.assertEqual([(i.year, i.month) for i in invoices], [(2026, 2), (2026, 3), (2026, 4)])
+        self.assertEqual([i.charges_total for i in invoices], [Decimal("100")] * 3)
+        self.assertEqual(invoices[0].due_date, date(2026, 2, 20))
+        rollups = MonthlyRollup.objects.filter(card=self.card, type=MonthlyRollup.Type.CARD)
+        self.assertEqual(sorted((r.month, r.total, r.count) for r in rollups), [(1, 100, 1), (2, 100, 1), (3, 100, 1)])
+
+    def test_closed_invoice_moves_parcel_to_next_month(self):
+        closed = self.make_charge(self.card, "10", date(2026, 1, 2)).invoice
+        closed.status = Invoice.Status.CLOSED
+        closed.save()
+        charge, = create_installment_purchase(self.card, date(2026, 1, 3), "Café", Decimal("5"))
+        self.assertEqual((charge.invoice.year, charge.invoice.month), (2026, 2))
+        closed.refresh_from_db()
+        self.assertEqual(closed.charges_total, Decimal("10"))
+
+    def test_purchase_view(self):
+        resp = self.client.post(reverse("finance:purchase_create"), {
+            "card": self.card.pk, "date": "2026-03-01", "description": "Sofá",
+            "total_amount": "1200", "installments_total": "12",
+        })
+        self.assertRedirects(resp, reverse("finance:invoice_list"))
+        self.assertEqual(CardCharge.objects.filter(card=self.card).count(), 12)
+        self.assertEqual(Invoice.objects.filter(card=self.card).count(), 12)
+
+
+class InstallmentPlanTests(FinanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.card = self.make_card(closing_day=10, due_day=20)
+        create_installment_purchase(self.card, date(2026, 1, 15), "Geladeira", Decimal("1200"), 12)
+        self.plan = InstallmentPlan.objects.get()
+
+    def test_purchase_creates_plan(self):
+        self.assertEqual(self.plan.installments_total, 12)
+        self.assertEqual(self.plan.parcels.count(), 12)
+        self.assertFalse(CardCharge.objects.filter(plan__isnull=True).exists())
+
+    def test_parcels_add_up_to_the_total(self):
+        create_installment_purchase(self.card, date(2026, 1, 15), "Curso", Decimal("100"), 3)
+        plan = InstallmentPlan.objects.get(description="Curso")
+        amounts = list(plan.parcels.order_by("installment_number").values_list("total_amount", flat=True))
+        self.assertEqual(amounts, [Decimal("33.34"), Decimal("33.33"), Decimal("33.33")])
+        plan.total_amount = Decimal("200")
+        reschedule_plan(plan)
+        self.assertEqual(sum(plan.parcels.values_list("total_amount", flat=True)), Decimal("200"))
+
+    def test_deleting_one_parcel_updates_the_plan(self):
+        parcel = self.plan.parcels.get(installment_number=3)
+        self.client.post(reverse("finance:cardcharge_delete", args=[parcel.pk]))
+        self.plan.refresh_from_db()
+        self.assertEqual((self.plan.total_amount, self.plan.installments_total), (Decimal("1100"), 11))
+        # Reprogramar depois da exclusão redivide o valor entre as parcelas que restaram
+        reschedule_plan(self.plan)
+        self.assertEqual(set(self.plan.parcels.values_list("total_amount", flat=True)), {Decimal("100")})
+
+    def test_deleting_the_last_parcel_removes_the_plan(self):
+        for parcel in self.plan.parcels.all():
+            parcel.delete()
+        self.assertFalse(InstallmentPlan.objects.exists())
+
+    def test_editing_one_parcel_updates_the_plan_total(self):
+        parcel = self.plan.parcels.get(installment_number=1)
+        parcel.total_amount = Decimal("150")
+        parcel.save()
+        self.plan.refresh_from_db()
+        self.assertEqual((self.plan.total_amount, self.plan.installments_total), (Decimal("1250"), 12))
+
+    def test_reschedule_moves_parcels_and_totals(self):
+        other = self.make_card("Outro", closing_day=5, due_day=15)
+        self.plan.card = other
+        self.plan.total_amount = Decimal("600")
+        self.plan.start_date = date(2026, 3, 1)
+        with CaptureQueriesContext(connection) as ctx:
+            reschedule_plan(self.plan)
+        self.assertLess(len(ctx.captured_queries), 20)
+        self.assertFalse(Invoice.objects.filter(card=self.card).exists())
+        self.assertFalse(MonthlyRollup.objects.filter(card=self.card, count__gt=0).exists())
+        invoices = Invoice.objects.filter(card=other).order_by("year", "month")
+        self.assertEqual(invoices.count(), 12)
+        self.assertEqual({i.charges_total for i in invoices}, {Decimal("50")})
+        self.assertEqual((invoices[0].year, invoices[0].month), (2026, 3))
+        self.assertEqual(set(self.plan.parcels.values_list("card_id", flat=True)), {other.pk})
+
+    def test_delete_removes_parcels_and_empty_invoices(self):
+        extra = self.make_charge(self.card, "10", date(2026, 1, 20))
+        with CaptureQueriesContext(connection) as ctx:
+            delete_installment_plan(self.plan)
+        self.assertLess(len(ctx.captured_queries), 20)
+        self.assertEqual(list(CardCharge.objects.all()), [extra])
+        invoice, = Invoice.objects.all()
+        self.assertEqual(invoice.charges_total, Decimal("10"))
+        self.assertEqual(sum(MonthlyRollup.objects.filter(card=self.card).values_list("total", flat=True)), 10)
+
+    def test_views(self):
+        url = reverse("finance:plan_update", args=[self.plan.pk])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        resp = self.client.post(url, {
+            "card": self.card.pk, "start_date": "2026-01-15", "description": "Geladeira nova", "total_amount": "2400",
+        })
+        self.assertRedirects(resp, reverse("finance:invoice_list"))
+        self.assertEqual(set(CardCharge.objects.values_list("total_amount", flat=True)), {Decimal("200")})
+        resp = self.client.post(reverse("finance:plan_delete", args=[self.plan.pk]))
+        self.assertRedirects(resp, reverse("finance:invoice_list"))
+        self.assertFalse(CardCharge.objects.exists())
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_generated_recurring_purchase_has_plan(self):
+        rec = RecurringCardPurchase.objects.create(
+            user=self.user, card=self.card, description="Curso", total_amount=Decimal("100"),
+            installments_total=3, day_of_month=5, next_date=date(2026, 2, 5),
+        )
+        self.client.post(reverse("finance:rec_card_generate", args=[rec.pk]))
+        plan = InstallmentPlan.objects.get(description="Curso")
+        self.assertEqual((plan.total_amount, plan.installments_total), (Decimal("100"), 3))
+        self.assertEqual(plan.parcels.count(), 3)
+        self.assertFalse(CardCharge.objects.filter(description="Curso", plan__isnull=True).exists())
+        rec.refresh_from_db()
+        self.assertEqual((rec.next_date, rec.generated_count), (date(2026, 3, 5), 1))
+
+    def test_other_users_plan_is_not_found(self):
+        self.client.force_login(User.objects.create_user("bia", password="x"))
+        self.assertEqual(self.client.get(reverse("finance:plan_update", args=[self.plan.pk])).status_code, 404)
+
+
+class CardCommittedAmountTests(FinanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.card = self.make_card(limit=Decimal("1000"))
+
+    def assertCommitted(self, expected):
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.committed_amount, Decimal(expected))
+        self.assertEqual(
+            CreditCard.objects.filter(pk=self.card.pk).values_list(CreditCard.actual_committed(), flat=True).get(),
+            Decimal(expected),
+        )
+
+    def test_charges_installments_and_payments(self):
+        create_installment_purchase(self.card, date(2026, 1, 15), "TV", Decimal("600"), 6)
+        charge = self.make_charge(self.card, "50", date(2026, 1, 20))
+        self.assertCommitted("650")
+        payment = InvoicePayment.objects.create(invoice=charge.invoice, amount=Decimal("150"))
+        self.assertCommitted("500")
+        charge.total_amount = Decimal("70")
+        charge.save()
+        self.assertCommitted("520")
+        payment.delete()
+        charge.delete()
+        self.assertCommitted("600")
+        delete_installment_plan(InstallmentPlan.objects.get())
+        self.assertCommitted("0")
+
+    def test_card_form_does_not_overwrite_committed(self):
+        self.make_charge(self.card, "80", date(2026, 1, 5))
+        stale = CreditCard.objects.get(pk=self.card.pk)
+        self.make_charge(self.card, "20", date(2026, 1, 6))
+        stale.limit = Decimal("2000")
+        stale.save()
+        self.assertCommitted("100")
+
+    def test_utilization_endpoint_and_limit_warning(self):
+        self.make_charge(self.card, "250", date(2026, 1, 5))
+        with self.assertNumQueries(3):
+            data = self.client.get(reverse("finance:card_utilization")).json()
+        self.assertEqual(data["cards"][0]["available"], "750.00")
+        self.assertEqual(Decimal(data["cards"][0]["utilization"]), Decimal("0.25"))
+        resp = self.client.post(reverse("finance:purchase_create"), {
+            "card": self.card.pk, "date": "2026-03-01", "description": "Notebook",
+            "total_amount": "800", "installments_total": "4",
+        }, follow=True)
+        self.assertContains(resp, "ultrapassa o limite")
+        self.assertCommitted("1050")
+
+    def test_rebuild_command_fixes_committed(self):
+        self.make_charge(self.card, "80", date(2026, 1, 5))
+        CreditCard.objects.filter(pk=self.card.pk).update(committed_amount=Decimal("1"))
+        with self.assertRaises(CommandError):
+            call_command("rebuild_invoice_totals", "--check", stdout=StringIO())
+        call_command("rebuild_invoice_totals", stdout=StringIO())
+        self.assertCommitted("80")
+
+
+class RunRecurrencesTests(FinanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.acc = self.make_account("Banco", "0")
+        self.card = self.make_card(closing_day=10, due_day=20)
+
+    def make_rec_tx(self, next_date, day_of_month, **extra):
+        return RecurringTransaction.objects.create(
+            user=self.user, account=self.acc, type="OUT", description="Aluguel", amount=Decimal("100"),
+            day_of_month=day_of_month, next_date=next_date, **extra,
+        )
+
+    def test_matches_generate_next(self):
+        manual = self.make_rec_tx(date(2026, 1, 31), 31)
+        batch = self.make_rec_tx(date(2026, 1, 31), 31)
+        for _ in range(4):
+            manual.generate_next()
+        run_recurrences(date(2026, 4, 30))
+        batch.refresh_from_db()
+        self.assertEqual(batch.next_date, manual.next_date)
+        self.assertEqual(
+            list(batch.generated_transactions.order_by("date").values_list("date", flat=True)),
+            list(manual.generated_transactions.order_by("date").values_list("date", flat=True)),
+        )
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.balance(), Decimal("-800"))
+
+    def test_idempotent_and_skips_existing_occurrences(self):
+        rec = self.make_rec_tx(date(2026, 1, 5), 5, end_date=date(2026, 3, 1))
+        self.make_tx(self.acc, "OUT", "100", date(2026, 1, 5), recurring_transaction=rec)
+        result = run_recurrences(date(2026, 6, 30))
+        self.assertEqual(result, {"transactions": 1, "charges": 0, "schedules": 1})
+        self.assertEqual(run_recurrences(date(2026, 6, 30))["transactions"], 0)
+        self.assertEqual(Transaction.objects.filter(recurring_transaction=rec).count(), 2)
+
+    def test_card_purchases_create_plans_and_totals(self):
+        RecurringCardPurchase.objects.create(
+            user=self.user, card=self.card, description="Academia", total_amount=Decimal("90"),
+            installments_total=3, day_of_month=15, next_date=date(2026, 1, 15),
+        )
+        result = run_recurrences(date(2026, 2, 28))
+        self.assertEqual(result["charges"], 6)
+        self.assertEqual(InstallmentPlan.objects.count(), 2)
+        totals = dict(Invoice.objects.filter(card=self.card).values_list("month", "charges_total"))
+        self.assertEqual(totals, {2: 30, 3: 60, 4: 60, 5: 30})
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.committed_amount, Decimal("180"))
+        self.assertEqual(RecurringCardPurchase.objects.get().next_date, date(2026, 3, 15))
+
+    def test_query_count_does_not_depend_on_schedules(self):
+        def count(n, until):
+            # Conta nova a cada rodada: as duas criam os seus consolidados mensais
+            self.acc = self.make_account(f"Conta {n}")
+            for _ in range(n):
+                self.make_rec_tx(date(2026, 1, 5), 5)
+            with CaptureQueriesContext(connection) as ctx:
+                run_recurrences(until)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(count(2, date(2026, 3, 31)), count(20, date(2026, 3, 31)))
+
+    def test_command(self):
+        self.make_rec_tx(date(2026, 1, 5), 5)
+        out = StringIO()
+        call_command("run_recurrences", "--until", "2026-02-10", "--batch-size", "1", stdout=out)
+        self.assertIn("2 lançamento(s)", out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command("run_recurrences", "--until", "amanhã", stdout=StringIO())
+
+
+class RecurrenceRuleTests(FinanceTestCase):
+    def rule(self, frequency, anchor, interval=1, day=None, remaining=None, until=None):
+        return rrule.Rule(frequency, interval, day or anchor.day, anchor, remaining, until)
+
+    def stepped(self, rule, end):
+        # Referência: percorre a série índice a índice desde a âncora
+        dates, k = [], 0
+        while rule.nth(k) <= end:
+            dates.append(rule.nth(k))
+            k += 1
+        return dates
+
+    def test_monthly_clamps_day_to_month_length(self):
+        rule = self.rule(rrule.MONTHLY, date(2026, 1, 31))
+        self.assertEqual(
+            rule.upto(date(2026, 4, 30)),
+            [date(2026, 1, 31), date(2026, 2, 28), date(2026, 3, 31), date(2026, 4, 30)],
+        )
+
+    def test_frequencies(self):
+        self.assertEqual(self.rule(rrule.WEEKLY, date(2026, 1, 1)).nth(2), date(2026, 1, 15))
+        self.assertEqual(self.rule(rrule.BIWEEKLY, date(2026, 1, 1), interval=2).nth(1), date(2026, 1, 29))
+        self.assertEqual(self.rule(rrule.YEARLY, date(2024, 2, 29)).nth(1), date(2025, 2, 28))
+        self.assertEqual(self.rule(rrule.MONTHLY, date(2026, 1, 10), interval=3).nth(2), date(2026, 7, 10))
+        # 31/05/2026 é domingo: o último dia útil é sexta, 29
+        self.assertEqual(self.rule(rrule.LAST_BUSINESS_DAY, date(2026, 4, 30)).nth(1), date(2026, 5, 29))
+
+    def test_deleted_occurrence_is_regenerated_within_count(self):
+        acc = self.make_account("Banco")
+        rec = RecurringTransaction.objects.create(
+            user=self.user, account=acc, type="OUT", description="Seguro", amount=Decimal("10"),
+            frequency=RecurringTransaction.Frequency.WEEKLY, day_of_month=1, next_date=date(2026, 1, 1), count=4,
+        )
+        run_recurrences(date(2026, 1, 15))
+        # A tela só exclui a ocorrência mais recente
+        newest = rec.generated_transactions.get(date=date(2026, 1, 15))
+        self.client.post(reverse("finance:transaction_delete", args=[newest.pk]))
+        rec.refresh_from_db()
+        self.assertEqual((rec.next_date, rec.generated_count), (date(2026, 1, 15), 2))
+        self.assertEqual(rec.upcoming(), [date(2026, 1, 15), date(2026, 1, 22)])
+
+        # Ocorrência do meio excluída por fora da tela: as seguintes também deixam de contar
+        rec.generated_transactions.filter(date=date(2026, 1, 8)).delete()
+        rec.rewind(date(2026, 1, 8))
+        self.assertEqual((rec.next_date, rec.generated_count), (date(2026, 1, 8), 1))
+        self.assertEqual(rec.upcoming(), [date(2026, 1, 8), date(2026, 1, 15), date(2026, 1, 22)])
+
+        for _ in range(5):
+            rec.generate_next()
+        run_recurrences(date(2026, 12, 31))
+        self.assertEqual(
+            list(rec.generated_transactions.order_by("date").values_list("date", flat=True)),
+            [date(2026, 1, 1), date(2026, 1, 8), date(2026, 1, 15), date(2026, 1, 22)],
+        )
+        rec.refresh_from_db()
+        self.assertEqual(rec.generated_count, 4)
+        self.assertEqual(rec.upcoming(), [])
+
+    def test_last_business_day_normalizes_first_occurrence(self):
+        # Âncora no meio do mês: a primeira ocorrência é o último dia útil de janeiro
+        rule = self.rule(rrule.LAST_BUSINESS_DAY, date(2026, 1, 9))
+        self.assertEqual(rule.nth(0), date(2026, 1, 30))
+        self.assertEqual(rule.preview(2), [date(2026, 1, 30), date(2026, 2, 27)])
+        self.assertEqual(rule.upto(date(2026, 2, 27)), [date(2026, 1, 30), date(2026, 2, 27)])
+        # 31/05/2026 é domingo: a âncora no fim de semana volta para sexta, 29
+        self.assertEqual(self.rule(rrule.LAST_BUSINESS_DAY, date(2026, 5, 31)).nth(0), date(2026, 5, 29))
+
+        acc = self.make_account("Banco")
+        rec = RecurringTransaction.objects.create(
+            user=self.user, account=acc, type="IN", description="Salário", amount=Decimal("10"),
+            frequency=RecurringTransaction.Frequency.LAST_BUSINESS_DAY, next_date=date(2026, 1, 9),
+        )
+        self.assertEqual(rec.generate_next().date, date(2026, 1, 30))
+        self.assertEqual(rec.next_date, date(2026, 2, 27))
+
+    def test_between_matches_stepping_for_any_window(self):
+        rules = [
+            self.rule(rrule.MONTHLY, date(2026, 1, 31)),
+            self.rule(rrule.MONTHLY, date(2026, 1, 15), interval=2, day=30),
+            self.rule(rrule.WEEKLY, date(2026, 1, 3)),
+            self.rule(rrule.BIWEEKLY, date(2026, 1, 3)),
+            self.rule(rrule.YEARLY, date(2024, 2, 29)),
+            self.rule(rrule.LAST_BUSINESS_DAY, date(2026, 1, 9)),
+        ]
+        end = date(2030, 12, 31)
+        for rule in rules:
+            every = self.stepped(rule, end)
+            for start, stop in [(date(2020, 1, 1), end), (date(2027, 3, 15), date(2028, 8, 1)), (date(2029, 2, 28), date(2029, 3, 1))]:
+                expected = [d for d in every if start <= d <= stop]
+                self.assertEqual(rule.between(start, stop), expected, (rule.frequency, start, stop))
+
+    def test_count_and_until(self):
+        rule = self.rule(rrule.WEEKLY, date(2026, 1, 1), remaining=3)
+        self.assertEqual(len(rule.upto(date(2027, 1, 1))), 3)
+        self.assertEqual(rule.preview(5), rule.upto(date(2027, 1, 1)))
+        rule = self.rule(rrule.MONTHLY, date(2026, 1, 1), until=date(2026, 3, 1))
+        self.assertEqual(len(rule.upto(date(2027, 1, 1))), 3)
+
+    def test_list_previews_next_dates(self):
+        card = self.make_card()
+        RecurringCardPurchase.objects.create(
+            user=self.user, card=card, description="Streaming", total_amount=Decimal("30"),
+            frequency=RecurringCardPurchase.Frequency.YEARLY, day_of_month=10, next_date=date(2026, 3, 10),
+        )
+        self.assertContains(self.client.get(reverse("finance:rec_card_list")), "10/03/2026, 10/03/2027, 10/03/2028")
+
+    def test_schedule_count_stops_generation(self):
+        acc = self.make_account("Banco")
+        rec = RecurringTransaction.objects.create(
+            user=self.user, account=acc, type="OUT", description="Seguro", amount=Decimal("10"),
+            frequency=RecurringTransaction.Frequency.WEEKLY, day_of_month=1, next_date=date(2026, 1, 1), count=3,
+        )
+        rec.generate_next()
+        run_recurrences(date(2026, 12, 31))
+        rec.refresh_from_db()
+        self.assertEqual(rec.generated_count, 3)
+        self.assertIsNone(rec.generate_next())
+        self.assertEqual(
+            list(rec.generated_transactions.order_by("date").values_list("date", flat=True)),
+            [date(2026, 1, 1), date(2026, 1, 8), date(2026, 1, 15)],
+        )
+
+
+class ProjectedOccurrencesTests(FinanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.acc = self.make_account("Banco", "1000")
+        self.rent = RecurringTransaction.objects.create(
+            user=self.user, account=self.acc, type="OUT", description="Aluguel", amount=Decimal("500"),
+            day_of_month=5, next_date=date(2026, 2, 5),
+        )
+        RecurringTransaction.objects.create(
+            user=self.user, account=self.acc, type="IN", description="Salário", amount=Decimal("900"),
+            frequency=RecurringTransaction.Frequency.BIWEEKLY, day_of_month=1, next_date=date(2026, 1, 30),
+        )
+        for day in (3, 5, 20):
+            self.make_tx(self.acc, "OUT", "10", date(2026, 1, day))
+        self.make_tx(self.acc, "IN", "10", date(2026, 2, 5))
+        self.source = projected_source(projection_schedules(self.user), date(2026, 3, 31))
+
+    def keys(self, items):
+        return [cursor_key(o) for o in items]
+
+    def test_pages_merge_real_and_projected_rows_in_order(self):
+        qs = Transaction.objects.filter(user=self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            pages, cursor = [], None
+            while True:
+                page = paginate_keyset(qs, cursor, per_page=3, projected=self.source)
+                pages.append(page)
+                if not page.has_next:
+                    break
+                cursor = page.next_cursor
+        self.assertFalse([q for q in ctx.captured_queries if not q["sql"].startswith("SELECT")])
+        items = [o for page in pages for o in page]
+        self.assertEqual(self.keys(items), sorted(self.keys(items), reverse=True))
+        projected = [o for o in items if getattr(o, "projected", False)]
+        # Aluguel em fev e mar; salário quinzenal de 30/01 a 26/03
+        self.assertEqual(len(projected), 2 + 5)
+        self.assertEqual([o.date for o in projected if o.description == "Aluguel"], [date(2026, 3, 5), date(2026, 2, 5)])
+        self.assertEqual(len(items) - len(projected), 4)
+        # Mesmo dia: a projeção do aluguel vem antes do lançamento real de 05/02
+        feb5 = [getattr(o, "projected", False) for o in items if o.date == date(2026, 2, 5)]
+        self.assertEqual(feb5, [True, False])
+        back = paginate_keyset(qs, pages[2].previous_cursor, per_page=3, projected=self.source)
+        self.assertEqual(self.keys(back), self.keys(pages[1]))
+        self.assertEqual(pages[0].income_total, Decimal("0"))
+
+    def test_statement_and_list_show_projections_without_writes(self):
+        before = Transaction.objects.count()
+        resp = self.client.get(reverse("finance:statement"), {"account": self.acc.pk, "projected": "on", "type": "OUT"})
+        rows = resp.context["object_list"]
+        self.assertContains(resp, "Projetado")
+        self.assertEqual({o.description for o in rows if getattr(o, "projected", False)}, {"Aluguel"})
+        self.assertFalse(resp.context["show_running_balance"])
+        resp = self.client.get(
+            reverse("finance:statement"), {"account": self.acc.pk, "projected": "on", "end_date": "2026-03-31"},
+        )
+        self.assertEqual(len(resp.context["object_list"]), 11)
+        real = [o for o in resp.context["object_list"] if not getattr(o, "projected", False)]
+        self.assertEqual(real[0].running_balance, Decimal("980"))
+        resp = self.client.get(reverse("finance:transaction_list"), {"projected": "1"})
+        self.assertContains(resp, "Ocultar projeções")
+        self.assertContains(resp, reverse("finance:rec_tx_update", args=[self.rent.pk]))
+        self.assertEqual(Transaction.objects.count(), before)
+
+
+class InvoiceCalendarTests(FinanceTestCase):
+    def test_periods(self):
+        card = CreditCard(closing_day=10, due_day=20)
+        self.assertEqual(
+            invoice_calendar.period_for(card, date(2026, 1, 9)),
+            (2026, 1, date(2026, 1, 10), date(2026, 1, 20)),
+        )
+        dec = invoice_calendar.period_for(card, date(2026, 12, 10))
+        self.assertEqual((dec.year, dec.month), (2027, 1))
+        late = CreditCard(closing_day=25, due_day=5)
+        self.assertEqual(invoice_calendar.period(late, 2026, 12).due_date, date(2027, 1, 5))
+        self.assertEqual(invoice_calendar.following(late, invoice_calendar.period(late, 2026, 12)).month, 1)
+        # Fechamento no dia 31 em fevereiro usa o último dia do mês
+        self.assertEqual(invoice_calendar.period_for(CreditCard(closing_day=31, due_day=31), date(2026, 2, 28)).month, 3)
+
+    def test_memoized_per_card_configuration(self):
+        before = invoice_calendar.cache_info()["period_for"].hits
+        for _ in range(3):
+            invoice_calendar.period_for(CreditCard(closing_day=3, due_day=9), date(2031, 5, 5))
+        self.assertEqual(invoice_calendar.cache_info()["period_for"].hits, before + 2)
+
+    def test_assign_invoice_for_only_reads_existing_invoice(self):
+        card = self.make_card()
+        inv = Invoice.assign_invoice_for(card, date(2026, 1, 5))
+        with self.assertNumQueries(1):
+            self.assertEqual(Invoice.assign_invoice_for(card, date(2026, 1, 6)), inv)
+        nxt = inv.next_invoice()
+        with self.assertNumQueries(1):
+            self.assertEqual(inv.next_invoice(), nxt)
+        # Datas divergentes do calendário são corrigidas
+        Invoice.objects.filter(pk=inv.pk).update(due_date=None)
+        self.assertEqual(Invoice.assign_invoice_for(card, date(2026, 1, 5)).due_date, date(2026, 1, 20))
+
+    def test_close_view_fills_dates_from_calendar(self):
+        card = self.make_card(closing_day=25, due_day=5)
+        inv = self.make_charge(card, "10", date(2026, 1, 2)).invoice
+        Invoice.objects.filter(pk=inv.pk).update(closing_date=None, due_date=None)
+        self.client.post(reverse("finance:invoice_close", args=[inv.pk]))
+        inv.refresh_from_db()
+        self.assertEqual((inv.status, inv.closing_date, inv.due_date), ("CLOSED", date(2026, 1, 25), date(2026, 2, 5)))
+        self.assertTrue(Invoice.objects.filter(card=card, year=2026, month=2).exists())
+
+
+class CardChargeDirtyTrackingTests(FinanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.card = self.make_card(closing_day=10, due_day=20)
+        self.charge = self.make_charge(self.card, "50", date(2026, 1, 5))
+
+    def test_description_change_skips_invoice_work(self):
+        charge = CardCharge.objects.select_related("card").get(pk=self.charge.pk)
+        charge.description = "Outra descrição"
+        with CaptureQueriesContext(connection) as ctx:
+            charge.save()
+        writes = [q["sql"].split()[0] for q in ctx.captured_queries if not q["sql"].startswith(("SAVEPOINT", "RELEASE"))]
+        # Só o UPDATE da compra e o incremento da versão dos dados (cache)
+        self.assertEqual(writes, ["UPDATE", "UPDATE"])
+        self.assertIn("finance_cardcharge", ctx.captured_queries[1]["sql"])
+
+    def test_date_change_moves_invoice_and_removes_empty_one(self):
+        old_invoice = self.charge.invoice
+        charge = CardCharge.objects.get(pk=self.charge.pk)
+        charge.date = date(2026, 1, 15)
+        charge.save()
+        self.assertEqual((charge.invoice.year, charge.invoice.month), (2026, 2))
+        self.assertFalse(Invoice.objects.filter(pk=old_invoice.pk).exists())
+        self.assertEqual(charge.invoice.charges_total, Decimal("0"))  # instância anterior ao F()
+        charge.invoice.refresh_from_db()
+        self.assertEqual(charge.invoice.charges_total, Decimal("50"))
+        # Salvar de novo sem mudanças não altera totais
+        charge.save()
+        charge.invoice.refresh_from_db()
+        self.assertEqual(charge.invoice.charges_total, Decimal("50"))
+
+    def test_amount_change_updates_totals_without_reassigning(self):
+        charge = CardCharge.objects.get(pk=self.charge.pk)
+        charge.total_amount = Decimal("80")
+        with CaptureQueriesContext(connection) as ctx:
+            charge.save()
+        self.assertFalse(any("INSERT INTO \"finance_invoice\"" in q["sql"] for q in ctx.captured_queries))
+        self.assertFalse(any(q["sql"].startswith("SELECT \"finance_invoice\"") for q in ctx.captured_queries))
+        self.assertEqual(Invoice.objects.get(pk=charge.invoice_id).charges_total, Decimal("80"))
 
-# Create your tests here.
+    def test_update_view_query_count(self):
+        url = reverse("finance:cardcharge_update", args=[self.charge.pk])
+        data = {"card": self.card.pk, "date": "2026-01-05", "description": "Mercado", "total_amount": "50.00"}
+        # sessão, usuário, compra, tags iniciais, validação do cartão (2), savepoint,
+        # UPDATE da compra, versão do cache, release e tags; nenhuma consulta de fatura
+        with self.assertNumQueries(11):
+            resp = self.client.post(url, data)
+        self.assertRedirects(resp, reverse("finance:invoice_detail", args=[self.charge.invoice_id]), fetch_redirect_response=False)
+        self.assertEqual(CardCharge.objects.get(pk=self.charge.pk).description, "Mercado")
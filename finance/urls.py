@@ -7,6 +7,11 @@ urlpatterns = [
     path("profile/", views.ProfileView.as_view(), name="profile"),
     path("", views.DashboardView.as_view(), name="dashboard"),
     path("dashboard/", views.DashboardView.as_view(), name="dashboard"),
+    path("forecast/", views.ForecastView.as_view(), name="forecast"),
+    path("forecast/data/", views.ForecastJsonView.as_view(), name="forecast_data"),
+    path("balances/data/", views.BalanceHistoryJsonView.as_view(), name="balance_history"),
+    path("search/", views.SearchView.as_view(), name="search"),
+    path("cache/stats/", views.CacheStatsView.as_view(), name="cache_stats"),
     path("accounts/", views.AccountListView.as_view(), name="account_list"),
     path("accounts/new/", views.AccountCreateView.as_view(), name="account_create"),
     path("accounts/<int:pk>/edit/", views.AccountUpdateView.as_view(), name="account_update"),
@@ -16,6 +21,7 @@ urlpatterns = [
     path("cards/new/", views.CreditCardCreateView.as_view(), name="card_create"),
     path("cards/<int:pk>/edit/", views.CreditCardUpdateView.as_view(), name="card_update"),
     path("cards/<int:pk>/delete/", views.CreditCardDeleteView.as_view(), name="card_delete"),
+    path("cards/utilization/", views.CardUtilizationJsonView.as_view(), name="card_utilization"),
 
     path("transactions/", views.TransactionListView.as_view(), name="transaction_list"),
     path("transactions/new/", views.TransactionCreateView.as_view(), name="transaction_create"),
@@ -36,6 +42,8 @@ urlpatterns = [
     # Compras no cartão - editar lançamento
     path("charges/<int:pk>/edit/", views.CardChargeUpdateView.as_view(), name="cardcharge_update"),
     path("charges/<int:pk>/delete/", views.CardChargeDeleteView.as_view(), name="cardcharge_delete"),
+    path("plans/<int:pk>/edit/", views.InstallmentPlanUpdateView.as_view(), name="plan_update"),
+    path("plans/<int:pk>/delete/", views.InstallmentPlanDeleteView.as_view(), name="plan_delete"),
 
     path("categories/", views.CategoryListView.as_view(), name="category_list"),
     path("categories/new/", views.CategoryCreateView.as_view(), name="category_create"),
@@ -48,6 +56,7 @@ urlpatterns = [
     path("tags/<int:pk>/delete/", views.TagDeleteView.as_view(), name="tag_delete"),
 
     path("statement/", views.StatementView.as_view(), name="statement"),
+    path("statement/export/<str:fmt>/", views.StatementExportView.as_view(), name="statement_export"),
 
     # Recorrentes - transações em conta
     path("recurrents/transactions/", views.RecurringTransactionListView.as_view(), name="rec_tx_list"),
@@ -1,9 +1,9 @@
 from django.shortcuts import render
 from django.urls import reverse_lazy
-from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views import generic
 from django.views import View
-from django.http import HttpResponseRedirect, HttpResponseForbidden
+from django.http import Http404, HttpResponseRedirect, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.contrib import messages
 from django.utils import timezone
 from .models import Account, CreditCard
@@ -12,8 +12,9 @@ from django.db import transaction as db_transaction
 from .forms import TransactionForm, TransferForm
 from .forms import PurchaseForm, InvoicePaymentForm, StatementFilterForm
 from .forms import RecurringTransactionForm, RecurringCardPurchaseForm
-from .forms import CardChargeForm
+from .forms import CardChargeForm, InstallmentPlanForm
 from .models import Invoice, CardCharge, InvoicePayment, Category, Tag, RecurringTransaction, RecurringCardPurchase
+from .models import InstallmentPlan
 from datetime import date, timedelta
 from decimal import Decimal
 from django.db.models import Sum, Q
@@ -21,6 +22,17 @@ import calendar
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth import update_session_auth_hash
 from .forms import UserProfileForm
+from .aggregates import account_summaries, card_invoice_summaries, expenses_by_category, unpaid_invoices_total
+from .cache import cached, stats as cache_stats
+from .balances import daily_balances, set_running_balances
+from .exports import stream_csv, stream_ofx
+from .invoice_calendar import period as invoice_period
+from .forecast import MAX_MONTHS, month_end_rows, project_cash_flow
+from .invoices import settle
+from .pagination import paginate_keyset
+from .projections import projected_source, projection_end, projection_schedules
+from .purchases import create_installment_purchase, delete_installment_plan, reschedule_plan
+from .search import filter_by_description, search
 
 # Create your views here.
 
@@ -151,27 +163,46 @@ class CardChargeUpdateView(LoginRequiredMixin, generic.UpdateView):
         return reverse_lazy("finance:invoice_detail", kwargs={"pk": obj.invoice_id})
 
     def form_valid(self, form):
-        old_obj = self.get_object()
-        old_invoice = old_obj.invoice
-        obj = form.save(commit=False)
-        # Reatribui a fatura com base em card+date
-        inv = Invoice.assign_invoice_for(obj.card, obj.date)
-        if inv.status == Invoice.Status.CLOSED:
-            inv = inv.next_invoice()
-        obj.invoice = inv
-        obj.save()
-        form.save_m2m()
+        # CardCharge.save reatribui a fatura (e remove a antiga se ficou vazia)
+        # apenas quando cartão ou data mudaram
+        self.object = form.save()
         messages.success(self.request, "Lançamento atualizado com sucesso.")
-        # Se a fatura anterior ficou vazia (sem compras e sem pagamentos), exclui
-        try:
-            if old_invoice and old_invoice.pk != inv.pk:
-                has_charges = old_invoice.charges.exists()
-                has_payments = old_invoice.payments.exists()
-                if not has_charges and not has_payments:
-                    old_invoice.delete()
-        except Exception:
-            pass
-        return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
+
+
+class InstallmentPlanUpdateView(LoginRequiredMixin, generic.UpdateView):
+    model = InstallmentPlan
+    form_class = InstallmentPlanForm
+    template_name = "finance/installmentplan_form.html"
+    success_url = reverse_lazy("finance:invoice_list")
+
+    def get_queryset(self):
+        return InstallmentPlan.objects.filter(card__user=self.request.user).select_related("card")
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs["user"] = self.request.user
+        return kwargs
+
+    def form_valid(self, form):
+        # Todas as parcelas são redivididas e movidas de fatura em conjunto
+        reschedule_plan(form.save(commit=False))
+        messages.success(self.request, "Compra parcelada atualizada com sucesso.")
+        return HttpResponseRedirect(self.get_success_url())
+
+
+class InstallmentPlanDeleteView(LoginRequiredMixin, generic.DeleteView):
+    model = InstallmentPlan
+    template_name = "finance/confirm_delete.html"
+    success_url = reverse_lazy("finance:invoice_list")
+
+    def get_queryset(self):
+        return InstallmentPlan.objects.filter(card__user=self.request.user).select_related("card")
+
+    def form_valid(self, form):
+        delete_installment_plan(self.object)
+        messages.success(self.request, "Compra parcelada excluída com sucesso.")
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class InvoiceCloseView(LoginRequiredMixin, View):
@@ -181,18 +212,10 @@ class InvoiceCloseView(LoginRequiredMixin, View):
             return HttpResponseForbidden()
         if inv.status == Invoice.Status.OPEN or inv.status == Invoice.Status.PARTIAL:
             inv.status = Invoice.Status.CLOSED
-            if not inv.closing_date:
-                try:
-                    inv.closing_date = date(inv.year, inv.month, min(inv.card.closing_day, 28))
-                except Exception:
-                    pass
-            if not inv.due_date:
-                vy, vm = (inv.year + 1, 1) if inv.month == 12 else (inv.year, inv.month + 1)
-                try:
-                    inv.due_date = date(vy, vm, min(inv.card.due_day, 28))
-                except Exception:
-                    pass
-            inv.save()
+            period = invoice_period(inv.card, inv.year, inv.month)
+            inv.closing_date = inv.closing_date or period.closing_date
+            inv.due_date = inv.due_date or period.due_date
+            inv.save(update_fields=["status", "closing_date", "due_date"])
             # Garantir existência da próxima fatura (projeção)
             inv.next_invoice()
             messages.success(request, "Fatura fechada e próxima fatura projetada.")
@@ -222,35 +245,56 @@ class StatementView(LoginRequiredMixin, generic.TemplateView):
         ctx = super().get_context_data(**kwargs)
         form = getattr(self, 'form', None) or StatementFilterForm(user=self.request.user)
         qs = Transaction.objects.filter(user=self.request.user).select_related("account", "category").prefetch_related("tags")
+        running = False
         if form.is_valid():
-            account = form.cleaned_data.get("account")
-            start_date = form.cleaned_data.get("start_date")
-            end_date = form.cleaned_data.get("end_date")
-            typ = form.cleaned_data.get("type")
-            category = form.cleaned_data.get("category")
-            tag = form.cleaned_data.get("tag")
-            reconciled = form.cleaned_data.get("reconciled")
-            if account:
-                qs = qs.filter(account=account)
-            if start_date:
-                qs = qs.filter(date__gte=start_date)
-            if end_date:
-                qs = qs.filter(date__lte=end_date)
-            if typ:
-                qs = qs.filter(type=typ)
-            if category:
-                qs = qs.filter(category=category)
-            if tag:
-                qs = qs.filter(tags=tag)
-            if reconciled == '1':
-                qs = qs.filter(reconciled=True)
-            elif reconciled == '0':
-                qs = qs.filter(reconciled=False)
+            qs = form.filter_queryset(qs)
+            running = form.shows_running_balance()
         ctx['form'] = form
-        ctx['object_list'] = qs.order_by('-date', '-id')
+
+        projected = None
+        if form.is_valid() and form.cleaned_data.get("projected"):
+            end = projection_end()
+            if form.cleaned_data.get("end_date"):
+                end = min(end, form.cleaned_data["end_date"])
+            schedules = form.filter_schedules(projection_schedules(self.request.user))
+            projected = projected_source(schedules, end, form.cleaned_data.get("start_date"))
+
+        def build_page():
+            cursor = self.request.GET.get("cursor")
+            page = paginate_keyset(qs, cursor, projected=projected)
+            if running:
+                set_running_balances(form.cleaned_data["account"], [o for o in page.items if not getattr(o, "projected", False)])
+            return page
+
+        params = {"params": sorted(self.request.GET.lists()), "today": date.today()}
+        page = cached(self.request.user, "statement", params, build_page)
+        ctx['page'] = page
+        ctx['object_list'] = page.items
+        ctx['show_running_balance'] = running
         return ctx
 
 
+class StatementExportView(LoginRequiredMixin, View):
+    """Exporta o extrato filtrado em CSV ou OFX sem carregar tudo na memória."""
+
+    def get(self, request, fmt):
+        if fmt not in ("csv", "ofx"):
+            raise Http404
+        form = StatementFilterForm(request.GET, user=request.user)
+        if not form.is_valid():
+            messages.error(request, "Selecione a conta e filtros válidos para exportar.")
+            return HttpResponseRedirect(reverse_lazy("finance:statement"))
+        qs = form.filter_queryset(Transaction.objects.filter(user=request.user))
+        account = form.cleaned_data["account"]
+        if fmt == "csv":
+            response = StreamingHttpResponse(stream_csv(qs), content_type="text/csv; charset=utf-8")
+        else:
+            stream = stream_ofx(qs, account, form.cleaned_data.get("start_date"), form.cleaned_data.get("end_date"))
+            response = StreamingHttpResponse(stream, content_type="application/x-ofx")
+        response["Content-Disposition"] = f'attachment; filename="extrato-{account.pk}.{fmt}"'
+        return response
+
+
 class ToggleReconciliationView(LoginRequiredMixin, View):
     def post(self, request, pk):
         tx = Transaction.objects.filter(pk=pk, user=request.user).first()
@@ -443,7 +487,10 @@ class CategoryUpdateView(LoginRequiredMixin, generic.UpdateView):
 
     def get_form(self, form_class=None):
         form = super().get_form(form_class)
-        form.fields["parent"].queryset = Category.objects.filter(user=self.request.user).exclude(pk=self.object.pk)
+        # Exclui a própria categoria e suas subcategorias para evitar ciclos
+        form.fields["parent"].queryset = Category.objects.filter(user=self.request.user).exclude(
+            ancestor_links__ancestor=self.object
+        )
         return form
 
     def form_valid(self, form):
@@ -480,143 +527,54 @@ class DashboardView(LoginRequiredMixin, generic.TemplateView):
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
         user = self.request.user
+        today = date.today()
+        by_parent = self.request.GET.get("by_parent") == "1"
+        # Cacheado por versão dos dados do usuário (ver finance.cache)
+        ctx.update(cached(
+            user, "dashboard", {"today": today, "by_parent": by_parent},
+            lambda: self.dashboard_data(user, today, by_parent),
+        ))
+        return ctx
 
+    def dashboard_data(self, user, today, by_parent):
         # Calcula período do mês atual (precisa estar antes de usar month_start e month_end)
-        today = date.today()
         month_start = date(today.year, today.month, 1)
         # último dia do mês
         next_month = date(today.year + (today.month // 12), 1 if today.month == 12 else today.month + 1, 1)
         month_end = next_month - timedelta(days=1)
 
-        # Saldos por conta: saldo = initial_balance + entradas - saídas
-        accounts = Account.objects.filter(user=user, active=True).order_by("name")
-        account_balances = []
-        for acc in accounts:
-            tx = Transaction.objects.filter(user=user, account=acc)
-            ins = tx.filter(type=Transaction.TxType.INCOME).aggregate(s=Sum("amount")).get("s") or Decimal("0")
-            outs = tx.filter(type=Transaction.TxType.OUTCOME).aggregate(s=Sum("amount")).get("s") or Decimal("0")
-            balance = Decimal(acc.initial_balance) + ins - outs
-            
-            # Totais do mês atual
-            tx_month = tx.filter(date__gte=month_start, date__lte=month_end)
-            ins_month = tx_month.filter(type=Transaction.TxType.INCOME).aggregate(s=Sum("amount")).get("s") or Decimal("0")
-            outs_month = tx_month.filter(type=Transaction.TxType.OUTCOME).aggregate(s=Sum("amount")).get("s") or Decimal("0")
-            
-            account_balances.append({
-                "account": acc,
-                "balance": balance,
-                "initial_balance": Decimal(acc.initial_balance),
-                "total_income": ins,
-                "total_outcome": outs,
-                "month_income": ins_month,
-                "month_outcome": outs_month,
-            })
+        # Próximo mês: período
+        nm_y = month_start.year + (1 if month_start.month == 12 else 0)
+        nm_m = 1 if month_start.month == 12 else month_start.month + 1
+        next_month_start = date(nm_y, nm_m, 1)
+        next_month_end = date(nm_y, nm_m, calendar.monthrange(nm_y, nm_m)[1])
 
-        # Despesas por categoria no mês atual (CONTAS)
-        qs_out = Transaction.objects.filter(
-            user=user,
-            type=Transaction.TxType.OUTCOME,
-            date__gte=month_start,
-            date__lte=month_end,
-        ).select_related("category")
-        expenses_by_category_account = {}
-        for t in qs_out:
-            key = t.category.name if t.category else "Sem categoria"
-            expenses_by_category_account[key] = expenses_by_category_account.get(key, Decimal("0")) + t.amount
-        
-        # Total de despesas por categoria (CONTAS)
-        expenses_total_account = sum(expenses_by_category_account.values()) or Decimal("0")
+        # Saldos por conta e entradas/saídas do mês e do próximo mês (uma única consulta)
+        summary = account_summaries(user, month_start, next_month_start)
+        account_balances = summary["account_balances"]
+        month_income_total = summary["month_income_total"]
+        month_outcome_total = summary["month_outcome_total"]
+        next_month_income_total = summary["next_month_income_total"]
+        next_month_outcome_total = summary["next_month_outcome_total"]
 
-        # Despesas por categoria no mês atual (CARTÃO)
-        card_charges = CardCharge.objects.filter(
-            card__user=user,
-            date__gte=month_start,
-            date__lte=month_end,
-        ).select_related("category")
-        expenses_by_category_card = {}
-        for c in card_charges:
-            key = c.category.name if c.category else "Sem categoria"
-            expenses_by_category_card[key] = expenses_by_category_card.get(key, Decimal("0")) + Decimal(str(c.total_amount))
-        
-        # Total de despesas por categoria (CARTÃO)
-        expenses_total_card = sum(expenses_by_category_card.values()) or Decimal("0")
+        # Despesas por categoria no mês atual (agrupadas no banco)
+        expenses_by_category_account = expenses_by_category(user, month_start, "account", by_parent)
+        expenses_total_account = sum(val for _, val in expenses_by_category_account) or Decimal("0")
+        expenses_by_category_card = expenses_by_category(user, month_start, "card", by_parent)
+        expenses_total_card = sum(val for _, val in expenses_by_category_card) or Decimal("0")
 
         # Alertas de vencimento de faturas (próximos 7 dias)
-        upcoming = Invoice.objects.filter(
+        upcoming = list(Invoice.objects.filter(
             card__user=user,
             due_date__gte=today,
             due_date__lte=today + timedelta(days=20),
-        ).exclude(status=Invoice.Status.PAID).select_related("card").order_by("due_date")
+        ).exclude(status=Invoice.Status.PAID).select_related("card").order_by("due_date"))
 
         # Totais de faturas por cartão
-        cards = CreditCard.objects.filter(user=user, active=True).order_by("name")
-        card_invoice_totals = []
-        for card in cards:
-            invoices = Invoice.objects.filter(card=card).select_related("card")
-            
-            # Totais por status
-            open_invoices = invoices.filter(status=Invoice.Status.OPEN)
-            closed_invoices = invoices.filter(status=Invoice.Status.CLOSED)
-            paid_invoices = invoices.filter(status=Invoice.Status.PAID)
-            partial_invoices = invoices.filter(status=Invoice.Status.PARTIAL)
-            
-            # Soma dos totais (converte para Decimal)
-            open_total = Decimal(sum(Decimal(str(inv.total_charges() or 0)) for inv in open_invoices))
-            closed_total = Decimal(sum(Decimal(str(inv.total_charges() or 0)) for inv in closed_invoices))
-            paid_total = Decimal(sum(Decimal(str(inv.total_charges() or 0)) for inv in paid_invoices))
-            partial_total = Decimal(sum(Decimal(str(inv.total_charges() or 0)) for inv in partial_invoices))
-            
-            # Saldo total (total de compras - total de pagamentos)
-            total_charges = Decimal(sum(Decimal(str(inv.total_charges() or 0)) for inv in invoices))
-            total_payments = Decimal(sum(Decimal(str(inv.total_payments() or 0)) for inv in invoices))
-            balance = total_charges - total_payments
-            
-            card_invoice_totals.append({
-                "card": card,
-                "open_total": open_total,
-                "closed_total": closed_total,
-                "paid_total": paid_total,
-                "partial_total": partial_total,
-                "total_charges": total_charges,
-                "total_payments": total_payments,
-                "balance": balance,
-            })
-
-        # Entradas do mês (todas as contas)
-        month_income_total = (
-            Transaction.objects.filter(
-                user=user,
-                type=Transaction.TxType.INCOME,
-                date__gte=month_start,
-                date__lte=month_end,
-            ).aggregate(s=Sum("amount")).get("s")
-            or Decimal("0")
-        )
-
-        # Saídas do mês (todas as contas)
-        month_outcome_total = (
-            Transaction.objects.filter(
-                user=user,
-                type=Transaction.TxType.OUTCOME,
-                date__gte=month_start,
-                date__lte=month_end,
-            ).aggregate(s=Sum("amount")).get("s")
-            or Decimal("0")
-        )
+        card_invoice_totals = card_invoice_summaries(user)
 
         # Faturas a pagar no mês (saldo de faturas com vencimento no mês e não pagas)
-        invoices_due_this_month = (
-            Invoice.objects.filter(
-                card__user=user,
-                due_date__gte=month_start,
-                due_date__lte=month_end,
-            )
-            .exclude(status=Invoice.Status.PAID)
-            .select_related("card")
-        )
-        invoices_to_pay_total = Decimal(
-            sum(Decimal(str(inv.balance() or 0)) for inv in invoices_due_this_month)
-        )
+        invoices_to_pay_total = unpaid_invoices_total(user, month_start, month_end)
 
         # Sobra e média diária até o fim do mês (não inclui o dia atual na contagem)
         # Considera: Entradas - Saídas - Faturas a pagar
@@ -626,56 +584,18 @@ class DashboardView(LoginRequiredMixin, generic.TemplateView):
             (remaining_after_bills / days_left_in_month) if days_left_in_month > 0 else remaining_after_bills
         )
 
-        # Próximo mês: período
-        nm_y = month_start.year + (1 if month_start.month == 12 else 0)
-        nm_m = 1 if month_start.month == 12 else month_start.month + 1
-        next_month_start = date(nm_y, nm_m, 1)
-        next_month_end = date(nm_y, nm_m, calendar.monthrange(nm_y, nm_m)[1])
-
-        # Entradas do próximo mês
-        next_month_income_total = (
-            Transaction.objects.filter(
-                user=user,
-                type=Transaction.TxType.INCOME,
-                date__gte=next_month_start,
-                date__lte=next_month_end,
-            ).aggregate(s=Sum("amount")).get("s")
-            or Decimal("0")
-        )
-
-        # Saídas do próximo mês
-        next_month_outcome_total = (
-            Transaction.objects.filter(
-                user=user,
-                type=Transaction.TxType.OUTCOME,
-                date__gte=next_month_start,
-                date__lte=next_month_end,
-            ).aggregate(s=Sum("amount")).get("s")
-            or Decimal("0")
-        )
-
         # Faturas a pagar no próximo mês (saldo de faturas com vencimento no próximo mês e não pagas)
-        invoices_due_next_month = (
-            Invoice.objects.filter(
-                card__user=user,
-                due_date__gte=next_month_start,
-                due_date__lte=next_month_end,
-            )
-            .exclude(status=Invoice.Status.PAID)
-            .select_related("card")
-        )
-        invoices_to_pay_total_next = Decimal(
-            sum(Decimal(str(inv.balance() or 0)) for inv in invoices_due_next_month)
-        )
+        invoices_to_pay_total_next = unpaid_invoices_total(user, next_month_start, next_month_end)
 
         remaining_after_bills_next = next_month_income_total - next_month_outcome_total - invoices_to_pay_total_next
 
-        ctx.update({
+        return {
             "account_balances": account_balances,
             "expenses_by_category_account": expenses_by_category_account,
             "expenses_total_account": expenses_total_account,
             "expenses_by_category_card": expenses_by_category_card,
             "expenses_total_card": expenses_total_card,
+            "by_parent": by_parent,
             "upcoming_invoices": upcoming,
             "card_invoice_totals": card_invoice_totals,
             "month_start": month_start,
@@ -694,10 +614,86 @@ class DashboardView(LoginRequiredMixin, generic.TemplateView):
             "next_month_outcome_total": next_month_outcome_total,
             "invoices_to_pay_total_next": invoices_to_pay_total_next,
             "remaining_after_bills_next": remaining_after_bills_next,
+        }
+
+
+def forecast_months(request, default=12):
+    try:
+        months = int(request.GET.get("months", default))
+    except (TypeError, ValueError):
+        months = default
+    return max(1, min(months, MAX_MONTHS))
+
+
+class ForecastView(LoginRequiredMixin, generic.TemplateView):
+    template_name = "finance/forecast.html"
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        months = forecast_months(self.request)
+        forecast = project_cash_flow(self.request.user, months)
+        ctx.update({
+            "months": months,
+            "forecast": forecast,
+            "rows": month_end_rows(forecast),
+            # Menor saldo consolidado no período
+            "lowest_total": min(forecast["total"]) if forecast["total"] else Decimal("0"),
         })
         return ctx
 
 
+class ForecastJsonView(LoginRequiredMixin, View):
+    def get(self, request):
+        forecast = project_cash_flow(request.user, forecast_months(request))
+        return JsonResponse(forecast)
+
+
+class BalanceHistoryJsonView(LoginRequiredMixin, View):
+    """Saldo ao fim de cada dia por conta e consolidado (?start=&end=&account=)."""
+
+    def get(self, request):
+        try:
+            end = date.fromisoformat(request.GET["end"]) if request.GET.get("end") else date.today()
+            start = date.fromisoformat(request.GET["start"]) if request.GET.get("start") else end - timedelta(days=89)
+            accounts = [int(pk) for pk in request.GET.getlist("account")] or None
+        except ValueError:
+            return JsonResponse({"error": "Parâmetros inválidos."}, status=400)
+        if start > end:
+            return JsonResponse({"error": "A data inicial deve ser anterior à final."}, status=400)
+        return JsonResponse(daily_balances(request.user, start, end, accounts))
+
+
+class SearchView(LoginRequiredMixin, View):
+    """Busca em lançamentos e compras no cartão, ordenada por relevância (?q=)."""
+
+    def get(self, request):
+        hits = []
+        for kind, obj in search(request.user, request.GET.get("q", "")):
+            hits.append({
+                "type": kind,
+                "id": obj.pk,
+                "date": obj.date,
+                "description": obj.description,
+                "amount": obj.amount if kind == "transaction" else obj.total_amount,
+                "source": obj.account.name if kind == "transaction" else obj.card.name,
+                "url": (
+                    reverse_lazy("finance:transaction_update", kwargs={"pk": obj.pk}) if kind == "transaction"
+                    else reverse_lazy("finance:invoice_detail", kwargs={"pk": obj.invoice_id})
+                ),
+            })
+        return JsonResponse({"results": hits})
+
+
+class CacheStatsView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """Acertos/erros do cache do financeiro neste processo (somente staff)."""
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request):
+        return JsonResponse(cache_stats())
+
+
 class TagCreateView(LoginRequiredMixin, generic.CreateView):
     model = Tag
     fields = ["name"]
@@ -772,6 +768,24 @@ class CreditCardListView(LoginRequiredMixin, UserQuerysetMixin, generic.ListView
     template_name = "finance/creditcard_list.html"
 
 
+class CardUtilizationJsonView(LoginRequiredMixin, View):
+    """Limite, valor comprometido (faturas em aberto e parcelas futuras) e disponível por cartão."""
+
+    def get(self, request):
+        cards = []
+        for card in CreditCard.objects.filter(user=request.user, active=True):
+            utilization = card.utilization()
+            cards.append({
+                "id": card.pk,
+                "name": card.name,
+                "limit": card.limit,
+                "committed": card.committed_amount,
+                "available": card.available_limit(),
+                "utilization": round(utilization, 4) if utilization is not None else None,
+            })
+        return JsonResponse({"cards": cards})
+
+
 class CreditCardCreateView(LoginRequiredMixin, UserCreateMixin, generic.CreateView):
     model = CreditCard
     fields = ["name", "brand", "limit", "closing_day", "due_day", "active"]
@@ -806,7 +820,19 @@ class TransactionListView(LoginRequiredMixin, generic.ListView):
 
     def get_queryset(self):
         qs = super().get_queryset()
-        return qs.filter(user=self.request.user).select_related("account", "category").prefetch_related("tags")
+        qs = qs.filter(user=self.request.user).select_related("account", "category").prefetch_related("tags")
+        self.projected = self.request.GET.get("projected") == "1"
+        projected = None
+        if self.projected:
+            projected = projected_source(projection_schedules(self.request.user), projection_end())
+        self.page = paginate_keyset(qs, self.request.GET.get("cursor"), projected=projected)
+        return self.page.items
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx["page"] = self.page
+        ctx["projected"] = self.projected
+        return ctx
 
 
 class TransactionDeleteView(LoginRequiredMixin, generic.DeleteView):
@@ -874,9 +900,9 @@ class TransactionDeleteView(LoginRequiredMixin, generic.DeleteView):
         if recurring_tx:
             # Seta next_date para a data da transação que está sendo deletada
             # Isso permite que ao gerar novamente, gere a mesma parcela que foi deletada
-            recurring_tx.next_date = tx_date
-            recurring_tx.save(update_fields=["next_date"])
-            messages.info(self.request, f"Próxima data do lançamento recorrente '{recurring_tx.description}' ajustada para {tx_date.strftime('%d/%m/%Y')}.")
+            recurring_tx.rewind(tx_date)
+            if recurring_tx.next_date == tx_date:
+                messages.info(self.request, f"Próxima data do lançamento recorrente '{recurring_tx.description}' ajustada para {tx_date.strftime('%d/%m/%Y')}.")
         
         return HttpResponseRedirect(self.success_url)
 
@@ -944,14 +970,6 @@ class TransferCreateView(LoginRequiredMixin, generic.FormView):
         return super().form_valid(form)
 
 
-def add_months(d: date, months: int) -> date:
-    y = d.year + (d.month - 1 + months) // 12
-    m = (d.month - 1 + months) % 12 + 1
-    last_day = calendar.monthrange(y, m)[1]
-    day = min(d.day, last_day)
-    return date(y, m, day)
-
-
 class PurchaseCreateView(LoginRequiredMixin, generic.FormView):
     form_class = PurchaseForm
     template_name = "finance/purchase_form.html"
@@ -970,24 +988,14 @@ class PurchaseCreateView(LoginRequiredMixin, generic.FormView):
         parcels = form.cleaned_data["installments_total"]
         category = form.cleaned_data.get("category")
 
-        per_parcel = (total / parcels).quantize(Decimal("0.01")) if parcels > 1 else total
-
-        with db_transaction.atomic():
-            for i in range(1, parcels + 1):
-                charge_date = add_months(pdate, i - 1)
-                inv = Invoice.assign_invoice_for(card, charge_date)
-                if inv.status == Invoice.Status.CLOSED:
-                    inv = inv.next_invoice()
-                CardCharge.objects.create(
-                    card=card,
-                    invoice=inv,
-                    date=charge_date,
-                    description=description,
-                    total_amount=per_parcel,
-                    installment_number=i,
-                    installments_total=parcels,
-                    category=category,
-                )
+        # Verificado pelo valor comprometido já mantido no cartão, sem somar compras
+        if card.exceeds_limit(total):
+            messages.warning(
+                self.request,
+                f"Esta compra ultrapassa o limite disponível do cartão {card.name} "
+                f"(disponível: {card.available_limit()}).",
+            )
+        create_installment_purchase(card, pdate, description, total, parcels, category)
         messages.success(self.request, "Compra registrada com sucesso.")
         return super().form_valid(form)
 
@@ -1003,8 +1011,20 @@ class InvoiceListView(LoginRequiredMixin, generic.ListView):
         if status_param == "closed":
             qs = qs.filter(status__in=[Invoice.Status.CLOSED, Invoice.Status.PAID])
         else:
+            status_param = "open"
             qs = qs.filter(status__in=[Invoice.Status.OPEN, Invoice.Status.PARTIAL])
-        return qs.order_by('closing_date')
+        q = (self.request.GET.get("q") or "").strip()
+        if q:
+            # Faturas com alguma compra cuja descrição casa com a busca
+            qs = qs.filter(pk__in=filter_by_description(CardCharge.objects.all(), q).values("invoice_id"))
+        return cached(
+            self.request.user, "invoices", {"status": status_param, "q": q}, lambda: list(qs.order_by('closing_date'))
+        )
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx["q"] = self.request.GET.get("q", "")
+        return ctx
 
 
 class InvoiceDetailView(LoginRequiredMixin, generic.DetailView):
@@ -1014,6 +1034,13 @@ class InvoiceDetailView(LoginRequiredMixin, generic.DetailView):
     def get_queryset(self):
         return super().get_queryset().filter(card__user=self.request.user).select_related("card").prefetch_related("charges", "payments")
 
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        q = self.request.GET.get("q", "").strip()
+        ctx["q"] = q
+        ctx["charges"] = filter_by_description(self.object.charges.all(), q) if q else self.object.charges.all()
+        return ctx
+
 
 class InvoicePaymentCreateView(LoginRequiredMixin, generic.FormView):
     form_class = InvoicePaymentForm
@@ -1055,13 +1082,7 @@ class InvoicePaymentCreateView(LoginRequiredMixin, generic.FormView):
                     description=f"Pagamento fatura {inv.card.name} {inv.month:02d}/{inv.year}",
                     amount=amount,
                 )
-            # Atualiza status da fatura
-            bal = inv.balance()
-            if bal <= 0:
-                inv.status = Invoice.Status.PAID
-            elif amount > 0:
-                inv.status = Invoice.Status.PARTIAL
-            inv.save()
+            settle(inv)
         messages.success(self.request, "Pagamento registrado com sucesso." if kind != "DISCOUNT" else "Desconto registrado com sucesso.")
         return super().form_valid(form)
 
@@ -1161,18 +1182,7 @@ class InvoicePaymentUpdateView(LoginRequiredMixin, generic.FormView):
                         amount=amount,
                     )
 
-            # Recalcula status da fatura
-            inv.refresh_from_db()
-            bal = inv.balance()
-            if bal <= 0:
-                inv.status = Invoice.Status.PAID
-            elif inv.total_payments() > 0:
-                inv.status = Invoice.Status.PARTIAL
-            else:
-                # Se não há pagamentos, mantém OPEN/CLOSED conforme já estiver
-                if inv.status == Invoice.Status.PAID:
-                    inv.status = Invoice.Status.OPEN
-            inv.save()
+            settle(inv)
 
         messages.success(self.request, "Pagamento atualizado com sucesso.")
         return super().form_valid(form)
@@ -1225,18 +1235,7 @@ class InvoicePaymentDeleteView(LoginRequiredMixin, generic.DeleteView):
             # Exclui pagamento
             self.object.delete()
 
-            # Recalcula status da fatura
-            inv.refresh_from_db()
-            bal = inv.balance()
-            if bal <= 0 and inv.total_payments() > 0:
-                inv.status = Invoice.Status.PAID
-            elif inv.total_payments() > 0:
-                inv.status = Invoice.Status.PARTIAL
-            else:
-                # Se não há pagamentos, volta para OPEN se estava PAID
-                if inv.status in [Invoice.Status.PAID, Invoice.Status.PARTIAL]:
-                    inv.status = Invoice.Status.OPEN
-            inv.save()
+            settle(inv)
 
         messages.success(request, "Pagamento excluído com sucesso.")
         return HttpResponseRedirect(self.get_success_url())
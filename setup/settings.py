@@ -86,6 +86,23 @@ WSGI_APPLICATION = 'setup.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Cache das páginas do financeiro (dashboard, faturas e extrato), invalidado pela
+# versão dos dados de cada usuário. O LocMemCache descarta as entradas menos usadas
+# ao atingir MAX_ENTRIES; para compartilhar entre processos troque o BACKEND por
+# FileBasedCache ou DatabaseCache (com LOCATION apropriado).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'finance': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'finance',
+        'TIMEOUT': 3600,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+FINANCE_CACHE_ALIAS = 'finance'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',